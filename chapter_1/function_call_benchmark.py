@@ -0,0 +1,190 @@
+"""
+File: function_call_benchmark.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Compares two ways of answering a model that asks for several tool calls at once:
+the one-call-at-a-time flow (answer the first tool call, ask the model again, repeat) and the
+registry flow of `tool_registry.py` (run every tool call of the response in parallel and send
+all results in one follow-up request). Reports round trips to the model and wall time.
+
+By default the model is an offline stand-in with a fixed latency per request, so no API key is
+needed. Use `--live` to run both flows against OpenAI instead.
+
+Usage:
+1. Run `python3 function_call_benchmark.py --calls 4 --model-latency 0.8 --tool-latency 0.2`.
+2. Run `python3 function_call_benchmark.py --live --calls 3` to use gpt-4o-mini (needs OPENAI_API_KEY).
+"""
+
+import argparse
+import json
+import random
+import time
+from types import SimpleNamespace
+
+from tool_registry import ToolRegistry
+
+# Simulated duration of a tool call, set from the command line
+TOOL_LATENCY_SECONDS = [0.0]
+
+registry = ToolRegistry()
+
+
+@registry.tool
+def multiply(number1: int, number2: int) -> int:
+    """
+    Use this function to multiply two integers and return the result.
+
+    Args:
+        number1 (int): The first integer to multiply.
+        number2 (int): The second integer to multiply.
+
+    Returns:
+        int: The multiplication result of number1 and number2.
+    """
+    time.sleep(TOOL_LATENCY_SECONDS[0])
+    return number1 * number2
+
+
+class FakeChatClient:
+    """
+    Offline stand-in for `OpenAI()` answering like a model that needs one `multiply` call per
+    product in the question: it requests every product not answered yet, then replies in text.
+    """
+
+    def __init__(self, products: list, latency: float):
+        """
+        Parameters:
+        - products (list): (number1, number2) pairs the question asks about.
+        - latency (float): Seconds every request takes.
+        """
+        self.products = products
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model: str, messages: list, **kwargs):
+        time.sleep(self.latency)
+        answered = {
+            message["tool_call_id"]
+            for message in messages
+            if isinstance(message, dict) and message["role"] == "tool"
+        }
+        tool_calls = [
+            SimpleNamespace(
+                id=f"call_{index}",
+                type="function",
+                function=SimpleNamespace(
+                    name="multiply", arguments=json.dumps({"number1": number1, "number2": number2})
+                ),
+            )
+            for index, (number1, number2) in enumerate(self.products)
+            if f"call_{index}" not in answered
+        ]
+        if tool_calls and kwargs.get("tools"):
+            message = SimpleNamespace(role="assistant", content=None, tool_calls=tool_calls)
+        else:
+            message = SimpleNamespace(role="assistant", content="Done ✅", tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def _assistant_message(tool_call) -> dict:
+    """Assistant message carrying a single tool call, so the one-at-a-time flow stays valid."""
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
+            {
+                "id": tool_call.id,
+                "type": "function",
+                "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments},
+            }
+        ],
+    }
+
+
+def one_call_at_a_time(client, model: str, messages: list, max_rounds: int = 20) -> tuple:
+    """
+    Answers only the first tool call of every response and asks the model again.
+
+    Returns:
+    - tuple: (final answer, number of requests to the model).
+    """
+    for round_trips in range(1, max_rounds + 1):
+        response_message = client.chat.completions.create(
+            model=model, messages=messages, temperature=0, tools=registry.schemas(), tool_choice="auto"
+        ).choices[0].message
+        if not response_message.tool_calls:
+            return response_message.content, round_trips
+
+        tool_call = response_message.tool_calls[0]
+        messages.append(_assistant_message(tool_call))
+        messages.extend(registry.dispatch([tool_call]))
+    return None, max_rounds
+
+
+def all_calls_at_once(client, model: str, messages: list, max_rounds: int = 20) -> tuple:
+    """
+    Runs every tool call of a response in parallel and sends all results in one request.
+
+    Returns:
+    - tuple: (final answer, number of requests to the model).
+    """
+    for round_trips in range(1, max_rounds + 1):
+        response_message = client.chat.completions.create(
+            model=model, messages=messages, temperature=0, tools=registry.schemas(), tool_choice="auto"
+        ).choices[0].message
+        if not response_message.tool_calls:
+            return response_message.content, round_trips
+
+        messages.append(response_message)
+        messages.extend(registry.dispatch(response_message.tool_calls))
+    return None, max_rounds
+
+
+def main():
+    """
+    Parses the command line, runs both flows and prints round trips and wall time.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark one-at-a-time vs. batched tool calls.")
+    parser.add_argument("--calls", type=int, default=4, help="Products asked for (tool calls per question)")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per flow")
+    parser.add_argument("--model-latency", type=float, default=0.8, help="Offline model latency per request")
+    parser.add_argument("--tool-latency", type=float, default=0.2, help="Simulated duration of a tool call")
+    parser.add_argument("--live", action="store_true", help="Use OpenAI (gpt-4o-mini) instead of the offline model")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the numbers in the question")
+    args = parser.parse_args()
+    TOOL_LATENCY_SECONDS[0] = args.tool_latency
+
+    generator = random.Random(args.seed)
+    products = [
+        (generator.randint(1000, 9999999), generator.randint(1000, 9999999)) for _ in range(args.calls)
+    ]
+    question = "What are the multiplications of " + ", ".join(f"{a} * {b}" for a, b in products) + "?"
+
+    if args.live:
+        from dotenv import find_dotenv, load_dotenv
+        from openai import OpenAI
+
+        load_dotenv(find_dotenv())
+        client = OpenAI()
+    else:
+        client = FakeChatClient(products, args.model_latency)
+
+    for name, flow in (("one call at a time", one_call_at_a_time), ("all calls at once", all_calls_at_once)):
+        round_trips, seconds = [], []
+        for _ in range(args.repeats):
+            messages = [
+                {"role": "system", "content": "Respond short with emojis."},
+                {"role": "user", "content": question},
+            ]
+            started = time.perf_counter()
+            _, requests = flow(client, "gpt-4o-mini", messages)
+            seconds.append(time.perf_counter() - started)
+            round_trips.append(requests)
+        print(
+            f"{name:<20} round trips {sum(round_trips) / len(round_trips):5.1f}  "
+            f"wall time {sum(seconds) / len(seconds):7.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,8 @@ import os
 from dotenv import find_dotenv, load_dotenv
 from openai import OpenAI
 
+from response_cache import CachedOpenAI
+
 def main():
     """
     Main function to demonstrate how to interact with the OpenAI API.
@@ -30,8 +32,8 @@ def main():
     if not api_key:
         raise ValueError("OPENAI_API_KEY not found in the environment variables. Make sure to set it in your .env file.")
     
-    # Initialize the OpenAI client
-    client = OpenAI(api_key=api_key)
+    # Initialize the OpenAI client (temperature-0 requests are answered from the response cache)
+    client = CachedOpenAI(OpenAI(api_key=api_key))
     
     # Specify the model and user input
     model = "gpt-4o-mini"
@@ -54,5 +56,9 @@ def main():
     response_message = response.choices[0].message.content
     print(f"AI Response: {response_message}")
 
+    # Report how many requests were answered from the response cache
+    if client.cache is not None:
+        print(f"Response cache: {client.cache.stats()}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
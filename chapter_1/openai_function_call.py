@@ -3,31 +3,41 @@ File: openai_function_call.py
 Author: Sina Mehdinia
 Date: 01/26/2025
 Description: Demonstrates using OpenAI's function-calling feature with a custom Python function.
+The function is registered with `tool_registry.py`, which generates its JSON schema from the
+signature and runs every tool call of a response, so one follow-up request answers them all.
 
 Usage:
 1. Set up a .env file with your OpenAI API key.
 2. Run the script with `python3 openai_function_call.py`.
 """
 
-import json
 import os
 
 from dotenv import find_dotenv, load_dotenv
 from openai import OpenAI
 
+from response_cache import CachedOpenAI
+from tool_cache import memoize
+from tool_registry import ToolRegistry
 
-def multiply(parameters):
+# Functions the model may call
+registry = ToolRegistry()
+
+
+# `multiply` is pure, so repeated calls with the same numbers are answered from the cache
+@registry.tool
+@memoize
+def multiply(number1: int, number2: int) -> int:
     """
-    Custom function to multiply two integers.
+    Use this function to multiply two integers and return the result.
 
     Args:
-        parameters (dict): A dictionary containing two integers, "number1" and "number2".
+        number1 (int): The first integer to multiply.
+        number2 (int): The second integer to multiply.
 
     Returns:
         int: The multiplication result of number1 and number2.
     """
-    number1 = parameters["number1"]
-    number2 = parameters["number2"]
     return number1 * number2
 
 
@@ -38,7 +48,8 @@ def main():
     Learn how to:
     1. Load environment variables.
     2. Set up a custom function for the AI to use.
-    3. Interact with OpenAI's function-calling feature to execute the function.
+    3. Interact with OpenAI's function-calling feature to execute the function,
+       answering all tool calls of the response in one follow-up request.
     """
     # Load environment variables from .env file
     load_dotenv(find_dotenv())
@@ -48,39 +59,17 @@ def main():
     if not api_key:
         raise ValueError("OPENAI_API_KEY not found in the environment variables. Make sure to set it in your .env file.")
     
-    # Initialize the OpenAI client
-    client = OpenAI(api_key=api_key)
+    # Initialize the OpenAI client (temperature-0 requests are answered from the response cache)
+    client = CachedOpenAI(OpenAI(api_key=api_key))
     
     # Specify the model to use
     model = "gpt-4o-mini"
     
-    # Define tools (functions) for the model to use
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "multiply",
-                "description": "Use this function to multiply two integers and return the result.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "number1": {
-                            "type": "integer",
-                            "description": "The first integer to multiply.",
-                        },
-                        "number2": {
-                            "type": "integer",
-                            "description": "The second integer to multiply.",
-                        },
-                    },
-                    "required": ["number1", "number2"],
-                },
-            },
-        }
-    ]
+    # Define tools (functions) for the model to use, generated from the registered functions
+    tools = registry.schemas()
     
     # Define the user question
-    question = "What is the multiplication of 1248124 * 21421124?"
+    question = "What are the multiplications of 1248124 * 21421124 and 5821 * 9123?"
     
     # Set up conversation context
     messages = [
@@ -107,37 +96,24 @@ def main():
     # Check if the model's response includes a tool call
     tool_calls = response_message.tool_calls
     if tool_calls:
-        # Extract details about the tool call
-        tool_call_id = tool_calls[0].id
-        tool_function_name = tool_calls[0].function.name
-        tool_arguments = json.loads(tool_calls[0].function.arguments)
+        # Execute every tool call of the response (in parallel) and append all tool responses
+        messages.extend(registry.dispatch(tool_calls))
         
-        if tool_function_name == "multiply":
-            # Execute the multiply function
-            result = multiply(tool_arguments)
-            
-            # Append the tool response to the message history
-            messages.append(
-                {
-                    "role": "tool",
-                    "tool_call_id": tool_call_id,
-                    "name": tool_function_name,
-                    "content": str(result),
-                }
-            )
-            
-            # Get a new response from the model after the function result is provided
-            model_response_with_function_call = client.chat.completions.create(
-                model=model,
-                messages=messages,
-            )
-            print(f"AI Response: {model_response_with_function_call.choices[0].message.content}")
-        else:
-            print(f"Error: function {tool_function_name} does not exist")
+        # Get a new response from the model after all function results are provided
+        model_response_with_function_call = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0,
+        )
+        print(f"AI Response: {model_response_with_function_call.choices[0].message.content}")
     else:
         # If no tool was identified, print the initial response
         print(f"AI Response: {response_message.content}")
 
+    # Report how many requests were answered from the response cache
+    if client.cache is not None:
+        print(f"Response cache: {client.cache.stats()}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,225 @@
+"""
+File: response_cache.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Exact-match cache of model responses for deterministic (temperature 0) chat
+calls, kept in a local SQLite file with a size limit and least-recently-used eviction.
+The key covers the model, the messages, the tools and every other request parameter, so
+only identical requests share a response. Each hit counts the latency of the original
+call as saved. `CachedOpenAI` wraps the raw `OpenAI` client; chapter 2 installs the same
+cache for all LangChain chat models (see `chapter_2/langchain_response_cache.py`).
+
+Usage:
+1. Wrap the client: `client = CachedOpenAI(OpenAI(api_key=api_key))` and use it as before.
+2. Print `client.cache.stats()` (lookups, hit rate and seconds saved) at the end of a run.
+3. Set `RESPONSE_CACHE_PATH` to choose the file, `RESPONSE_CACHE_MAX_MB` to limit its size,
+   or `RESPONSE_CACHE_ENABLED=false` to always call the model.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+"""
+
+
+def _jsonable(value):
+    """Converts request values JSON cannot encode (e.g. SDK message objects) for the key."""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(exclude_none=True)
+    return repr(value)
+
+
+class ResponseCache:
+    """SQLite-backed exact-match response cache with size-limited LRU eviction."""
+
+    def __init__(self, path: str = "response_cache.sqlite3", max_bytes: int = 64 * 1024 * 1024):
+        """
+        Parameters:
+        - path (str): SQLite file holding the responses (shared by every script using it).
+        - max_bytes (int): Total response size kept before the least recently used are evicted.
+        """
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(_SCHEMA)
+        # Running total of the stored bytes, so writes do not have to sum the table
+        self._bytes = self._size()
+
+        # Counters of this process
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def make_key(namespace: str, request: dict) -> str:
+        """
+        Builds the key of a request.
+
+        Parameters:
+        - namespace (str): Client or model family, e.g. `openai` or LangChain's model description.
+        - request (dict): Model, messages, tools and parameters of the request.
+
+        Returns:
+        - str: SHA-256 of the namespace and the request serialized with sorted keys.
+        """
+        payload = json.dumps(request, sort_keys=True, separators=(",", ":"), default=_jsonable)
+        return hashlib.sha256(f"{namespace}\n{payload}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached response, or None on a miss."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, seconds FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            self.saved_seconds += row[1]
+            return row[0]
+
+    def set(self, key: str, value: str, seconds: float) -> None:
+        """
+        Stores a response and evicts the least recently used ones if the cache is full.
+
+        Parameters:
+        - key (str): Key built with `make_key`.
+        - value (str): Serialized response.
+        - seconds (float): How long the model call took, counted as saved on every hit.
+        """
+        now = time.time()
+        with self._lock:
+            # A replaced response no longer counts towards the total
+            row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, value, len(value), seconds, now, now),
+            )
+            self._bytes += len(value) - (row[0] if row else 0)
+            if self._bytes <= self.max_bytes:
+                return
+
+            # Other scripts may share the file, so re-read the total before evicting
+            self._bytes = self._size()
+            if self._bytes <= self.max_bytes:
+                return
+
+            # Walk entries from least to most recently used until enough space is freed
+            excess = self._bytes - self.max_bytes
+            stale_keys = []
+            for stale_key, size in self._db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at"
+            ):
+                stale_keys.append((stale_key,))
+                self._bytes -= size
+                excess -= size
+                if excess <= 0:
+                    break
+            self._db.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+
+    def clear(self) -> None:
+        """Removes every cached response."""
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._bytes = 0
+
+    def _size(self) -> int:
+        """Sums the size of the stored responses."""
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of this process and the size of the cache.
+
+        Returns:
+        - dict: Lookups, hits, misses, hit rate, seconds saved, entries and bytes stored.
+        """
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "lookups": lookups,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+def default_response_cache() -> Optional[ResponseCache]:
+    """Returns the cache configured by the `RESPONSE_CACHE_*` variables, None if disabled."""
+    if os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    return ResponseCache(
+        os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3"),
+        int(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024,
+    )
+
+
+class _CachedCompletions:
+    """`client.chat.completions` answering temperature-0 requests from the cache."""
+
+    def __init__(self, completions, cache: ResponseCache):
+        self._completions = completions
+        self._cache = cache
+
+    def create(self, **kwargs):
+        # Only deterministic requests return the same response every time
+        if kwargs.get("temperature") != 0 or kwargs.get("stream"):
+            return self._completions.create(**kwargs)
+
+        from openai.types.chat import ChatCompletion
+
+        key = ResponseCache.make_key("openai.chat.completions", kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return ChatCompletion.model_validate_json(cached)
+
+        started = time.perf_counter()
+        response = self._completions.create(**kwargs)
+        self._cache.set(key, response.model_dump_json(), time.perf_counter() - started)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+
+class CachedOpenAI:
+    """Wrapper of an `OpenAI` client whose temperature-0 chat completions are cached."""
+
+    def __init__(self, client, cache: Optional[ResponseCache] = None):
+        """
+        Parameters:
+        - client (OpenAI): The client to wrap.
+        - cache (ResponseCache | None): Cache to use, defaults to `default_response_cache()`.
+        """
+        self._client = client
+        self.cache = cache or default_response_cache()
+        completions = client.chat.completions
+        if self.cache is not None:
+            completions = _CachedCompletions(completions, self.cache)
+        self.chat = SimpleNamespace(completions=completions)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
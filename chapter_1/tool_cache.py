@@ -0,0 +1,240 @@
+"""
+File: tool_cache.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Opt-in memoization of deterministic tools. A decorated function is looked up
+by its canonicalized arguments (positional or keyword, defaults filled in) in a bounded
+in-memory LRU with a time-to-live, optionally backed by a bounded SQLite file that keeps
+results across runs; only misses run the function body. Calls whose arguments are not
+JSON-serializable always run the function. Hits and misses are counted per tool.
+
+The decorator wraps the plain function, so it works under both `@registry.tool`
+(`tool_registry.py`, the raw OpenAI tool loop) and LangChain's `@tool` (chapter 2), where
+`tool.invoke(tool_call)` returns a cached result without running the tool.
+
+Usage:
+1. Decorate a pure function: `@memoize` (shared default cache) or `@memoize(cache=ToolCache(...))`,
+   placed below the tool decorator, e.g. `@registry.tool` then `@memoize` then `def multiply(...)`.
+2. Set `TOOL_CACHE_PATH=tool_cache.sqlite3` to give the default cache a persistent disk tier,
+   holding at most `TOOL_CACHE_MAX_DISK_ITEMS` results (default 100000).
+3. Read the per-tool statistics with `default_cache.stats()` (or `multiply.cache.stats()`).
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tool_results (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tool_results_expires ON tool_results (expires_at);
+"""
+
+
+def canonical_key(function, args: tuple, kwargs: dict) -> Optional[str]:
+    """
+    Returns the cache key of a call: the function's qualified name and its arguments bound to
+    the signature (so `f(1, b=2)` and `f(a=1, b=2)` match), serialized as sorted-key JSON.
+    Returns None if an argument is not JSON-serializable: its `repr` may be the same for
+    different objects (e.g. a reused memory address), so such calls are not cached.
+    """
+    bound = inspect.signature(function).bind(*args, **kwargs)
+    bound.apply_defaults()
+    try:
+        arguments = json.dumps(bound.arguments, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+    digest = hashlib.sha256(arguments.encode("utf-8")).hexdigest()
+    return f"{function.__module__}.{function.__qualname__}:{digest}"
+
+
+class ToolCache:
+    """Bounded LRU of tool results with a time-to-live and an optional SQLite tier."""
+
+    def __init__(
+        self, max_items: int = 1024, ttl_seconds: float = 3600, path: str = None, max_disk_items: int = 100000
+    ):
+        """
+        Parameters:
+        - max_items (int): Results kept in memory, least recently used ones are dropped first.
+        - ttl_seconds (float): How long a result stays valid.
+        - path (str | None): SQLite file keeping results across runs, None for memory only.
+        - max_disk_items (int): Results kept in the SQLite file; expired ones are pruned first,
+          then those expiring soonest.
+        """
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_items = max_disk_items
+        self._items = OrderedDict()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            self._disk_items = self._db.execute("SELECT COUNT(*) FROM tool_results").fetchone()[0]
+
+    def _count(self, tool: str, outcome: str) -> None:
+        counts = self._stats.setdefault(tool, {"hits": 0, "disk_hits": 0, "misses": 0, "uncacheable": 0})
+        counts[outcome] += 1
+
+    def skip(self, tool: str) -> None:
+        """Counts a call that ran without the cache because its arguments have no key."""
+        with self._lock:
+            self._count(tool, "uncacheable")
+
+    def get(self, tool: str, key: str) -> tuple:
+        """
+        Looks a result up in memory, then on disk.
+
+        Returns:
+        - tuple: (True, value) on a hit, (False, None) on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry[0] > now:
+                self._items.move_to_end(key)
+                self._count(tool, "hits")
+                return True, entry[1]
+            self._items.pop(key, None)
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM tool_results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self._count(tool, "disk_hits")
+                    return True, value
+                if row is not None:
+                    self._disk_items -= self._db.execute(
+                        "DELETE FROM tool_results WHERE key = ?", (key,)
+                    ).rowcount
+            self._count(tool, "misses")
+            return False, None
+
+    def _remember(self, key: str, value, expires_at: float) -> None:
+        self._items[key] = (expires_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def put(self, key: str, value, ttl_seconds: float = None) -> None:
+        """Stores a result in memory and, if it is JSON-serializable, on disk."""
+        expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                try:
+                    serialized = json.dumps(value)
+                except TypeError:
+                    return
+                replaced = self._db.execute("SELECT 1 FROM tool_results WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO tool_results VALUES (?, ?, ?)", (key, serialized, expires_at)
+                )
+                if replaced is None:
+                    self._disk_items += 1
+                if self._disk_items > self.max_disk_items:
+                    self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """Deletes expired results, then those expiring soonest until under `max_disk_items`."""
+        self._db.execute("DELETE FROM tool_results WHERE expires_at <= ?", (time.time(),))
+        # Re-read the count, other processes may share the file
+        self._disk_items = self._db.execute("SELECT COUNT(*) FROM tool_results").fetchone()[0]
+        excess = self._disk_items - self.max_disk_items
+        if excess > 0:
+            self._disk_items -= self._db.execute(
+                "DELETE FROM tool_results WHERE key IN "
+                "(SELECT key FROM tool_results ORDER BY expires_at LIMIT ?)",
+                (excess,),
+            ).rowcount
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counts per tool.
+
+        Returns:
+        - dict: Tool name -> `hits` (memory), `disk_hits`, `misses`, `uncacheable` (calls whose
+          arguments are not JSON-serializable, run without the cache) and `hit_rate`.
+        """
+        with self._lock:
+            stats = {tool: dict(counts) for tool, counts in self._stats.items()}
+        for counts in stats.values():
+            lookups = counts["hits"] + counts["disk_hits"] + counts["misses"]
+            counts["hit_rate"] = (counts["hits"] + counts["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+# Cache used by `@memoize` without arguments, on disk if `TOOL_CACHE_PATH` is set
+default_cache = ToolCache(
+    path=os.getenv("TOOL_CACHE_PATH") or None,
+    max_disk_items=int(os.getenv("TOOL_CACHE_MAX_DISK_ITEMS", "100000")),
+)
+
+
+def memoize(function=None, *, cache: ToolCache = None, ttl_seconds: float = None):
+    """
+    Decorator caching the results of a deterministic function by its arguments.
+
+    Parameters:
+    - function (callable | None): The function, when used as `@memoize` without arguments.
+    - cache (ToolCache | None): Cache to use, defaults to `default_cache`.
+    - ttl_seconds (float | None): Time-to-live of this function's results, defaults to the cache's.
+
+    Returns:
+    - callable: The wrapped function (sync or async, like the original), with its `cache` attached.
+    """
+    if function is None:
+        return lambda function: memoize(function, cache=cache, ttl_seconds=ttl_seconds)
+    cache = cache or default_cache
+    name = function.__name__
+
+    if inspect.iscoroutinefunction(function):
+
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            key = canonical_key(function, args, kwargs)
+            if key is None:
+                cache.skip(name)
+                return await function(*args, **kwargs)
+            hit, value = cache.get(name, key)
+            if hit:
+                return value
+            value = await function(*args, **kwargs)
+            cache.put(key, value, ttl_seconds)
+            return value
+
+        async_wrapper.cache = cache
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        key = canonical_key(function, args, kwargs)
+        if key is None:
+            cache.skip(name)
+            return function(*args, **kwargs)
+        hit, value = cache.get(name, key)
+        if hit:
+            return value
+        value = function(*args, **kwargs)
+        cache.put(key, value, ttl_seconds)
+        return value
+
+    wrapper.cache = cache
+    return wrapper
@@ -0,0 +1,152 @@
+"""
+File: tool_registry.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Decorator-based registry of Python functions exposed to OpenAI's function
+calling. The JSON schema of every tool is generated from its signature and docstring once
+per process and then reused, and all tool calls of a response are parsed and executed
+(in parallel) so their results can go back to the model in a single follow-up request.
+
+Usage:
+1. Create a registry with `registry = ToolRegistry()` and decorate functions with `@registry.tool`.
+2. Pass `tools=registry.schemas()` to `client.chat.completions.create(...)`.
+3. Append `registry.dispatch(response_message.tool_calls)` to the messages and call the model again.
+"""
+
+import inspect
+import json
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# JSON schema types of the Python annotations supported in tool signatures
+_JSON_TYPES = {
+    int: "integer",
+    float: "number",
+    str: "string",
+    bool: "boolean",
+    list: "array",
+    dict: "object",
+}
+
+
+def _parse_docstring(docstring: str) -> tuple:
+    """
+    Splits a docstring into its description (first paragraph) and the argument
+    descriptions listed under `Args:` as `name (type): description`.
+    """
+    text = inspect.cleandoc(docstring or "")
+    description = text.split("\n\n")[0].replace("\n", " ").strip()
+
+    arguments = {}
+    in_args = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped == "Args:":
+            in_args = True
+        elif in_args and stripped.endswith(":") and " " not in stripped:
+            # Next section, e.g. `Returns:`
+            in_args = False
+        elif in_args and ":" in stripped:
+            name, _, argument_description = stripped.partition(":")
+            arguments[name.split("(")[0].strip()] = argument_description.strip()
+    return description, arguments
+
+
+def _type_schema(annotation) -> dict:
+    """JSON schema of a parameter annotation, describing the items of lists too."""
+    # Optional[X] is X that may be left out
+    if typing.get_origin(annotation) is typing.Union:
+        annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+    schema = {"type": _JSON_TYPES.get(typing.get_origin(annotation) or annotation, "string")}
+    if schema["type"] == "array":
+        # OpenAI rejects arrays without `items`; a bare `list` accepts any item
+        item_types = typing.get_args(annotation)
+        schema["items"] = _type_schema(item_types[0]) if item_types else {}
+    return schema
+
+
+@lru_cache(maxsize=None)
+def function_schema(function) -> dict:
+    """
+    Builds the OpenAI tool schema of a function from its signature and docstring
+    (cached, so each function's schema is generated once per process).
+
+    Parameters:
+    - function (callable): Function with annotated parameters.
+
+    Returns:
+    - dict: Tool definition in the `{"type": "function", "function": {...}}` format.
+    """
+    description, argument_descriptions = _parse_docstring(function.__doc__)
+    hints = typing.get_type_hints(function)
+
+    properties = {}
+    required = []
+    for name, parameter in inspect.signature(function).parameters.items():
+        properties[name] = _type_schema(hints.get(name, str))
+        if name in argument_descriptions:
+            properties[name]["description"] = argument_descriptions[name]
+        if parameter.default is inspect.Parameter.empty:
+            required.append(name)
+
+    return {
+        "type": "function",
+        "function": {
+            "name": function.__name__,
+            "description": description,
+            "parameters": {"type": "object", "properties": properties, "required": required},
+        },
+    }
+
+
+class ToolRegistry:
+    """Functions the model may call, by name, with their cached JSON schemas."""
+
+    def __init__(self, max_workers: int = 8):
+        """
+        Parameters:
+        - max_workers (int): Tool calls of one response executed at the same time.
+        """
+        self.functions = {}
+        self.max_workers = max_workers
+        self._schemas = None
+
+    def tool(self, function):
+        """Decorator registering a function as a tool, returned unchanged."""
+        self.functions[function.__name__] = function
+        self._schemas = None
+        return function
+
+    def schemas(self) -> list:
+        """Returns the tool definitions to pass as `tools=` (built once, then reused)."""
+        if self._schemas is None:
+            self._schemas = [function_schema(function) for function in self.functions.values()]
+        return self._schemas
+
+    def _call(self, tool_call) -> dict:
+        """Runs one tool call and returns its tool message; errors are reported to the model."""
+        name = tool_call.function.name
+        function = self.functions.get(name)
+        try:
+            if function is None:
+                raise ValueError(f"function {name} does not exist")
+            content = str(function(**json.loads(tool_call.function.arguments or "{}")))
+        except Exception as exc:
+            content = f"Error: {exc}"
+        return {"role": "tool", "tool_call_id": tool_call.id, "name": name, "content": content}
+
+    def dispatch(self, tool_calls: list) -> list:
+        """
+        Runs every tool call of a response, in parallel when there are several.
+
+        Parameters:
+        - tool_calls (list): The `tool_calls` of the model's message.
+
+        Returns:
+        - list: One tool message per call, in the order of the calls.
+        """
+        if len(tool_calls) <= 1:
+            return [self._call(tool_call) for tool_call in tool_calls]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tool_calls))) as executor:
+            return list(executor.map(self._call, tool_calls))
@@ -0,0 +1,304 @@
+"""
+File: bulk_runner.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Sends a large set of prompts to one or more chat providers and writes every
+answer to a JSONL file as soon as it arrives. Each provider has its own concurrency limit
+(a fixed pool of workers calling `ainvoke`), and all providers run at the same time. The
+output file is also the checkpoint: a rerun skips the prompts already answered by a
+provider and retries the failed ones, so an interrupted run resumes where it stopped.
+At the end the runner reports throughput and p50/p95/p99 latency per provider.
+
+Input lines are JSON objects with a `prompt` (or `question`) and an optional `id` (the line
+number otherwise) and `system` message. Output lines carry `id`, `provider`, `model`,
+`response` (or `error`), `latency_seconds` and `usage` when the provider reports it.
+
+Usage:
+1. Write the prompts, e.g. `{"id": "q1", "prompt": "What is 1248124 * 21421124?"}` per line.
+2. Run `python3 bulk_runner.py prompts.jsonl results.jsonl --providers openai,anthropic,ollama`.
+   Use `provider:model` to pick another model, e.g. `--providers openai:gpt-4o`.
+3. Override the default concurrency limits with e.g. `--concurrency openai=32,ollama=4`.
+4. Rerun the same command after an interruption or failures; answered prompts are skipped.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from dotenv import find_dotenv, load_dotenv
+
+from chat_providers import PROVIDERS, make_chat_model
+from langchain_response_cache import install_response_cache
+
+
+def read_prompts(path: str) -> list:
+    """
+    Reads the prompts of a JSONL file.
+
+    Returns:
+    - list: Dicts with `id` (str), `prompt` and `system` (None to use the default).
+    """
+    prompts = []
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            prompt = record.get("prompt", record.get("question"))
+            if prompt is None:
+                raise ValueError(f"{path}:{line_number} has no prompt or question")
+            prompts.append(
+                {
+                    "id": str(record.get("id", line_number)),
+                    "prompt": prompt,
+                    "system": record.get("system"),
+                }
+            )
+    return prompts
+
+
+def read_checkpoint(path: str) -> set:
+    """
+    Collects the prompts already answered in an earlier run of the same output file.
+
+    Returns:
+    - set: (provider, model, id) of the prompts with a response; failed ones are left out to be retried.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line cut short by an interruption
+                continue
+            if record.get("error") is None:
+                done.add((record["provider"], record["model"], record["id"]))
+    return done
+
+
+def parse_providers(text: str) -> list:
+    """Parses `openai,anthropic:claude-3-5-sonnet-latest` into (provider, model) pairs."""
+    providers = []
+    for item in text.split(","):
+        name, _, model = item.strip().partition(":")
+        if name not in PROVIDERS:
+            raise ValueError(f"Unknown provider {name}, expected one of: {', '.join(PROVIDERS)}")
+        providers.append((name, model or PROVIDERS[name]["model"]))
+    return providers
+
+
+def parse_concurrency(text: str) -> dict:
+    """Parses `openai=32,ollama=4` into a provider -> limit dict."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, limit = item.partition("=")
+        limits[name] = int(limit)
+    return limits
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Returns the given percentile of a list of numbers (nearest rank)."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ResultWriter:
+    """Appends result lines to the output file, flushed one by one so none is lost on interruption."""
+
+    def __init__(self, path: str):
+        """
+        Parameters:
+        - path (str): Output JSONL file, created if missing and appended to otherwise.
+        """
+        # Start on a new line if the previous run stopped in the middle of one
+        cut_short = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                cut_short = file.read(1) != b"\n"
+        self._file = open(path, "a", encoding="utf-8")
+        if cut_short:
+            self._file.write("\n")
+        self.written = 0
+
+    def write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.written += 1
+
+    def close(self) -> None:
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+async def run_provider(
+    provider: str,
+    model_name: str,
+    model,
+    prompts: list,
+    system: str,
+    concurrency: int,
+    writer: ResultWriter,
+) -> dict:
+    """
+    Sends the prompts to one provider with at most `concurrency` requests in flight.
+
+    Steps:
+    1. Starts `concurrency` workers that take the next prompt from a shared queue, call
+       `ainvoke` and write the result (or the error) as soon as it arrives.
+    2. Returns the counts and latencies of the run.
+
+    Parameters:
+    - provider (str): Provider name (see `chat_providers.py`).
+    - model_name (str): Model to use.
+    - model (BaseChatModel): The provider's chat model, built with `make_chat_model`.
+    - prompts (list): Prompts not answered yet by this provider.
+    - system (str): System message for prompts without their own.
+    - concurrency (int): Maximum number of requests in flight.
+    - writer (ResultWriter): Where results are written.
+
+    Returns:
+    - dict: `ok` and `failed` counts, `latencies` of the answered prompts and `seconds` of wall time.
+    """
+    queue = asyncio.Queue()
+    for prompt in prompts:
+        queue.put_nowait(prompt)
+    stats = {"ok": 0, "failed": 0, "latencies": [], "seconds": 0.0}
+
+    async def worker():
+        while not queue.empty():
+            prompt = queue.get_nowait()
+            messages = [("system", prompt["system"] or system), ("user", prompt["prompt"])]
+            record = {"id": prompt["id"], "provider": provider, "model": model_name}
+            started = time.perf_counter()
+            try:
+                response = await model.ainvoke(messages)
+                record["response"] = response.content
+                record["usage"] = getattr(response, "usage_metadata", None)
+                stats["ok"] += 1
+                stats["latencies"].append(time.perf_counter() - started)
+            except Exception as exc:
+                record["error"] = f"{type(exc).__name__}: {exc}"
+                stats["failed"] += 1
+            record["latency_seconds"] = round(time.perf_counter() - started, 3)
+            writer.write(record)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(prompts)))))
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def report(results: dict, skipped: dict) -> dict:
+    """
+    Prints throughput and latency percentiles per provider and model.
+
+    Returns:
+    - dict: The printed numbers by `provider:model` (latencies in seconds).
+    """
+    summary = {}
+    for label, stats in results.items():
+        if isinstance(stats, BaseException):
+            # The provider's run stopped early; its answers so far are in the output file
+            summary[label] = {"skipped": skipped[label], "error": f"{type(stats).__name__}: {stats}"}
+            print(f"{label:<32} stopped by {summary[label]['error']}")
+            continue
+        latencies = stats["latencies"]
+        summary[label] = {
+            "ok": stats["ok"],
+            "failed": stats["failed"],
+            "skipped": skipped[label],
+            "seconds": round(stats["seconds"], 3),
+            "prompts_per_second": stats["ok"] / stats["seconds"] if stats["seconds"] else 0.0,
+            "latency_seconds": {
+                f"p{int(q * 100)}": percentile(latencies, q) for q in (0.5, 0.95, 0.99)
+            } if latencies else {},
+        }
+        line = (
+            f"{label:<32} ok {stats['ok']:<7} failed {stats['failed']:<5} skipped {skipped[label]:<7} "
+            f"{summary[label]['prompts_per_second']:8.2f} prompts/s"
+        )
+        for name, seconds in summary[label]["latency_seconds"].items():
+            line += f" {name}={seconds * 1000:.0f}ms"
+        print(line)
+    return summary
+
+
+async def main_async(args) -> dict:
+    """
+    Reads the prompts and the checkpoint, runs all providers concurrently and reports.
+    Every chat model is built before any prompt is sent, so a missing API key or package
+    stops the run up front; a provider failing during the run is reported without
+    cancelling the others.
+    """
+    providers = parse_providers(args.providers)
+    limits = parse_concurrency(args.concurrency)
+    prompts = read_prompts(args.input)
+    done = read_checkpoint(args.output)
+
+    models, errors = {}, []
+    for provider, model_name in providers:
+        try:
+            models[provider, model_name] = make_chat_model(provider, model_name)
+        except Exception as exc:
+            errors.append(f"{provider}:{model_name}: {exc}")
+    if errors:
+        raise SystemExit("Could not create the chat models:\n" + "\n".join(errors))
+
+    writer = ResultWriter(args.output)
+    tasks, skipped = {}, {}
+    try:
+        for provider, model_name in providers:
+            label = f"{provider}:{model_name}"
+            pending = [prompt for prompt in prompts if (provider, model_name, prompt["id"]) not in done]
+            skipped[label] = len(prompts) - len(pending)
+            concurrency = limits.get(provider, PROVIDERS[provider]["concurrency"])
+            print(f"{label}: {len(pending)} prompts to send, {skipped[label]} already answered")
+            tasks[label] = run_provider(
+                provider, model_name, models[provider, model_name], pending, args.system, concurrency, writer
+            )
+        results = dict(zip(tasks, await asyncio.gather(*tasks.values(), return_exceptions=True)))
+    finally:
+        writer.close()
+    return report(results, skipped)
+
+
+def main():
+    """
+    Parses the command line and runs the prompts; rerun the same command to resume.
+    """
+    parser = argparse.ArgumentParser(description="Send prompts from a JSONL file to several chat providers.")
+    parser.add_argument("input", help="JSONL file with one prompt per line")
+    parser.add_argument("output", help="JSONL file receiving the results, also used to resume")
+    parser.add_argument("--providers", default="openai", help="Providers, e.g. openai,ollama:llama3.2")
+    parser.add_argument("--concurrency", default="", help="Per-provider limits, e.g. openai=32,ollama=4")
+    parser.add_argument("--system", default="Respond short with emojis.", help="Default system message")
+    parser.add_argument("--report", help="Also write the per-provider report to this JSON file")
+    args = parser.parse_args()
+
+    # Load environment variables from .env file
+    load_dotenv(find_dotenv())
+
+    # Answer repeated temperature-0 requests from the shared response cache
+    response_cache = install_response_cache()
+
+    try:
+        summary = asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        print(f"Interrupted, rerun the same command to resume from {args.output}")
+        return
+
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.stats()}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+File: chat_providers.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Shared factory for the LangChain chat models of this chapter (OpenAI,
+Anthropic, Gemini and Llama via Ollama). It knows each provider's integration package,
+default model, API key variable and a default concurrency limit for bulk runs. The
+integration package is only imported when its provider is used, so a script needs just
+the packages of the providers it calls.
+
+Usage:
+1. Load the `.env` file, then call e.g. `model = make_chat_model("anthropic")`, or
+   `make_chat_model("openai", "gpt-4o")` for another model.
+2. `PROVIDERS` lists the provider names accepted by `make_chat_model`.
+"""
+
+import importlib
+import os
+from typing import Optional
+
+# Provider name -> integration package and class, default model, API key variable
+# (None for local models) and default number of requests in flight in bulk runs
+PROVIDERS = {
+    "openai": {
+        "module": "langchain_openai",
+        "class": "ChatOpenAI",
+        "model": "gpt-4o-mini",
+        "api_key": "OPENAI_API_KEY",
+        "concurrency": 16,
+    },
+    "anthropic": {
+        "module": "langchain_anthropic",
+        "class": "ChatAnthropic",
+        "model": "claude-3-5-haiku-latest",
+        "api_key": "ANTHROPIC_API_KEY",
+        "concurrency": 8,
+    },
+    "gemini": {
+        "module": "langchain_google_genai",
+        "class": "ChatGoogleGenerativeAI",
+        "model": "gemini-2.0-flash",
+        "api_key": "GOOGLE_API_KEY",
+        "concurrency": 8,
+    },
+    "ollama": {
+        "module": "langchain_ollama",
+        "class": "ChatOllama",
+        "model": "llama3.1:latest",
+        "api_key": None,
+        "concurrency": 2,
+    },
+}
+
+
+def make_chat_model(provider: str, model: Optional[str] = None, temperature: float = 0, **kwargs):
+    """
+    Creates the LangChain chat model of a provider.
+
+    Steps:
+    1. Looks the provider up in `PROVIDERS`.
+    2. Checks that its API key is set in the environment.
+    3. Imports its integration package and creates the model.
+
+    Parameters:
+    - provider (str): One of `PROVIDERS` (`openai`, `anthropic`, `gemini`, `ollama`).
+    - model (str | None): Model name, defaults to the provider's default model.
+    - temperature (float): Sampling temperature; 0 keeps answers reproducible and cacheable.
+    - **kwargs: Extra arguments for the model class (e.g. `max_retries`).
+
+    Returns:
+    - BaseChatModel: The chat model.
+    """
+    settings = PROVIDERS.get(provider)
+    if settings is None:
+        raise ValueError(f"Unknown provider {provider}, expected one of: {', '.join(PROVIDERS)}")
+
+    # Get the API key from environment variables
+    api_key = settings["api_key"]
+    if api_key and not os.getenv(api_key):
+        raise ValueError(
+            f"{api_key} not found in the environment variables. Make sure to set it in your .env file."
+        )
+
+    chat_class = getattr(importlib.import_module(settings["module"]), settings["class"])
+    return chat_class(model=model or settings["model"], temperature=temperature, **kwargs)
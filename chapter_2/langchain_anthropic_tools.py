@@ -10,12 +10,17 @@ Usage:
 2. Run the script with `python3 langchain_anthropic_tools.py`.
 """
 
-import os
-
 from dotenv import find_dotenv, load_dotenv
-from langchain_anthropic import ChatAnthropic
 from langchain_core.tools import tool
 
+from chat_providers import make_chat_model
+from langchain_response_cache import install_response_cache
+from shared_modules import import_from_chapter_1
+from tool_engine import ToolEngine, print_turns
+
+# The memoization decorator for pure tools is shared with chapter 1's raw OpenAI tool loop
+memoize = import_from_chapter_1("tool_cache").memoize
+
 
 def main():
     """
@@ -26,24 +31,21 @@ def main():
     1. Load environment variables.
     2. Initialize Anthropic model via LangChain.
     3. Bind tools to the model.
-    4. Send a user query and handle tool calls.
+    4. Send a user query and run the tool calls until the model answers.
     """
 
     # Load environment variables from .env file
     load_dotenv(find_dotenv())
 
-    # Get the API key from environment variables
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    if not api_key:
-        raise ValueError(
-            "ANTHROPIC_API_KEY not found in the environment variables. Make sure to set it in your .env file."
-        )
+    # Answer repeated temperature-0 requests from the shared response cache
+    response_cache = install_response_cache()
 
-    # Initialize the Anthropic model via LangChain
-    model = ChatAnthropic(model="claude-3-5-haiku-latest", temperature=0)
+    # Initialize the Anthropic model via LangChain (the shared factory checks the API key)
+    model = make_chat_model("anthropic")
 
-    # Register the custom function as a langchain tool
+    # Register the custom function as a langchain tool (pure, so its results are cached)
     @tool
+    @memoize
     def multiply(a: int, b: int) -> int:
         """Multiplies a and b."""
         return a * b
@@ -55,7 +57,7 @@ def main():
     model_with_tools = model.bind_tools(tools)
 
     # Define the user question
-    question = "What is the multiplication of 1248124 * 21421124?"
+    question = "What are the multiplications of 1248124 * 21421124 and 5821 * 9123?"
 
     # Set up conversation context (LangChain format)
     messages = [
@@ -63,32 +65,18 @@ def main():
         ("user", question),
     ]
 
-    # Call the model with tools enabled
-    response_message = model_with_tools.invoke(messages)
-
-    # Check if the model's response includes a tool call
-    if response_message.tool_calls:
-        # Append model's response to the conversation history
-        messages.append(response_message)
-
-        for tool_call in response_message.tool_calls:
-            tool_name = tool_call["name"]
-
-            # Check if the requested tool exists
-            if tool_name == "multiply":
-                # Execute the multiply function using LangChain's native tool execution
-                tool_result = multiply.invoke(tool_call)
-
-                # Append the tool response to the message history
-                messages.append(tool_result)
+    # Call the model with tools enabled until it stops calling tools; the independent
+    # tool calls of each turn run concurrently (see `tool_engine.py`)
+    engine = ToolEngine(tools, timeout_seconds=10)
+    final_response, turns = engine.run(model_with_tools, messages, max_iterations=5)
 
-        # Get a new response from the model after the function result is provided
-        final_response = model_with_tools.invoke(messages)
-        print(f"AI Response: {final_response.content}")
+    # Show where the time went, then the model's answer
+    print_turns(turns)
+    print(f"AI Response: {final_response.content}")
 
-    else:
-        # If no tool was identified, print the initial response
-        print(f"AI Response: {response_message.content}")
+    # Report how many requests were answered from the response cache
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.stats()}")
 
 
 if __name__ == "__main__":
@@ -9,10 +9,10 @@ Usage:
 2. Run the script with `python3 langchain_openai_basic.py`.
 """
 
-import os
-
 from dotenv import find_dotenv, load_dotenv
-from langchain_openai import ChatOpenAI
+
+from chat_providers import make_chat_model
+from langchain_response_cache import install_response_cache
 
 
 def main():
@@ -28,15 +28,11 @@ def main():
     # Load environment variables from .env file
     load_dotenv(find_dotenv())
 
-    # Get the API key from environment variables
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise ValueError(
-            "OPENAI_API_KEY not found in the environment variables. Make sure to set it in your .env file."
-        )
+    # Answer repeated temperature-0 requests from the shared response cache
+    response_cache = install_response_cache()
 
-    # Initialize the OpenAI model via LangChain
-    model = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+    # Initialize the OpenAI model via LangChain (the shared factory checks the API key)
+    model = make_chat_model("openai")
 
     # Define user query
     question = "What is the multiplication of 1248124 * 21421124?"
@@ -53,6 +49,10 @@ def main():
     # Print the response
     print(f"AI Response: {response.content}")
 
+    # Report how many requests were answered from the response cache
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.stats()}")
+
 
 if __name__ == "__main__":
     main()
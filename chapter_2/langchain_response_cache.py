@@ -0,0 +1,117 @@
+"""
+File: langchain_response_cache.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Installs the exact-match response cache of `chapter_1/response_cache.py` as
+LangChain's global LLM cache, so every chat model (OpenAI, Anthropic, Gemini, Ollama)
+answers repeated temperature-0 requests from the same SQLite file. LangChain hands the
+cache the serialized messages and a description of the model that includes its parameters
+and bound tools, so both are part of the key. Requests with a nonzero or unknown
+temperature are never cached.
+
+Usage:
+1. Call `response_cache = install_response_cache()` before invoking the models.
+2. Print `response_cache.stats()` (lookups, hit rate and seconds saved) at the end of a run.
+3. The `RESPONSE_CACHE_*` variables of `chapter_1/response_cache.py` apply here as well.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from langchain_core.caches import BaseCache
+from langchain_core.globals import set_llm_cache
+from langchain_core.load import dumps, loads
+
+from shared_modules import import_from_chapter_1
+
+# The cache itself is shared with chapter 1's raw OpenAI client
+_chapter_1_cache = import_from_chapter_1("response_cache")
+ResponseCache = _chapter_1_cache.ResponseCache
+default_response_cache = _chapter_1_cache.default_response_cache
+
+# `"temperature": 0.0` in the serialized model or `('temperature', 0.0)` in its parameters
+_TEMPERATURE = re.compile(r"""['"]temperature['"]\s*[:,]\s*(-?[0-9.]+)""")
+
+
+def _is_deterministic(llm_string: str) -> bool:
+    """True if the model description sets a temperature and every mention of it is 0."""
+    temperatures = _TEMPERATURE.findall(llm_string)
+    return bool(temperatures) and all(float(temperature) == 0 for temperature in temperatures)
+
+
+class LangChainResponseCache(BaseCache):
+    """LangChain cache storing the generations of temperature-0 calls in a `ResponseCache`."""
+
+    def __init__(self, cache: ResponseCache, max_pending: int = 1024):
+        """
+        Parameters:
+        - cache (ResponseCache): Where the generations are stored.
+        - max_pending (int): Requests whose start time is kept until `update`; the oldest are
+          dropped first, since a model call that fails never reaches `update`.
+        """
+        self.cache = cache
+        self.max_pending = max_pending
+        # Key -> start times of the calls that missed, oldest first, so concurrent identical
+        # requests each get their own, and `update` records how long the model took
+        self._started = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[list]:
+        """Returns the cached generations of a request, or None to call the model."""
+        if not _is_deterministic(llm_string):
+            return None
+        key = ResponseCache.make_key(llm_string, {"prompt": prompt})
+        cached = self.cache.get(key)
+        if cached is None:
+            with self._lock:
+                self._started.setdefault(key, deque(maxlen=16)).append(time.perf_counter())
+                self._started.move_to_end(key)
+                while len(self._started) > self.max_pending:
+                    self._started.popitem(last=False)
+            return None
+        return [loads(generation) for generation in json.loads(cached)]
+
+    def update(self, prompt: str, llm_string: str, return_val: list) -> None:
+        """Stores the generations the model returned for a request."""
+        if not _is_deterministic(llm_string):
+            return
+        key = ResponseCache.make_key(llm_string, {"prompt": prompt})
+        started = None
+        with self._lock:
+            starts = self._started.get(key)
+            if starts:
+                started = starts.popleft()
+                if not starts:
+                    del self._started[key]
+        seconds = time.perf_counter() - started if started is not None else 0.0
+        self.cache.set(key, json.dumps([dumps(generation) for generation in return_val]), seconds)
+
+    def clear(self, **kwargs) -> None:
+        """Removes every cached response."""
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        """Returns the hit rate and seconds saved (see `ResponseCache.stats`)."""
+        return self.cache.stats()
+
+
+def install_response_cache(cache: Optional[ResponseCache] = None) -> Optional[LangChainResponseCache]:
+    """
+    Installs the response cache for all LangChain chat models of this process.
+
+    Parameters:
+    - cache (ResponseCache | None): Cache to use, defaults to `default_response_cache()`.
+
+    Returns:
+    - LangChainResponseCache | None: The installed cache (for its stats), None if disabled.
+    """
+    cache = cache or default_response_cache()
+    if cache is None:
+        return None
+    response_cache = LangChainResponseCache(cache)
+    set_llm_cache(response_cache)
+    return response_cache
@@ -0,0 +1,45 @@
+"""
+File: shared_modules.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Loads the modules chapter 2 shares with chapter 1 (the tool cache and the
+response cache) from their files in `chapter_1`, without adding that folder to `sys.path`,
+so importing them cannot shadow or change any other import of the process.
+
+Usage:
+1. Call e.g. `memoize = import_from_chapter_1("tool_cache").memoize`.
+2. Every caller gets the same module object, so e.g. the default tool cache is shared.
+"""
+
+import importlib.util
+import os
+import sys
+
+# Folder of the chapter 1 modules
+CHAPTER_1_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "chapter_1")
+
+
+def import_from_chapter_1(name: str):
+    """
+    Imports a chapter 1 module by its file path, once per process.
+
+    Parameters:
+    - name (str): Module name, e.g. `tool_cache` for `chapter_1/tool_cache.py`.
+
+    Returns:
+    - module: The imported module.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = importlib.util.spec_from_file_location(name, os.path.join(CHAPTER_1_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    # Registered before running it, like a regular import, so later imports reuse it
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
@@ -0,0 +1,150 @@
+"""
+File: tool_engine.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Reusable tool-execution engine for the LangChain tool scripts. It looks tools
+up by name in a registry, runs all tool calls of one model turn concurrently (async tools
+on the event loop, sync tools in daemon threads), applies a timeout to every tool, and
+loops model -> tools -> model until the model stops calling tools or the iteration limit
+is reached. Each turn reports the time spent in the model and in the tools.
+
+Usage:
+1. Create the engine, e.g. `engine = ToolEngine([multiply], timeout_seconds=10)`.
+2. Run the agent loop with `final_response, turns = engine.run(model_with_tools, messages)`
+   (or `await engine.arun(...)` inside an event loop).
+3. Print the timings with `print_turns(turns)`.
+4. A sync tool that times out cannot be stopped: the model gets an error right away, but the
+   tool keeps running in its daemon thread until it returns (or the script exits).
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+from langchain_core.messages import ToolMessage
+
+
+class ToolEngine:
+    """Runs the tool calls of a model concurrently and drives the agent loop."""
+
+    def __init__(self, tools: list, timeout_seconds: float = 30, timeouts: dict = None, max_workers: int = 8):
+        """
+        Parameters:
+        - tools (list): LangChain tools (e.g. made with `@tool`), sync or async.
+        - timeout_seconds (float): Default time limit of a tool call.
+        - timeouts (dict | None): Per-tool time limits by tool name, overriding the default.
+        - max_workers (int): Sync tools running at the same time; a timed-out tool keeps
+          its slot until it returns.
+        """
+        # Name -> tool, so dispatching a call is a single lookup
+        self.registry = {tool.name: tool for tool in tools}
+        self.timeout_seconds = timeout_seconds
+        self.timeouts = timeouts or {}
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def _start_thread(self, tool, tool_call: dict) -> Future:
+        """
+        Runs a sync tool in a new daemon thread. Unlike a thread pool, whose threads are joined
+        when the interpreter exits, a timed-out tool cannot keep the script from ending.
+        """
+        future = Future()
+
+        def target():
+            with self._slots:
+                if not future.set_running_or_notify_cancel():
+                    return
+                try:
+                    future.set_result(tool.invoke(tool_call))
+                except BaseException as exc:
+                    future.set_exception(exc)
+
+        threading.Thread(target=target, name=f"tool-{tool.name}", daemon=True).start()
+        return future
+
+    async def _run_tool_call(self, tool_call: dict) -> ToolMessage:
+        """
+        Runs one tool call, turning unknown tools, timeouts and errors into error messages
+        the model can react to instead of exceptions that end the loop.
+        """
+        name = tool_call["name"]
+        tool = self.registry.get(name)
+        if tool is None:
+            content = f"Error: unknown tool {name}"
+            return ToolMessage(content, tool_call_id=tool_call["id"], name=name, status="error")
+
+        timeout = self.timeouts.get(name, self.timeout_seconds)
+        try:
+            if getattr(tool, "coroutine", None) is not None:
+                return await asyncio.wait_for(tool.ainvoke(tool_call), timeout)
+            # A timed-out sync tool keeps running until it returns, only the wait is abandoned
+            return await asyncio.wait_for(asyncio.wrap_future(self._start_thread(tool, tool_call)), timeout)
+        except asyncio.TimeoutError:
+            content = f"Error: {name} did not finish within {timeout}s"
+        except Exception as exc:
+            content = f"Error: {name} failed: {exc}"
+        return ToolMessage(content, tool_call_id=tool_call["id"], name=name, status="error")
+
+    async def arun_tool_calls(self, tool_calls: list) -> list:
+        """
+        Runs all tool calls of one turn at the same time.
+
+        Parameters:
+        - tool_calls (list): The `tool_calls` of the model's message.
+
+        Returns:
+        - list: One `ToolMessage` per call, in the order of the calls.
+        """
+        return await asyncio.gather(*(self._run_tool_call(tool_call) for tool_call in tool_calls))
+
+    async def arun(self, model_with_tools, messages: list, max_iterations: int = 5) -> tuple:
+        """
+        Calls the model and its tools in turns until the model answers without tool calls.
+
+        Steps:
+        1. Calls the model with the conversation so far.
+        2. Returns its message if it has no tool calls (or the iteration limit is reached).
+        3. Otherwise runs all its tool calls concurrently, appends the message and the
+           tool results to the conversation and starts the next turn.
+
+        Parameters:
+        - model_with_tools: Chat model with the tools bound (`model.bind_tools(tools)`).
+        - messages (list): Conversation so far; the model and tool messages are appended to it.
+        - max_iterations (int): Maximum number of model calls.
+
+        Returns:
+        - tuple: (last model message, list of per-turn dicts with `model_seconds`,
+          `tool_seconds` and `tool_calls`).
+        """
+        turns = []
+        for _ in range(max_iterations):
+            started = time.perf_counter()
+            response_message = await model_with_tools.ainvoke(messages)
+            turn = {"model_seconds": time.perf_counter() - started, "tool_seconds": 0.0, "tool_calls": []}
+            turns.append(turn)
+            if not response_message.tool_calls:
+                return response_message, turns
+
+            # Append model's response, then the result of every tool it called
+            messages.append(response_message)
+            started = time.perf_counter()
+            messages.extend(await self.arun_tool_calls(response_message.tool_calls))
+            turn["tool_seconds"] = time.perf_counter() - started
+            turn["tool_calls"] = [tool_call["name"] for tool_call in response_message.tool_calls]
+
+        # Iteration limit reached while the model still called tools
+        return response_message, turns
+
+    def run(self, model_with_tools, messages: list, max_iterations: int = 5) -> tuple:
+        """Blocking version of `arun`, for scripts without an event loop."""
+        return asyncio.run(self.arun(model_with_tools, messages, max_iterations))
+
+
+def print_turns(turns: list) -> None:
+    """Prints the time spent in the model and in the tools for every turn."""
+    for number, turn in enumerate(turns, start=1):
+        calls = ", ".join(turn["tool_calls"]) or "none"
+        print(
+            f"Turn {number}: model {turn['model_seconds']:.3f}s, "
+            f"tools {turn['tool_seconds']:.3f}s (calls: {calls})"
+        )
@@ -3,21 +3,182 @@ File: api.py
 Author: Sina Mehdinia
 Date: 02/27/2025
 Description: Implements a FastAPI-based backend to process receipt image uploads.
-It extracts structured receipt data using the `process_receipt_bytes` function.
+It extracts structured receipt data using the async `aprocess_receipt_bytes` function,
+so slow model calls never block the event loop.
 
 Usage:
 1. Run the script with `uvicorn receipt_api:app --reload --port 1234`.
 2. Open `http://localhost:1234/static/index.html` in your browser.
-3. Upload a receipt image via the `/upload_receipt` endpoint.
+3. Upload a receipt image via the `/upload_receipt` endpoint,
+   or many at once via the `/upload_receipts` endpoint.
+4. For long-running extractions, submit a job via `POST /jobs`
+   and fetch its result via `GET /jobs/{job_id}`.
 """
 
-from fastapi import FastAPI, UploadFile, File
-from receipt_processor import process_receipt_bytes
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+# Start of the (slow) third-party imports, reported on `/startup_stats`
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, UploadFile, File, Response
+from fastapi.encoders import jsonable_encoder
+from receipt_processor import (
+    STARTUP_TIMINGS,
+    admission_controller,
+    aprocess_receipt_bytes,
+    http_pool,
+    model_cascade,
+    model_router,
+    near_duplicate_index,
+    receipt_cache,
+    shared_state,
+    warm_up,
+)
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+
+from config import (
+    ANALYTICS_DIR,
+    ANALYTICS_ENABLED,
+    JOB_DB_PATH,
+    JOB_MAX_QUEUE_DEPTH,
+    JOB_MAX_QUEUED_BYTES,
+    JOB_WORKERS,
+    MAX_CONCURRENT_EXTRACTIONS,
+    MAX_IN_FLIGHT_UPLOAD_BYTES,
+    MAX_UPLOAD_BYTES,
+    REQUEST_TIMING_LOGS,
+    STORE_BATCH_SIZE,
+    STORE_ENABLED,
+    STORE_FLUSH_SECONDS,
+    STORE_PATH,
+    UPLOAD_BUDGET_WAIT_SECONDS,
+    WARM_UP,
+    WORKERS,
+)
+from job_queue import DONE, FAILED, JobQueue, QueueFullError
+from metrics import registry
+from rate_limiter import AdmissionQueueFullError, RateLimitedError
+from receipt_analytics import ReceiptAnalytics
+from receipt_store import ReceiptStore, iso_date
+from upload_limits import (
+    ByteBudget,
+    MaxUploadSizeMiddleware,
+    UploadBudgetTimeoutError,
+    UploadTooLargeError,
+    check_upload_size,
+    read_upload,
+)
+
+logger = logging.getLogger(__name__)
+
+# Persistent job store and the in-memory queue of job ids the workers drain
+job_queue = JobQueue(JOB_DB_PATH, max_depth=JOB_MAX_QUEUE_DEPTH, max_queued_bytes=JOB_MAX_QUEUED_BYTES)
+pending_jobs = asyncio.Queue()
+
+# Every extracted receipt is saved here for the `/receipts` endpoints
+receipt_store = ReceiptStore(
+    STORE_PATH, batch_size=STORE_BATCH_SIZE, flush_seconds=STORE_FLUSH_SECONDS
+) if STORE_ENABLED else None
+
+# Spending aggregates over the stored receipts, served on `/analytics`
+receipt_analytics = ReceiptAnalytics(ANALYTICS_DIR) if STORE_ENABLED and ANALYTICS_ENABLED else None
+
+# Events used to wake up clients waiting for a job's status to change, and how many
+# clients wait on each, so the event is dropped when the last one stops waiting
+job_status_events = {}
+job_status_waiters = Counter()
+
+# Delayed requeues of rate-limited jobs, referenced until done so they are not garbage-collected
+requeue_tasks = set()
+
+# How often waiting clients re-read a job's status when other worker processes may run it
+JOB_POLL_SECONDS = 0.5
+
+# How often a worker publishes its metrics for the other workers' `/metrics`
+METRICS_PUBLISH_SECONDS = 5
+
+# Metrics exposed on `/metrics`
+extractions_total = registry.counter(
+    "receipt_extractions_total", "Receipt extractions by endpoint and outcome", ["endpoint", "outcome"]
+)
+extraction_errors_total = registry.counter(
+    "receipt_extraction_errors_total", "Failed receipt extractions by endpoint and error type",
+    ["endpoint", "error_type"],
+)
+extractions_in_flight = registry.gauge(
+    "receipt_extractions_in_flight", "Receipt extractions currently in progress", ["endpoint"]
+)
+stage_seconds = registry.histogram(
+    "receipt_stage_seconds", "Duration of each receipt processing stage", ["endpoint", "stage"]
+)
+payload_bytes = registry.histogram(
+    "receipt_payload_bytes", "Receipt image size before and after pre-processing", ["kind"],
+    buckets=[2 ** power for power in range(14, 25)],
+)
+llm_tokens_total = registry.counter(
+    "receipt_llm_tokens_total", "Tokens reported by the model", ["provider", "kind"]
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the job workers when the server starts and stops them on shutdown.
+    Jobs left queued or interrupted by the previous run are picked up again.
+    Receipts still waiting to be saved are written before the server exits.
+    With `RECEIPT_WARM_UP` on, the models are built before the first request comes in.
+    """
+    if WARM_UP:
+        # Building a model imports its provider package, keep it off the event loop
+        await asyncio.to_thread(warm_up)
+    logger.info(
+        "Started in %.3fs (imports %.3fs, warm-up %s)",
+        time.perf_counter() - _import_started,
+        startup_timings["api_import_seconds"],
+        f"{STARTUP_TIMINGS['warm_up_seconds']:.3f}s" if WARM_UP else "off",
+    )
+
+    # With several worker processes, `serve.py` already requeued the interrupted jobs and the
+    # others may be running theirs, so only the jobs of dead processes (e.g. the crashed worker
+    # this one replaces) are requeued; every process queues all waiting jobs, the first to start one wins
+    for job_id in job_queue.recover(requeue_running=WORKERS <= 1):
+        pending_jobs.put_nowait(job_id)
+
+    workers = [asyncio.create_task(job_worker()) for _ in range(JOB_WORKERS)]
+    if shared_state is not None:
+        registry.share(shared_state, str(os.getpid()))
+        workers.append(asyncio.create_task(publish_metrics()))
+    yield
+    for worker in [*workers, *requeue_tasks]:
+        worker.cancel()
+    if receipt_store is not None:
+        receipt_store.close()
+    await http_pool.aclose()
+
 
 # Initialize the FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# Limit the number of extractions this worker keeps in flight at once
+extraction_semaphore = asyncio.Semaphore(MAX_CONCURRENT_EXTRACTIONS)
+
+# Limit the upload bytes this worker holds in memory at once; further uploads wait
+upload_budget = ByteBudget(MAX_IN_FLIGHT_UPLOAD_BYTES)
+
+# Reject single-file uploads over the limit before their whole body is received
+app.add_middleware(
+    MaxUploadSizeMiddleware, max_bytes=MAX_UPLOAD_BYTES, paths=("/upload_receipt", "/jobs")
+)
 
 # Mount the static directory to serve frontend files (e.g., HTML, CSS)
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -34,15 +195,144 @@ async def read_root():
     return FileResponse("static/index.html")
 
 
+def _details_to_headers(details: dict) -> dict:
+    """
+    Converts per-request extraction details into `X-Receipt-*` response headers,
+    e.g. `original_bytes` becomes `X-Receipt-Original-Bytes`.
+    """
+    return {
+        "X-Receipt-" + "-".join(part.capitalize() for part in key.split("_")): str(value)
+        for key, value in details.items()
+    }
+
+
+def _receipt_json(result, details: dict) -> dict:
+    """
+    Encodes an extracted receipt for the response body, with `near_duplicate_of` (SHA-256 of
+    the earlier image whose result was reused, or None) and `near_duplicate_distance`, so
+    clients can tell a reused result from a fresh extraction without reading headers.
+    """
+    return {
+        **jsonable_encoder(result),
+        "near_duplicate_of": details.get("near_duplicate_of"),
+        "near_duplicate_distance": details.get("near_duplicate_distance"),
+    }
+
+
+def _observe_extraction(endpoint: str, details: dict) -> None:
+    """Feeds one extraction's details into the metrics and, if enabled, the timing log."""
+    for key, value in details.items():
+        if key.endswith("_seconds"):
+            stage_seconds.observe(value, endpoint=endpoint, stage=key[: -len("_seconds")])
+    for kind in ("original", "processed"):
+        if f"{kind}_bytes" in details:
+            payload_bytes.observe(details[f"{kind}_bytes"], kind=kind)
+    for kind in ("input", "output"):
+        if f"{kind}_tokens" in details:
+            llm_tokens_total.inc(details[f"{kind}_tokens"], provider=details.get("provider", ""), kind=kind)
+
+    if REQUEST_TIMING_LOGS:
+        logger.info("receipt_timing %s", json.dumps({"endpoint": endpoint, **details}, default=str))
+
+
+async def _run_extraction(
+    endpoint: str,
+    file_content: bytes,
+    details: dict,
+    digest: str = None,
+    priority: str = "interactive",
+):
+    """
+    Runs `aprocess_receipt_bytes` within the worker's concurrency limit, records its metrics
+    and queues the receipt to be saved in the receipt store.
+
+    Parameters:
+    - endpoint (str): Endpoint the extraction belongs to, used as a metric label.
+    - file_content (bytes): Raw image bytes of the receipt.
+    - details (dict): Per-request details, receives the `queue_wait` and `total` durations.
+    - digest (str | None): SHA-256 hex digest of the image, if computed while reading it.
+    - priority (str): Priority class used when waiting for provider quota.
+
+    Returns:
+    - Receipt: The extracted receipt (errors are counted and re-raised).
+    """
+    started = time.perf_counter()
+    if digest is None:
+        digest = hashlib.sha256(file_content).hexdigest()
+    extractions_in_flight.inc(endpoint=endpoint)
+    try:
+        # Wait for a free extraction slot, then process without blocking the event loop
+        async with extraction_semaphore:
+            details["queue_wait_seconds"] = round(time.perf_counter() - started, 6)
+            result = await aprocess_receipt_bytes(
+                file_content, details, image_digest=digest, priority=priority
+            )
+    except Exception as e:
+        extractions_total.inc(endpoint=endpoint, outcome="error")
+        extraction_errors_total.inc(endpoint=endpoint, error_type=type(e).__name__)
+        details["error_type"] = type(e).__name__
+        raise
+    else:
+        extractions_total.inc(endpoint=endpoint, outcome="ok")
+        if receipt_store is not None:
+            # A re-photographed receipt is saved under its original image, so it is stored once
+            receipt_store.add(result, details.get("near_duplicate_of") or digest)
+    finally:
+        extractions_in_flight.dec(endpoint=endpoint)
+        details["total_seconds"] = round(time.perf_counter() - started, 6)
+        _observe_extraction(endpoint, details)
+
+    return result
+
+
+def _upload_error_response(error: Exception) -> JSONResponse:
+    """Answers 413 for oversized uploads and 503 (with `Retry-After`) when the upload budget is full."""
+    if isinstance(error, UploadTooLargeError):
+        return JSONResponse({"error": str(error)}, status_code=413)
+    return JSONResponse(
+        {"error": str(error)}, status_code=503, headers={"Retry-After": str(int(UPLOAD_BUDGET_WAIT_SECONDS))}
+    )
+
+
+def _rate_limit_response(error: RateLimitedError) -> JSONResponse:
+    """
+    Answers 429 when the provider quota is exhausted, or 503 when too many calls are
+    already waiting for it, telling the client when to retry.
+    """
+    status_code = 503 if isinstance(error, AdmissionQueueFullError) else 429
+    return JSONResponse(
+        {"error": str(error), "retry_after": error.retry_after},
+        status_code=status_code,
+        headers={"Retry-After": str(math.ceil(error.retry_after))},
+    )
+
+
+async def _reserve_upload(file: UploadFile) -> int:
+    """
+    Rejects an oversized upload, then waits for room for it in the in-flight bytes budget.
+
+    Returns:
+    - int: Bytes reserved, to release once the upload is no longer held in memory.
+    """
+    check_upload_size(file, MAX_UPLOAD_BYTES)
+    return await upload_budget.acquire(file.size or MAX_UPLOAD_BYTES, UPLOAD_BUDGET_WAIT_SECONDS)
+
+
 @app.post("/upload_receipt")
-async def upload_receipt(file: UploadFile = File(...)):
+async def upload_receipt(response: Response, file: UploadFile = File(...)):
     """
     Endpoint for uploading a receipt image.
 
     Steps:
-    1. Reads the uploaded image file content into memory.
-    2. Processes the receipt using `process_receipt_bytes`.
-    3. Returns structured receipt data as JSON.
+    1. Waits for room in the worker's in-flight upload bytes, then reads the uploaded
+       image in chunks (hashing it along the way), rejecting it with 413 if too large.
+    2. Processes the receipt using `aprocess_receipt_bytes`, waiting for a free
+       extraction slot if the worker is already at its concurrency limit.
+    3. Returns structured receipt data as JSON, with per-request details
+       (cache hit, image bytes before/after pre-processing, stage durations, provider,
+       token usage) as `X-Receipt-*` headers, or 429/503 with `Retry-After` when the
+       providers are out of quota. The body also says whether a near-duplicate's result
+       was reused (`near_duplicate_of`, `near_duplicate_distance`).
 
     Parameters:
     - file (UploadFile): The uploaded receipt image.
@@ -50,15 +340,558 @@ async def upload_receipt(file: UploadFile = File(...)):
     Returns:
     - dict: JSON containing structured receipt details or an error message.
     """
+    details = {}
+    reserved = 0
     try:
+        reserved = await _reserve_upload(file)
+
         # Read the file content into memory
-        file_content = await file.read()
+        started = time.perf_counter()
+        file_content, digest = await read_upload(file, MAX_UPLOAD_BYTES)
+        details["read_seconds"] = round(time.perf_counter() - started, 6)
 
-        # Process the receipt image and extract structured data
-        result = process_receipt_bytes(file_content)
+        # Process the receipt image and extract structured data without blocking the event loop
+        result = await _run_extraction("/upload_receipt", file_content, details, digest)
 
+    except (UploadTooLargeError, UploadBudgetTimeoutError) as e:
+        return _upload_error_response(e)
+    except RateLimitedError as e:
+        return _rate_limit_response(e)
     except Exception as e:
         # Handle errors and return an appropriate response
         return {"error": str(e)}
+    finally:
+        await upload_budget.release(reserved)
 
-    return result
+    response.headers.update(_details_to_headers(details))
+    return _receipt_json(result, details)
+
+
+async def _batch_error(index: int, filename: str, error: Exception) -> dict:
+    """Entry for a batch file that was rejected before extraction (e.g. too large)."""
+    return {"index": index, "filename": filename, "error": str(error), "details": {}}
+
+
+async def _extract_one(
+    index: int, filename: str, file_content: bytes, digest: str, reserved: int
+) -> dict:
+    """
+    Extracts one receipt of a batch, capturing errors instead of raising them.
+
+    Parameters:
+    - index (int): Position of the file in the uploaded batch.
+    - filename (str): Name of the uploaded file.
+    - file_content (bytes): Raw image bytes of the receipt.
+    - digest (str): SHA-256 hex digest of the image.
+    - reserved (int): Upload budget bytes held for this file, released when done.
+
+    Returns:
+    - dict: The file's index and name with either its `result` or its `error`,
+      plus the extraction `details`.
+    """
+    details = {}
+    try:
+        result = await _run_extraction(
+            "/upload_receipts", file_content, details, digest, priority="batch"
+        )
+    except RateLimitedError as e:
+        return {
+            "index": index,
+            "filename": filename,
+            "error": str(e),
+            "retry_after": e.retry_after,
+            "details": details,
+        }
+    except Exception as e:
+        return {"index": index, "filename": filename, "error": str(e), "details": details}
+    finally:
+        await upload_budget.release(reserved)
+
+    return {
+        "index": index,
+        "filename": filename,
+        "result": _receipt_json(result, details),
+        "details": details,
+    }
+
+
+@app.post("/upload_receipts")
+async def upload_receipts(files: List[UploadFile] = File(...), stream: bool = False):
+    """
+    Endpoint for uploading many receipt images in a single request.
+
+    Steps:
+    1. Reads the uploaded files one by one as room frees up in the worker's in-flight
+       upload bytes, starting each extraction as soon as its file is read.
+    2. Processes all receipts concurrently, bounded by the worker's extraction limit.
+    3. Returns per-file results and errors in input order, or, with `?stream=true`,
+       streams each one back as a line of NDJSON as soon as it finishes.
+
+    Parameters:
+    - files (List[UploadFile]): The uploaded receipt images.
+    - stream (bool): Whether to stream results as NDJSON in completion order.
+
+    Returns:
+    - list | StreamingResponse: One entry per file with its `result` or `error`.
+    """
+    # Read all files before returning, the uploads are closed once the handler returns
+    tasks = []
+    for index, file in enumerate(files):
+        reserved = 0
+        try:
+            reserved = await _reserve_upload(file)
+            content, digest = await read_upload(file, MAX_UPLOAD_BYTES)
+        except (UploadTooLargeError, UploadBudgetTimeoutError) as e:
+            await upload_budget.release(reserved)
+            tasks.append(asyncio.create_task(_batch_error(index, file.filename, e)))
+            continue
+        tasks.append(
+            asyncio.create_task(_extract_one(index, file.filename, content, digest, reserved))
+        )
+
+    if not stream:
+        # Wait for all extractions, gather keeps the results in input order
+        return await asyncio.gather(*tasks)
+
+    async def ndjson_lines():
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # Stop the remaining extractions if the client disconnects early
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """
+    Reports how effective the receipt result cache and the near-duplicate detection are.
+
+    Returns:
+    - dict: Hit/miss counters and entry counts, or a note that caching is disabled,
+      plus the same for the near-duplicate index under `near_duplicates`.
+    """
+    # The cache counts its SQLite entries, so ask it from a thread
+    stats = (
+        {"enabled": False} if receipt_cache is None
+        else {"enabled": True, **await asyncio.to_thread(receipt_cache.stats)}
+    )
+    stats["near_duplicates"] = (
+        {"enabled": False} if near_duplicate_index is None
+        else {"enabled": True, **near_duplicate_index.stats()}
+    )
+    return stats
+
+
+def _require_store() -> ReceiptStore:
+    """Returns the receipt store, or answers 404 if it is disabled."""
+    if receipt_store is None:
+        raise HTTPException(status_code=404, detail="The receipt store is disabled")
+    return receipt_store
+
+
+@app.get("/receipts")
+async def list_receipts(
+    merchant: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_total: Optional[float] = None,
+    max_total: Optional[float] = None,
+    cursor: Optional[int] = None,
+    limit: int = 100,
+    stream: bool = False,
+):
+    """
+    Endpoint for querying the stored receipts, newest first.
+
+    Steps:
+    1. Filters by merchant name, transaction date range and total range.
+    2. Returns one page and the cursor of the next one (keyset pagination, so deep
+       pages cost the same as the first), or, with `?stream=true`, streams every
+       matching receipt as a line of NDJSON.
+
+    Parameters:
+    - merchant (str | None): Exact merchant name (case-insensitive).
+    - date_from (str | None): Earliest transaction date, e.g. `2025-01-01` (receipt dates in
+      other formats, such as `02/27/2025`, are compared after normalizing them to ISO).
+    - date_to (str | None): Latest transaction date.
+    - min_total (float | None): Smallest total.
+    - max_total (float | None): Largest total.
+    - cursor (int | None): `next_cursor` returned with the previous page.
+    - limit (int): Page size (max 1000).
+    - stream (bool): Whether to stream all matches as NDJSON instead of returning one page.
+
+    Returns:
+    - dict | StreamingResponse: `receipts` and `next_cursor`, or the NDJSON stream.
+    """
+    store = _require_store()
+    filters = {
+        "merchant": merchant,
+        "date_from": date_from,
+        "date_to": date_to,
+        "min_total": min_total,
+        "max_total": max_total,
+    }
+    limit = max(1, min(limit, 1000))
+    for name in ("date_from", "date_to"):
+        if filters[name] is not None and iso_date(filters[name]) is None:
+            raise HTTPException(status_code=400, detail=f"{name} is not a valid date: {filters[name]}")
+
+    # Queries run in a thread so a large page never blocks the event loop
+    if not stream:
+        return await asyncio.to_thread(store.query, **filters, cursor=cursor, limit=limit)
+
+    async def ndjson_lines():
+        next_cursor = cursor
+        while True:
+            page = await asyncio.to_thread(store.query, **filters, cursor=next_cursor, limit=1000)
+            if page["receipts"]:
+                yield "".join(json.dumps(receipt) + "\n" for receipt in page["receipts"])
+            next_cursor = page["next_cursor"]
+            if next_cursor is None:
+                return
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@app.get("/receipts/{receipt_id}")
+async def get_receipt(receipt_id: int):
+    """
+    Endpoint for reading one stored receipt.
+
+    Parameters:
+    - receipt_id (int): Id of the receipt, as returned by `GET /receipts`.
+
+    Returns:
+    - dict: The receipt with its merchant, transaction and items.
+    """
+    receipt = await asyncio.to_thread(_require_store().get, receipt_id)
+    if receipt is None:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    return receipt
+
+
+@app.get("/analytics")
+async def analytics(top: int = 10):
+    """
+    Endpoint for spending analytics over the stored receipts.
+
+    Steps:
+    1. Appends the receipts stored since the last call to the columnar analytics data.
+    2. Returns the aggregates, recomputed only if new receipts were appended.
+
+    Parameters:
+    - top (int): Number of merchants and items in the rankings (max 100).
+
+    Returns:
+    - dict: Overview (totals, tax and tip ratios), top merchants by spend, spend per
+      month and top items by quantity x price.
+    """
+    store = _require_store()
+    if receipt_analytics is None:
+        raise HTTPException(status_code=404, detail="Analytics are disabled")
+    top = max(1, min(top, 100))
+
+    # Syncing and the NumPy group-bys run in a thread, off the event loop
+    def refresh() -> dict:
+        receipt_analytics.sync(store)
+        return receipt_analytics.summary(top)
+
+    return await asyncio.to_thread(refresh)
+
+
+@app.get("/router_stats")
+async def router_stats():
+    """
+    Reports the health the model router uses to pick a provider, and how often hedged calls fire and win.
+
+    Returns:
+    - dict: Per provider circuit breaker state, p50/p95 latency, error rate and call count,
+      plus the hedging counters, the quota left under each provider's rate limits, the
+      HTTP connection pool utilization and, with the cascade enabled, the local tier's hit
+      rate and the latency of both tiers.
+    """
+    return {
+        "providers": model_router.snapshot(),
+        "hedging": model_router.hedge_stats(),
+        "rate_limits": admission_controller.snapshot(),
+        "http_pool": http_pool.stats(),
+        "cascade": model_cascade.stats() if model_cascade is not None else None,
+    }
+
+
+def _notify_job_status(job_id: str) -> None:
+    """Wakes up every client waiting for the given job's status to change."""
+    event = job_status_events.pop(job_id, None)
+    if event is not None:
+        event.set()
+
+
+async def _wait_for_job_status(job_id: str, timeout: float) -> None:
+    """Waits until the given job's status changes or the timeout expires."""
+    if WORKERS > 1:
+        # Another worker process may be running the job, poll instead of waiting only for our events
+        timeout = min(timeout, JOB_POLL_SECONDS)
+    event = job_status_events.setdefault(job_id, asyncio.Event())
+    job_status_waiters[job_id] += 1
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        job_status_waiters[job_id] -= 1
+        if not job_status_waiters[job_id]:
+            del job_status_waiters[job_id]
+            # Jobs finished by another worker never reach `_notify_job_status` here
+            if job_status_events.get(job_id) is event:
+                del job_status_events[job_id]
+
+
+def _job_response(job: dict) -> dict:
+    """Formats a stored job for the API, decoding its receipt JSON."""
+    return {**job, "result": json.loads(job["result"]) if job["result"] else None}
+
+
+async def _requeue_job_later(job_id: str, delay: float) -> None:
+    """Puts a job back in the queue once the provider quota it ran out of has refilled."""
+    await asyncio.sleep(delay)
+    await asyncio.to_thread(job_queue.requeue, job_id)
+    pending_jobs.put_nowait(job_id)
+    _notify_job_status(job_id)
+
+
+async def job_worker():
+    """
+    Drains the job queue: runs each job's extraction and stores its receipt or error.
+    Jobs that run out of provider quota are retried later instead of failing.
+    The job queue's SQLite calls run in a thread to keep them off the event loop.
+    """
+    while True:
+        job_id = await pending_jobs.get()
+        image_bytes = await asyncio.to_thread(job_queue.start, job_id)
+        if image_bytes is None:
+            continue
+        _notify_job_status(job_id)
+
+        details = {}
+        try:
+            result = await _run_extraction("/jobs", image_bytes, details, priority="background")
+            await asyncio.to_thread(job_queue.finish, job_id, json.dumps(_receipt_json(result, details)))
+        except RateLimitedError as e:
+            logger.warning("Receipt job %s rate limited, retrying in %.1fs", job_id, e.retry_after)
+            task = asyncio.create_task(_requeue_job_later(job_id, e.retry_after))
+            requeue_tasks.add(task)
+            task.add_done_callback(requeue_tasks.discard)
+            continue
+        except Exception as e:
+            logger.exception("Receipt job %s failed", job_id)
+            await asyncio.to_thread(job_queue.fail, job_id, str(e))
+
+        _notify_job_status(job_id)
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(file: UploadFile = File(...)):
+    """
+    Endpoint for submitting a receipt image as a background job.
+
+    Steps:
+    1. Stores the uploaded image in the persistent job queue.
+    2. Returns the job id immediately, while a worker extracts the receipt.
+
+    Parameters:
+    - file (UploadFile): The uploaded receipt image.
+
+    Returns:
+    - dict: The job id and its initial status.
+    """
+    reserved = 0
+    try:
+        reserved = await _reserve_upload(file)
+        file_content, _ = await read_upload(file, MAX_UPLOAD_BYTES)
+        job_id = await asyncio.to_thread(job_queue.enqueue, file_content)
+    except (UploadTooLargeError, UploadBudgetTimeoutError) as e:
+        return _upload_error_response(e)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    finally:
+        await upload_budget.release(reserved)
+
+    pending_jobs.put_nowait(job_id)
+    return {"id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Endpoint for reading a job's status and, once done, its receipt.
+
+    Parameters:
+    - job_id (str): Id returned by `POST /jobs`.
+    - wait (float): Long-poll for up to this many seconds (max 60) until the job finishes.
+
+    Returns:
+    - dict: The job's status, receipt `result` or `error`, and timestamps.
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(wait, 60)
+    while job["status"] not in (DONE, FAILED) and loop.time() < deadline:
+        await _wait_for_job_status(job_id, deadline - loop.time())
+        job = await asyncio.to_thread(job_queue.get, job_id)
+
+    return _job_response(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """
+    Endpoint streaming a job's status changes as Server-Sent Events,
+    ending with the finished job (receipt or error).
+
+    Parameters:
+    - job_id (str): Id returned by `POST /jobs`.
+
+    Returns:
+    - StreamingResponse: `text/event-stream` with one `status` event per change.
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        current = job
+        while True:
+            yield f"event: status\ndata: {json.dumps(_job_response(current))}\n\n"
+            if current["status"] in (DONE, FAILED):
+                return
+
+            # Wait for the next change, sending a comment now and then to keep the connection open
+            previous_status = current["status"]
+            quiet_since = loop.time()
+            while current["status"] == previous_status:
+                await _wait_for_job_status(job_id, 15)
+                current = await asyncio.to_thread(job_queue.get, job_id)
+                if current["status"] == previous_status and loop.time() - quiet_since >= 15:
+                    yield ": keep-alive\n\n"
+                    quiet_since = loop.time()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/startup_stats")
+async def startup_stats():
+    """
+    Reports how long the server took to start, to spot start-up regressions.
+
+    Returns:
+    - dict: Import time of the API and of the receipt processor, build time of every
+      provider model and the warm-up duration (None if not run).
+    """
+    return {**startup_timings, **STARTUP_TIMINGS}
+
+
+@app.get("/job_stats")
+async def job_stats():
+    """
+    Reports the state of the job queue.
+
+    Returns:
+    - dict: Job counts by status, bytes waiting and the number of workers.
+    """
+    return {"workers": JOB_WORKERS, **await asyncio.to_thread(job_queue.stats)}
+
+
+async def publish_metrics():
+    """Periodically shares this worker's metrics, so `/metrics` on any worker covers all of them."""
+    while True:
+        await asyncio.sleep(METRICS_PUBLISH_SECONDS)
+        try:
+            await asyncio.to_thread(registry.publish)
+        except Exception:
+            logger.exception("Could not publish the metrics of this worker")
+
+
+def _collect_component_metrics() -> None:
+    """Copies the cache, router and job queue statistics into gauges before `/metrics` renders."""
+    if receipt_cache is not None:
+        for key, value in receipt_cache.stats().items():
+            cache_gauge.set(value, stat=key)
+    if near_duplicate_index is not None:
+        for key, value in near_duplicate_index.stats().items():
+            near_duplicate_gauge.set(value, stat=key)
+    for provider, stats in model_router.snapshot().items():
+        provider_circuit_open.set(1 if stats["state"] == "open" else 0, provider=provider)
+        provider_error_rate.set(stats["error_rate"], provider=provider)
+    for key, value in model_router.hedge_stats().items():
+        hedge_gauge.set(value, stat=key)
+    for provider, stats in admission_controller.snapshot().items():
+        for key, value in stats.items():
+            if value is not None:
+                rate_limit_gauge.set(value, provider=provider, stat=key)
+    for key, value in http_pool.stats().items():
+        http_pool_gauge.set(float(value), stat=key)
+    if model_cascade is not None:
+        for key, value in model_cascade.stats().items():
+            if value is not None:
+                cascade_gauge.set(value, stat=key)
+    for status, count in job_queue.stats().items():
+        jobs_gauge.set(count, status=status)
+    jobs_gauge.set(pending_jobs.qsize(), status="pending_in_memory")
+    startup_gauge.set(startup_timings["api_import_seconds"], phase="api_import")
+    startup_gauge.set(STARTUP_TIMINGS["import_seconds"], phase="processor_import")
+    if STARTUP_TIMINGS["warm_up_seconds"] is not None:
+        startup_gauge.set(STARTUP_TIMINGS["warm_up_seconds"], phase="warm_up")
+    for provider, seconds in STARTUP_TIMINGS["model_build_seconds"].items():
+        startup_gauge.set(seconds, phase=f"build_{provider}")
+
+
+cache_gauge = registry.gauge("receipt_cache", "Receipt result cache counters and sizes", ["stat"])
+near_duplicate_gauge = registry.gauge(
+    "receipt_near_duplicates", "Near-duplicate index counters and size", ["stat"]
+)
+provider_circuit_open = registry.gauge(
+    "receipt_provider_circuit_open", "1 if the provider's circuit breaker is open", ["provider"]
+)
+provider_error_rate = registry.gauge(
+    "receipt_provider_error_rate", "Recent error rate of each provider", ["provider"]
+)
+hedge_gauge = registry.gauge("receipt_hedges", "Hedged request counters", ["stat"])
+rate_limit_gauge = registry.gauge(
+    "receipt_rate_limit", "Quota left and admission counters per provider", ["provider", "stat"]
+)
+http_pool_gauge = registry.gauge(
+    "receipt_http_pool", "Provider HTTP connection pool requests and connections", ["stat"]
+)
+cascade_gauge = registry.gauge(
+    "receipt_cascade", "Local tier attempts, outcomes, hit rate and latency of both tiers", ["stat"]
+)
+jobs_gauge = registry.gauge("receipt_jobs", "Background jobs by status", ["status"])
+startup_gauge = registry.gauge("receipt_startup_seconds", "Import and start-up durations", ["phase"])
+registry.add_collector(_collect_component_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Exposes the API's metrics in the Prometheus text format: extraction counts and errors
+    by type, in-flight extractions, per-stage durations, payload sizes, token usage,
+    and cache, router and job queue statistics.
+
+    Returns:
+    - PlainTextResponse: Prometheus exposition text.
+    """
+    # The collectors query SQLite (cache, job queue), so render in a thread, like `publish_metrics`
+    text = await asyncio.to_thread(registry.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+# Time spent importing this module (and with it the processor and provider setup)
+startup_timings = {"api_import_seconds": round(time.perf_counter() - _import_started, 6)}
@@ -0,0 +1,351 @@
+"""
+File: benchmark.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Load-testing harness for the receipt API. Sends synthetic receipt images
+with configurable concurrency, request rate and image-size mix, then reports throughput
+and p50/p95/p99 latency overall, per image size and per processing stage.
+
+By default the FastAPI app runs in-process with the offline fake model (see `fake_model.py`),
+so no API keys or running server are needed. Use `--url` to benchmark a running server instead.
+
+Usage:
+1. Run the offline benchmark with `python3 benchmark.py --requests 200 --concurrency 32`.
+2. Simulate a slow, flaky provider with e.g. `--fake-latency 2 --fake-jitter 1 --fake-failure-rate 0.05`.
+3. Send a fixed request rate with e.g. `--rate 20` (requests per second).
+4. Benchmark a running server with `python3 benchmark.py --url http://localhost:1234`.
+5. Put a local model tier in front of the fake model with e.g. `--local-tier --local-latency 0.3
+   --local-inconsistent-rate 0.2` (a stand-in Ollama server, see `fake_ollama.py`), and compare
+   the reported local hit rate and per-tier latency against a run without it.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Optional
+
+import httpx
+from PIL import Image, ImageDraw
+
+
+def parse_size_mix(text: str) -> list:
+    """
+    Parses an image-size mix such as `640x480:3,3024x4032:1`.
+
+    Parameters:
+    - text (str): Comma-separated `WIDTHxHEIGHT:WEIGHT` entries (weight defaults to 1).
+
+    Returns:
+    - list: (label, (width, height), weight) tuples.
+    """
+    mix = []
+    for entry in text.split(","):
+        size, _, weight = entry.strip().partition(":")
+        width, height = (int(value) for value in size.lower().split("x"))
+        mix.append((size, (width, height), float(weight or 1)))
+    return mix
+
+
+def make_receipt_image(width: int, height: int, seed: int) -> bytes:
+    """
+    Draws a synthetic receipt photo: a light paper strip with text-like lines on a dark background.
+
+    Parameters:
+    - width (int): Image width in pixels.
+    - height (int): Image height in pixels.
+    - seed (int): Seed making every generated image distinct but reproducible.
+
+    Returns:
+    - bytes: The image encoded as JPEG.
+    """
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), (60, 50, 45))
+    draw = ImageDraw.Draw(image)
+
+    paper = (int(width * 0.25), int(height * 0.05), int(width * 0.75), int(height * 0.95))
+    draw.rectangle(paper, fill=(245, 243, 235))
+
+    line_height = max(4, height // 60)
+    for top in range(paper[1] + line_height, paper[3] - line_height, line_height * 2):
+        right = rng.randint(paper[0] + (paper[2] - paper[0]) // 3, paper[2] - line_height)
+        draw.rectangle((paper[0] + line_height, top, right, top + line_height // 2), fill=(30, 30, 30))
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Returns the given percentile of a list of numbers (nearest rank)."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values: list) -> str:
+    """Formats the count and p50/p95/p99 of a list of durations in milliseconds."""
+    if not values:
+        return "n=0"
+    return (
+        f"n={len(values):<6} p50={percentile(values, 0.50) * 1000:9.1f}ms "
+        f"p95={percentile(values, 0.95) * 1000:9.1f}ms p99={percentile(values, 0.99) * 1000:9.1f}ms"
+    )
+
+
+async def send_request(client: httpx.AsyncClient, endpoint: str, label: str, image_bytes: bytes) -> dict:
+    """
+    Uploads one image and measures the request.
+
+    Returns:
+    - dict: Size label, latency, success flag, error and server-side stage timings.
+    """
+    started = time.perf_counter()
+    try:
+        response = await client.post(endpoint, files={"file": ("receipt.jpg", image_bytes, "image/jpeg")})
+        body = response.json()
+        error = body.get("error") if isinstance(body, dict) else None
+        if response.status_code != 200 and error is None:
+            error = f"HTTP {response.status_code}"
+    except Exception as e:
+        response, error = None, f"{type(e).__name__}: {e}"
+    latency = time.perf_counter() - started
+
+    # Stage timings reported by the server as `X-Receipt-<Stage>-Seconds` headers
+    stages = {}
+    if response is not None:
+        for header, value in response.headers.items():
+            header = header.lower()
+            if header.startswith("x-receipt-") and header.endswith("-seconds"):
+                stages[header[len("x-receipt-"):-len("-seconds")]] = float(value)
+
+    return {"label": label, "latency": latency, "ok": error is None, "error": error, "stages": stages}
+
+
+async def run_load(client: httpx.AsyncClient, args, images: dict, mix: list) -> tuple:
+    """
+    Sends `args.requests` uploads, either as fast as `args.concurrency` allows (closed loop)
+    or at a fixed `args.rate` per second (open loop, still capped by the concurrency).
+
+    Returns:
+    - tuple: (list of per-request results, elapsed wall time in seconds).
+    """
+    rng = random.Random(args.seed)
+    labels = [label for label, _, _ in mix]
+    weights = [weight for _, _, weight in mix]
+    plan = [rng.choices(labels, weights)[0] for _ in range(args.requests)]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def one(index: int, label: str):
+        async with semaphore:
+            variants = images[label]
+            results.append(await send_request(client, args.endpoint, label, variants[index % len(variants)]))
+
+    started = time.perf_counter()
+    tasks = []
+    for index, label in enumerate(plan):
+        if args.rate > 0:
+            # Open loop: release requests on schedule, whether or not earlier ones finished
+            delay = started + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(index, label)))
+    await asyncio.gather(*tasks)
+
+    return results, time.perf_counter() - started
+
+
+def report(results: list, elapsed: float) -> dict:
+    """
+    Prints throughput and latency percentiles overall, per image size and per stage.
+
+    Returns:
+    - dict: The same numbers, for `--json` output.
+    """
+    ok = [result for result in results if result["ok"]]
+    errors = defaultdict(int)
+    for result in results:
+        if not result["ok"]:
+            errors[result["error"]] += 1
+
+    by_label = defaultdict(list)
+    by_stage = defaultdict(list)
+    for result in ok:
+        by_label[result["label"]].append(result["latency"])
+        for stage, seconds in result["stages"].items():
+            by_stage[stage].append(seconds)
+
+    print(f"Requests:   {len(results)} ({len(ok)} ok, {len(results) - len(ok)} failed) in {elapsed:.2f}s")
+    print(f"Throughput: {len(ok) / elapsed:.2f} receipts/s")
+    print(f"Latency     {summarize([result['latency'] for result in ok])}")
+    for label, latencies in sorted(by_label.items()):
+        print(f"  {label:<16}{summarize(latencies)}")
+    if by_stage:
+        print("Server-side stages:")
+        for stage, durations in sorted(by_stage.items()):
+            print(f"  {stage:<16}{summarize(durations)}")
+    for error, count in sorted(errors.items(), key=lambda item: -item[1]):
+        print(f"Error x{count}: {error}")
+
+    def percentiles(values):
+        if not values:
+            return None
+        return {f"p{int(q * 100)}": percentile(values, q) for q in (0.5, 0.95, 0.99)}
+
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "elapsed_seconds": elapsed,
+        "throughput_per_second": len(ok) / elapsed,
+        "latency_seconds": percentiles([result["latency"] for result in ok]),
+        "latency_by_size_seconds": {label: percentiles(values) for label, values in by_label.items()},
+        "stage_seconds": {stage: percentiles(values) for stage, values in by_stage.items()},
+        "errors": dict(errors),
+    }
+
+
+def offline_environment(args, scratch: str) -> dict:
+    """
+    Returns the settings of an offline run: fake model, no result cache or near-duplicate
+    detection (every request should reach the model) and throwaway databases in `scratch`.
+    """
+    return {
+        "RECEIPT_PROVIDERS": "fake",
+        "RECEIPT_CACHE_ENABLED": "false",
+        "RECEIPT_NEAR_DUPLICATE_ENABLED": "false",
+        "RECEIPT_JOB_DB_PATH": os.path.join(scratch, "jobs.sqlite3"),
+        "RECEIPT_STORE_PATH": os.path.join(scratch, "receipts.sqlite3"),
+        "RECEIPT_ANALYTICS_DIR": os.path.join(scratch, "analytics"),
+        "RECEIPT_SHARED_STATE_PATH": os.path.join(scratch, "shared_state.sqlite3"),
+        "RECEIPT_FAKE_LATENCY_SECONDS": str(args.fake_latency),
+        "RECEIPT_FAKE_JITTER_SECONDS": str(args.fake_jitter),
+        "RECEIPT_FAKE_FAILURE_RATE": str(args.fake_failure_rate),
+        "RECEIPT_FAKE_SEED": str(args.seed),
+    }
+
+
+def load_app(args):
+    """
+    Imports the FastAPI app configured for an offline run (see `offline_environment`).
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(here)
+    sys.path.insert(0, here)
+
+    scratch = tempfile.mkdtemp(prefix="receipt-benchmark-")
+    os.environ.update(offline_environment(args, scratch))
+
+    # Local tier of the cascade, served by the stand-in Ollama server in this process
+    if args.local_tier:
+        from fake_ollama import FakeOllamaServer
+
+        server = FakeOllamaServer(
+            port=0,
+            latency=args.local_latency,
+            jitter=args.local_latency / 4,
+            inconsistent_rate=args.local_inconsistent_rate,
+            seed=args.seed,
+        ).start()
+        os.environ.update(RECEIPT_CASCADE_ENABLED="true", RECEIPT_OLLAMA_BASE_URL=server.url)
+
+    from api import app
+
+    return app
+
+
+async def fetch_startup(client: httpx.AsyncClient) -> Optional[dict]:
+    """Reads the server's import and warm-up timings, None if it does not report them."""
+    try:
+        response = await client.get("/startup_stats")
+    except httpx.HTTPError:
+        return None
+    return response.json() if response.status_code == 200 else None
+
+
+async def fetch_cascade(client: httpx.AsyncClient) -> Optional[dict]:
+    """Reads the cascade's local hit rate and per-tier latency, None if it is disabled."""
+    try:
+        response = await client.get("/router_stats")
+    except httpx.HTTPError:
+        return None
+    return response.json().get("cascade") if response.status_code == 200 else None
+
+
+async def main_async(args) -> dict:
+    mix = parse_size_mix(args.sizes)
+
+    # Pre-generate a few distinct images per size so encoding them does not skew the timings
+    images = {
+        label: [make_receipt_image(width, height, seed) for seed in range(args.variants)]
+        for label, (width, height), _ in mix
+    }
+
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as client:
+            results, elapsed = await run_load(client, args, images, mix)
+            startup = await fetch_startup(client)
+            cascade = await fetch_cascade(client)
+    else:
+        app = load_app(args)
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=timeout) as client:
+                results, elapsed = await run_load(client, args, images, mix)
+                startup = await fetch_startup(client)
+                cascade = await fetch_cascade(client)
+
+    summary = report(results, elapsed)
+    if startup is not None:
+        print(f"Start-up:   {json.dumps(startup)}")
+        summary["startup"] = startup
+    if cascade is not None:
+        print(f"Cascade:    {json.dumps(cascade)}")
+        summary["cascade"] = cascade
+    return summary
+
+
+def main():
+    """
+    Parses the command line, runs the benchmark and prints (or saves) the report.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the receipt processing API.")
+    parser.add_argument("--url", help="Base URL of a running server (default: in-process app with the fake model)")
+    parser.add_argument("--endpoint", default="/upload_receipt", help="Endpoint receiving the uploads")
+    parser.add_argument("--requests", type=int, default=100, help="Total number of requests")
+    parser.add_argument("--concurrency", type=int, default=16, help="Maximum requests in flight")
+    parser.add_argument("--rate", type=float, default=0, help="Requests per second (0 = as fast as possible)")
+    parser.add_argument("--sizes", default="640x480:3,1536x2048:2,3024x4032:1", help="Image-size mix, WIDTHxHEIGHT:WEIGHT")
+    parser.add_argument("--variants", type=int, default=4, help="Distinct images generated per size")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--fake-latency", type=float, default=1.0, help="Fake model mean latency in seconds")
+    parser.add_argument("--fake-jitter", type=float, default=0.2, help="Fake model latency jitter in seconds")
+    parser.add_argument("--fake-failure-rate", type=float, default=0.0, help="Fraction of fake model calls that fail")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the request mix and the fake model")
+    parser.add_argument("--local-tier", action="store_true", help="Try a stand-in local Ollama model first")
+    parser.add_argument("--local-latency", type=float, default=0.3, help="Local model mean latency in seconds")
+    parser.add_argument(
+        "--local-inconsistent-rate", type=float, default=0.2, help="Fraction of local answers escalated to the cloud"
+    )
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    # The in-process app changes the working directory, resolve the output path first
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    summary = asyncio.run(main_async(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+File: config.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Central place for the tunable settings of the receipt processing API.
+Every setting can be overridden with an environment variable (or an entry in the .env file).
+
+Usage:
+1. Import the setting you need, e.g. `from config import MAX_CONCURRENT_EXTRACTIONS`.
+2. Override a value when starting the server, e.g.
+   `RECEIPT_MAX_CONCURRENCY=64 uvicorn api:app --port 1234`.
+"""
+
+import os
+
+from dotenv import find_dotenv, load_dotenv
+
+# Load environment variables (Ensure a .env file exists with API keys)
+load_dotenv(find_dotenv())
+
+# Maximum number of receipt extractions a single API worker keeps in flight at once
+MAX_CONCURRENT_EXTRACTIONS = int(os.getenv("RECEIPT_MAX_CONCURRENCY", "32"))
+
+# Number of threads used to run extractions for models without native async support
+EXTRACTION_THREADS = int(os.getenv("RECEIPT_EXTRACTION_THREADS", str(MAX_CONCURRENT_EXTRACTIONS)))
+
+# Cache of extracted receipts, keyed by image content, model name and schema version
+CACHE_ENABLED = os.getenv("RECEIPT_CACHE_ENABLED", "true").lower() == "true"
+CACHE_PATH = os.getenv("RECEIPT_CACHE_PATH", "receipt_cache.sqlite3") or None
+CACHE_MEMORY_ITEMS = int(os.getenv("RECEIPT_CACHE_MEMORY_ITEMS", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("RECEIPT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CACHE_DISK_MAX_BYTES = int(os.getenv("RECEIPT_CACHE_MAX_DISK_MB", "256")) * 1024 * 1024
+
+# Image pre-processing applied before the image is base64-encoded and sent to the model
+PREPROCESS_ENABLED = os.getenv("RECEIPT_PREPROCESS_ENABLED", "true").lower() == "true"
+PREPROCESS_MAX_LONG_EDGE = int(os.getenv("RECEIPT_PREPROCESS_MAX_LONG_EDGE", "1600"))
+PREPROCESS_JPEG_QUALITY = int(os.getenv("RECEIPT_PREPROCESS_JPEG_QUALITY", "80"))
+PREPROCESS_GRAYSCALE = os.getenv("RECEIPT_PREPROCESS_GRAYSCALE", "true").lower() == "true"
+PREPROCESS_AUTOCROP = os.getenv("RECEIPT_PREPROCESS_AUTOCROP", "true").lower() == "true"
+PREPROCESS_WORKERS = int(os.getenv("RECEIPT_PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+
+# Tiling of long receipts and PDFs: images at least TILE_MIN_ASPECT times taller than wide
+# (and every PDF page) are cut into overlapping tiles extracted in parallel
+TILING_ENABLED = os.getenv("RECEIPT_TILING_ENABLED", "true").lower() == "true"
+TILE_MIN_ASPECT = float(os.getenv("RECEIPT_TILE_MIN_ASPECT", "2.5"))
+TILE_ASPECT = float(os.getenv("RECEIPT_TILE_ASPECT", "1.5"))
+TILE_OVERLAP = float(os.getenv("RECEIPT_TILE_OVERLAP", "0.15"))
+# Maximum tiles per page, also the maximum number of PDF pages rendered
+TILE_MAX = int(os.getenv("RECEIPT_TILE_MAX", "12"))
+PDF_DPI = int(os.getenv("RECEIPT_PDF_DPI", "200"))
+
+# Near-duplicate detection (opt-in): a new photo whose perceptual hash is within the Hamming
+# distance of an already extracted receipt reuses its result. Different receipts with the same
+# printed layout can hash closely, so the distance is kept small. The hash is computed during
+# pre-processing (or tiling), so photos sent whole need RECEIPT_PREPROCESS_ENABLED; PDFs are never matched
+NEAR_DUPLICATE_ENABLED = os.getenv("RECEIPT_NEAR_DUPLICATE_ENABLED", "false").lower() == "true"
+NEAR_DUPLICATE_PATH = os.getenv("RECEIPT_NEAR_DUPLICATE_PATH", "receipt_fingerprints.sqlite3") or None
+NEAR_DUPLICATE_HASH_SIZE = int(os.getenv("RECEIPT_NEAR_DUPLICATE_HASH_SIZE", "16"))
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("RECEIPT_NEAR_DUPLICATE_MAX_DISTANCE", "4"))
+
+# Store of every extracted receipt, queried through the `/receipts` endpoints; rows are
+# written in batches of up to the given size, or after the given delay
+STORE_ENABLED = os.getenv("RECEIPT_STORE_ENABLED", "true").lower() == "true"
+STORE_PATH = os.getenv("RECEIPT_STORE_PATH", "receipts.sqlite3")
+STORE_BATCH_SIZE = int(os.getenv("RECEIPT_STORE_BATCH_SIZE", "200"))
+STORE_FLUSH_SECONDS = float(os.getenv("RECEIPT_STORE_FLUSH_SECONDS", "0.5"))
+
+# Columnar copy of the stored receipts behind the `/analytics` endpoint (needs the store)
+ANALYTICS_ENABLED = os.getenv("RECEIPT_ANALYTICS_ENABLED", "true").lower() == "true"
+ANALYTICS_DIR = os.getenv("RECEIPT_ANALYTICS_DIR", "receipt_analytics")
+
+# Worker processes started by `serve.py` (0 = one per CPU core). With more than one, the
+# rate-limit buckets, metrics and job hand-off are shared through the given SQLite file
+WORKERS = int(os.getenv("RECEIPT_WORKERS", "1"))
+SHARED_STATE_PATH = os.getenv("RECEIPT_SHARED_STATE_PATH", "receipt_shared_state.sqlite3")
+
+# Background job queue used by the `/jobs` endpoints
+JOB_DB_PATH = os.getenv("RECEIPT_JOB_DB_PATH", "receipt_jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("RECEIPT_JOB_WORKERS", "4"))
+JOB_MAX_QUEUE_DEPTH = int(os.getenv("RECEIPT_JOB_MAX_QUEUE_DEPTH", "1000"))
+JOB_MAX_QUEUED_BYTES = int(os.getenv("RECEIPT_JOB_MAX_QUEUED_MB", "512")) * 1024 * 1024
+
+# Providers used for receipt extraction, in order of preference (`gemini`, `openai`, `ollama` or `fake`)
+PROVIDERS = [p.strip() for p in os.getenv("RECEIPT_PROVIDERS", "gemini,openai").split(",") if p.strip()]
+
+# Cascade: a local vision model served by Ollama extracts every receipt first, and only
+# answers failing the consistency checks (or local errors) escalate to the providers above.
+# Calls beyond the local concurrency go straight to the providers instead of queueing.
+CASCADE_ENABLED = os.getenv("RECEIPT_CASCADE_ENABLED", "false").lower() == "true"
+OLLAMA_MODEL = os.getenv("RECEIPT_OLLAMA_MODEL", "llama3.2-vision")
+OLLAMA_BASE_URL = os.getenv("RECEIPT_OLLAMA_BASE_URL", "http://localhost:11434")
+CASCADE_LOCAL_TIMEOUT_SECONDS = float(os.getenv("RECEIPT_CASCADE_LOCAL_TIMEOUT_SECONDS", "30"))
+CASCADE_LOCAL_CONCURRENCY = int(os.getenv("RECEIPT_CASCADE_LOCAL_CONCURRENCY", "2"))
+# Largest difference (in currency units) between receipt amounts that should add up
+CONSISTENCY_TOLERANCE = float(os.getenv("RECEIPT_CONSISTENCY_TOLERANCE", "0.05"))
+# Validation of every extracted receipt against the same consistency checks: a receipt whose
+# items or totals do not add up has only that section re-read, with a smaller prompt and schema
+VALIDATION_ENABLED = os.getenv("RECEIPT_VALIDATION_ENABLED", "true").lower() == "true"
+
+# Provider packages are imported and models built on first use instead of at import time;
+# the warm-up builds them (and starts the pre-processing workers) while the server starts
+LAZY_MODELS = os.getenv("RECEIPT_LAZY_MODELS", "true").lower() == "true"
+WARM_UP = os.getenv("RECEIPT_WARM_UP", "true").lower() == "true"
+
+# Shared keep-alive HTTP connection pool of the OpenAI client: connection limits per client,
+# idle connections kept open and for how long, HTTP/2 (needs the `h2` package) and timeout
+HTTP_MAX_CONNECTIONS = int(os.getenv("RECEIPT_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("RECEIPT_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("RECEIPT_HTTP_KEEPALIVE_SECONDS", "60"))
+HTTP2_ENABLED = os.getenv("RECEIPT_HTTP2", "true").lower() == "true"
+HTTP_TIMEOUT_SECONDS = float(os.getenv("RECEIPT_HTTP_TIMEOUT_SECONDS", "60"))
+
+# Latency-aware routing between providers and its circuit breaker
+ROUTER_WINDOW = int(os.getenv("RECEIPT_ROUTER_WINDOW", "100"))
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("RECEIPT_ROUTER_FAILURE_THRESHOLD", "5"))
+ROUTER_COOLDOWN_SECONDS = float(os.getenv("RECEIPT_ROUTER_COOLDOWN_SECONDS", "30"))
+
+# Hedged requests: if the primary provider has not answered within the delay, the same
+# request is sent to a secondary provider and the first answer wins. Without a fixed
+# delay, the primary's observed latency percentile is used (default delay until known).
+HEDGE_ENABLED = os.getenv("RECEIPT_HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_DELAY_SECONDS = float(os.getenv("RECEIPT_HEDGE_DELAY_SECONDS")) if os.getenv("RECEIPT_HEDGE_DELAY_SECONDS") else None
+HEDGE_PERCENTILE = float(os.getenv("RECEIPT_HEDGE_PERCENTILE", "0.9"))
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("RECEIPT_HEDGE_DEFAULT_DELAY_SECONDS", "5"))
+
+# Offline fake model (`RECEIPT_PROVIDERS=fake`) used for benchmarks without API keys
+FAKE_LATENCY_SECONDS = float(os.getenv("RECEIPT_FAKE_LATENCY_SECONDS", "1.0"))
+FAKE_JITTER_SECONDS = float(os.getenv("RECEIPT_FAKE_JITTER_SECONDS", "0.2"))
+FAKE_FAILURE_RATE = float(os.getenv("RECEIPT_FAKE_FAILURE_RATE", "0"))
+FAKE_SEED = int(os.getenv("RECEIPT_FAKE_SEED", "0"))
+
+# Log one structured line with the stage timings of every extraction
+REQUEST_TIMING_LOGS = os.getenv("RECEIPT_TIMING_LOGS", "false").lower() == "true"
+
+# Upload limits: maximum size of one image, and upload bytes a worker holds in memory at
+# once (further uploads wait up to the given time for room, then get a 503)
+MAX_UPLOAD_BYTES = int(os.getenv("RECEIPT_MAX_UPLOAD_MB", "20")) * 1024 * 1024
+MAX_IN_FLIGHT_UPLOAD_BYTES = int(os.getenv("RECEIPT_MAX_IN_FLIGHT_UPLOAD_MB", "256")) * 1024 * 1024
+UPLOAD_BUDGET_WAIT_SECONDS = float(os.getenv("RECEIPT_UPLOAD_BUDGET_WAIT_SECONDS", "30"))
+
+# Provider rate limits as `provider:requests_per_minute:tokens_per_minute` entries, e.g.
+# `gemini:2000:4000000,openai:500:200000` (0 or no entry means unlimited). Calls wait in
+# a bounded priority queue for quota and are rejected (429/503) if the wait gets too long;
+# rate-limit errors from the provider itself are retried with jittered exponential backoff.
+RATE_LIMITS = {
+    name.strip(): (float(rpm or 0), float(tpm or 0))
+    for name, _, rest in (
+        entry.partition(":") for entry in os.getenv("RECEIPT_RATE_LIMITS", "").split(",") if entry.strip()
+    )
+    for rpm, _, tpm in [rest.partition(":")]
+}
+RATE_LIMIT_DEFAULT_TOKENS = int(os.getenv("RECEIPT_RATE_LIMIT_DEFAULT_TOKENS", "1500"))
+RATE_LIMIT_MAX_WAITING = int(os.getenv("RECEIPT_RATE_LIMIT_MAX_WAITING", "256"))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RECEIPT_RATE_LIMIT_MAX_WAIT_SECONDS", "30"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RECEIPT_RATE_LIMIT_MAX_RETRIES", "3"))
+RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv("RECEIPT_RATE_LIMIT_BACKOFF_SECONDS", "1"))
+RATE_LIMIT_MAX_BACKOFF_SECONDS = float(os.getenv("RECEIPT_RATE_LIMIT_MAX_BACKOFF_SECONDS", "30"))
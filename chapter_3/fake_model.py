@@ -0,0 +1,122 @@
+"""
+File: fake_model.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Deterministic stand-in for a structured-output chat model, used to benchmark
+and exercise the receipt API offline without API keys. Latency, jitter and failure rate
+are configurable, and the same seed always produces the same sequence of outcomes.
+
+Usage:
+1. Set `RECEIPT_PROVIDERS=fake` to make the receipt processor use this model.
+2. Tune it with `RECEIPT_FAKE_LATENCY_SECONDS`, `RECEIPT_FAKE_JITTER_SECONDS`,
+   `RECEIPT_FAKE_FAILURE_RATE` and `RECEIPT_FAKE_SEED`.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+
+from langchain_core.messages import AIMessage
+
+# Receipt returned by the fake model, valid against the `Receipt` schema
+SAMPLE_RECEIPT = {
+    "merchant": {"name": "Corner Market", "address": "123 Main St, Springfield"},
+    "transaction": {
+        "date": "2025-02-27",
+        "subtotal": 14.5,
+        "tax": 1.16,
+        "tip": None,
+        "discount": None,
+        "total": 15.66,
+    },
+    "items": [
+        {"name": "Coffee", "quantity": 2, "price": 3.5},
+        {"name": "Bagel", "quantity": 1, "price": 2.5},
+        {"name": "Orange Juice", "quantity": 1, "price": 5.0},
+    ],
+}
+
+
+class FakeModelError(Exception):
+    """Simulated provider failure."""
+
+
+class FakeReceiptModel:
+    """Fake chat model answering every request with `SAMPLE_RECEIPT` after a simulated delay."""
+
+    def __init__(
+        self,
+        latency: float = 1.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+        schema=None,
+        response=None,
+        include_raw: bool = False,
+    ):
+        """
+        Parameters:
+        - latency (float): Mean response time in seconds.
+        - jitter (float): Maximum random deviation from the mean, in seconds.
+        - failure_rate (float): Fraction of calls that raise `FakeModelError`.
+        - seed (int): Seed of the random generator, for reproducible runs.
+        - schema (type | None): Pydantic model the response is validated into.
+        - response (dict | None): Response payload, defaults to `SAMPLE_RECEIPT`.
+        - include_raw (bool): Whether to answer like `with_structured_output(..., include_raw=True)`.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.schema = schema
+        self.response = response if response is not None else SAMPLE_RECEIPT
+        self.include_raw = include_raw
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def with_structured_output(self, schema, include_raw: bool = False):
+        """Returns a copy of the model that answers with instances of `schema`."""
+        return FakeReceiptModel(
+            self.latency, self.jitter, self.failure_rate, self.seed, schema, self.response, include_raw
+        )
+
+    def _next_outcome(self) -> tuple:
+        """Draws the delay and success of the next call."""
+        with self._lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            failed = self._random.random() < self.failure_rate
+        return delay, failed
+
+    def _respond(self, failed: bool):
+        if failed:
+            raise FakeModelError("Simulated provider failure")
+        parsed = dict(self.response) if self.schema is None else self.schema.model_validate(self.response)
+        if not self.include_raw:
+            return parsed
+
+        # Mimic the raw message of a real provider, including a rough token count
+        content = json.dumps(self.response)
+        raw = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": 300,
+                "output_tokens": len(content) // 4,
+                "total_tokens": 300 + len(content) // 4,
+            },
+        )
+        return {"raw": raw, "parsed": parsed, "parsing_error": None}
+
+    def invoke(self, messages, config=None, **kwargs):
+        """Blocks for the simulated delay, then returns the response or raises."""
+        delay, failed = self._next_outcome()
+        time.sleep(delay)
+        return self._respond(failed)
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        """Async version of `invoke` that sleeps without blocking the event loop."""
+        delay, failed = self._next_outcome()
+        await asyncio.sleep(delay)
+        return self._respond(failed)
@@ -0,0 +1,242 @@
+"""
+File: fake_ollama.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Local stand-in for an Ollama server, used to exercise and benchmark the
+local-model cascade without a GPU or a downloaded model. It speaks the parts of the
+Ollama HTTP API that `ChatOllama` uses (`/api/chat`, streamed or not, with JSON-schema
+output or tool calls, plus `/api/tags` and `/api/version`) and answers every chat with
+`SAMPLE_RECEIPT` after a simulated delay. A configurable share of the answers has a
+wrong total (so the consistency checks escalate them), is not JSON, or fails with an
+HTTP error. `test_model_cascade.py` runs the cascade against it.
+
+Usage:
+1. Run `python3 fake_ollama.py --port 11434 --latency 0.3 --inconsistent-rate 0.2`.
+2. Start the API with `RECEIPT_CASCADE_ENABLED=true RECEIPT_OLLAMA_BASE_URL=http://localhost:11434`.
+3. Or start it in-process with `server = FakeOllamaServer(port=0).start()` and read `server.url`
+   (the benchmark does this with `--local-tier`).
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fake_model import SAMPLE_RECEIPT
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Answers the Ollama API requests with the settings of the owning `FakeOllamaServer`."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep the benchmark output readable
+        pass
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        fake = self.server.fake
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": fake.model, "model": fake.model, "size": 0}]})
+        elif self.path == "/api/version":
+            self._send_json(200, {"version": "0.5.7"})
+        elif self.path == "/":
+            self._send_json(200, {"status": "Ollama is running"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        fake = self.server.fake
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path == "/api/show":
+            self._send_json(200, {"details": {"family": "fake"}, "capabilities": ["completion", "vision"]})
+            return
+        if self.path != "/api/chat":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        delay, outcome = fake.next_outcome()
+        time.sleep(delay)
+        if outcome == "failure":
+            self._send_json(500, {"error": "simulated model failure"})
+            return
+        self._send_chat(request, fake.answer(outcome == "inconsistent"), delay, outcome == "invalid")
+
+    def _send_chat(self, request: dict, receipt: dict, delay: float, invalid: bool = False) -> None:
+        """Sends the answer as a tool call or as JSON content, in one response or streamed."""
+        fake = self.server.fake
+        if invalid:
+            message = {"role": "assistant", "content": "Sorry, I cannot read this receipt."}
+        elif request.get("tools"):
+            name = request["tools"][0]["function"]["name"]
+            message = {
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [{"function": {"name": name, "arguments": receipt}}],
+            }
+        else:
+            message = {"role": "assistant", "content": json.dumps(receipt)}
+
+        images = sum(len(m.get("images") or []) for m in request.get("messages", []))
+        final = {
+            "model": fake.model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int(delay * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": 40 + 600 * images,
+            "eval_count": len(json.dumps(receipt)) // 4,
+        }
+        if not request.get("stream", True):
+            self._send_json(200, {**final, "message": message})
+            return
+
+        # Streamed answers are newline-delimited JSON: the message, then the final counts
+        lines = [
+            {"model": fake.model, "created_at": final["created_at"], "message": message, "done": False},
+            {**final, "message": {"role": "assistant", "content": ""}},
+        ]
+        body = b"".join(json.dumps(line).encode("utf-8") + b"\n" for line in lines)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOllamaServer:
+    """Threaded HTTP server emulating Ollama, answering with `SAMPLE_RECEIPT`."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 11434,
+        model: str = "llama3.2-vision",
+        latency: float = 0.3,
+        jitter: float = 0.0,
+        inconsistent_rate: float = 0.0,
+        failure_rate: float = 0.0,
+        invalid_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        """
+        Parameters:
+        - host (str): Address to listen on.
+        - port (int): Port to listen on (0 picks a free one).
+        - model (str): Model name reported by the server.
+        - latency (float): Mean response time in seconds.
+        - jitter (float): Maximum random deviation from the mean, in seconds.
+        - inconsistent_rate (float): Fraction of answers whose total does not add up.
+        - failure_rate (float): Fraction of calls answered with HTTP 500.
+        - invalid_rate (float): Fraction of answers that are plain text instead of a receipt.
+        - seed (int): Seed of the random generator, for reproducible runs.
+        """
+        self.model = model
+        self.latency = latency
+        self.jitter = jitter
+        self.inconsistent_rate = inconsistent_rate
+        self.failure_rate = failure_rate
+        self.invalid_rate = invalid_rate
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_outcome(self) -> tuple:
+        """Draws the delay and outcome (`ok`, `inconsistent`, `invalid` or `failure`) of the next call."""
+        with self._lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            draw = self._random.random()
+        if draw < self.failure_rate:
+            return delay, "failure"
+        if draw < self.failure_rate + self.inconsistent_rate:
+            return delay, "inconsistent"
+        if draw < self.failure_rate + self.inconsistent_rate + self.invalid_rate:
+            return delay, "invalid"
+        return delay, "ok"
+
+    @staticmethod
+    def answer(inconsistent: bool) -> dict:
+        """Returns the receipt answered, with a misread total if `inconsistent`."""
+        if not inconsistent:
+            return SAMPLE_RECEIPT
+        transaction = SAMPLE_RECEIPT["transaction"]
+        transaction = dict(transaction, total=transaction["total"] + 10)
+        return dict(SAMPLE_RECEIPT, transaction=transaction)
+
+    def start(self) -> "FakeOllamaServer":
+        """Serves requests in a background thread and returns the server."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops serving and closes the listening socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+
+def main():
+    """
+    Parses the command line and serves the fake Ollama API until interrupted.
+    """
+    parser = argparse.ArgumentParser(description="Run a stand-in Ollama server answering with a sample receipt.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=11434, help="Port to listen on")
+    parser.add_argument("--model", default="llama3.2-vision", help="Model name reported by the server")
+    parser.add_argument("--latency", type=float, default=0.3, help="Mean response time in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Response time jitter in seconds")
+    parser.add_argument("--inconsistent-rate", type=float, default=0.0, help="Fraction of answers with a wrong total")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of calls failing with HTTP 500")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="Fraction of answers that are not JSON")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the simulated outcomes")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(
+        host=args.host,
+        port=args.port,
+        model=args.model,
+        latency=args.latency,
+        jitter=args.jitter,
+        inconsistent_rate=args.inconsistent_rate,
+        failure_rate=args.failure_rate,
+        invalid_rate=args.invalid_rate,
+        seed=args.seed,
+    )
+    print(f"Fake Ollama listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
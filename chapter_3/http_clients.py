@@ -0,0 +1,142 @@
+"""
+File: http_clients.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Shared, pooled HTTP clients for the provider SDKs. One sync and one async
+`httpx` client per process keep connections to the provider alive between requests
+(optionally over HTTP/2), so TLS handshakes stop showing up in per-request latency.
+Requests are counted by the transports and the connection pools are inspected for
+utilization metrics.
+
+Usage:
+1. Create the pool, e.g. `pool = HttpClientPool(max_connections=100, max_keepalive=20)`.
+2. Pass `pool.sync_client` and `pool.async_client` to the SDK, e.g.
+   `ChatOpenAI(http_client=pool.sync_client, http_async_client=pool.async_client)`.
+3. Read the utilization with `pool.stats()` and close the clients with `await pool.aclose()`.
+"""
+
+import importlib.util
+import threading
+
+import httpx
+
+
+def http2_available() -> bool:
+    """Returns whether the `h2` package needed for HTTP/2 is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+class _Counters:
+    """Requests sent and currently waiting for their response headers, across both clients."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+
+    def started(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def finished(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    """Pooled sync transport that counts the requests going through it."""
+
+    def __init__(self, counters: _Counters, **kwargs):
+        super().__init__(**kwargs)
+        self.counters = counters
+
+    def handle_request(self, request):
+        self.counters.started()
+        try:
+            return super().handle_request(request)
+        finally:
+            self.counters.finished()
+
+
+class _AsyncCountingTransport(httpx.AsyncHTTPTransport):
+    """Pooled async transport that counts the requests going through it."""
+
+    def __init__(self, counters: _Counters, **kwargs):
+        super().__init__(**kwargs)
+        self.counters = counters
+
+    async def handle_async_request(self, request):
+        self.counters.started()
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.counters.finished()
+
+
+class HttpClientPool:
+    """Shared sync and async `httpx` clients with keep-alive connection pools."""
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        keepalive_seconds: float = 60,
+        http2: bool = True,
+        timeout_seconds: float = 60,
+    ):
+        """
+        Parameters:
+        - max_connections (int): Most connections each client opens at once; further
+          requests wait for a free one.
+        - max_keepalive (int): Most idle connections each client keeps open for reuse.
+        - keepalive_seconds (float): How long an idle connection is kept open.
+        - http2 (bool): Whether to use HTTP/2 (only if the `h2` package is installed).
+        - timeout_seconds (float): Timeout of every request.
+        """
+        self.max_connections = max_connections
+        self.http2 = http2 and http2_available()
+        self.counters = _Counters()
+        transport_options = {
+            "limits": httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_seconds,
+            ),
+            "http2": self.http2,
+        }
+        self._transports = [
+            _CountingTransport(self.counters, **transport_options),
+            _AsyncCountingTransport(self.counters, **transport_options),
+        ]
+
+        timeout = httpx.Timeout(timeout_seconds)
+        self.sync_client = httpx.Client(transport=self._transports[0], timeout=timeout)
+        self.async_client = httpx.AsyncClient(transport=self._transports[1], timeout=timeout)
+
+    def stats(self) -> dict:
+        """
+        Returns the pool utilization.
+
+        Returns:
+        - dict: Requests sent and in flight, open and idle connections of both clients,
+          and the share of `max_connections` busy.
+        """
+        # httpcore does not publish its pool state, read it defensively
+        connections = []
+        for transport in self._transports:
+            connections.extend(getattr(getattr(transport, "_pool", None), "connections", ()))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {
+            "requests": self.counters.requests,
+            "in_flight": self.counters.in_flight,
+            "connections_open": len(connections),
+            "connections_idle": idle,
+            "utilization": (len(connections) - idle) / (len(self._transports) * self.max_connections),
+            "http2": self.http2,
+        }
+
+    async def aclose(self) -> None:
+        """Closes the connections of both clients."""
+        self.sync_client.close()
+        await self.async_client.aclose()
@@ -0,0 +1,423 @@
+"""
+File: image_preprocessor.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Shrinks receipt images before they are base64-encoded and sent to the model.
+Sniffs the real MIME type, fixes EXIF orientation, crops to the receipt, downscales to a
+maximum long edge, converts to grayscale and re-encodes as JPEG at a tunable quality.
+It can also compute a perceptual hash of the receipt, used to spot re-photographed receipts,
+and split long receipts and multi-page PDFs into overlapping tiles.
+
+Usage:
+1. Call `preprocess_image(image_bytes)` to get the smaller image, its MIME type and byte counts.
+2. The function is pure and picklable, so it can run inside a process pool.
+3. Call `perceptual_hash(image_bytes)` for the fingerprint alone.
+4. Call `tile_image(image_bytes)` to split a tall image or a PDF into tiles (None if the
+   image is short enough to send whole).
+5. Call `prepare_image(image_bytes)` to do both in one pass: it tiles long receipts and
+   shrinks the rest, decoding and cropping the image only once.
+"""
+
+import io
+import math
+
+from PIL import Image, ImageFilter, ImageOps, ImageStat
+
+# Magic numbers of the image formats accepted by the multimodal models
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+]
+
+
+def sniff_mime_type(image_bytes: bytes, default: str = "image/jpeg") -> str:
+    """
+    Detects the image format from its leading bytes instead of trusting the upload.
+
+    Parameters:
+    - image_bytes (bytes): Raw image bytes.
+    - default (str): MIME type to assume when the format is not recognised.
+
+    Returns:
+    - str: The detected MIME type.
+    """
+    for signature, mime_type in _SIGNATURES:
+        if image_bytes.startswith(signature):
+            return mime_type
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    if image_bytes[4:8] == b"ftyp" and image_bytes[8:12] in (b"heic", b"heix", b"mif1"):
+        return "image/heic"
+    return default
+
+
+def _crop_to_receipt(image: Image.Image) -> Image.Image:
+    """
+    Crops the image to the bright paper area of the receipt.
+
+    The detection runs on a small thumbnail: pixels brighter than the average are
+    treated as paper, eroded to drop specks, and their bounding box (plus a small
+    margin) is mapped back onto the full-size image. The crop is skipped when the
+    detected area is implausibly small or already covers almost the whole image.
+    """
+    thumbnail = image.convert("L")
+    thumbnail.thumbnail((256, 256))
+
+    threshold = ImageStat.Stat(thumbnail).mean[0]
+    mask = thumbnail.point(lambda p: 255 if p > threshold else 0).filter(ImageFilter.MinFilter(5))
+    bbox = mask.getbbox()
+    if bbox is None:
+        return image
+
+    scale_x = image.width / thumbnail.width
+    scale_y = image.height / thumbnail.height
+    left, top, right, bottom = bbox
+    margin_x, margin_y = 0.02 * image.width, 0.02 * image.height
+    box = (
+        max(0, int(left * scale_x - margin_x)),
+        max(0, int(top * scale_y - margin_y)),
+        min(image.width, int(right * scale_x + margin_x)),
+        min(image.height, int(bottom * scale_y + margin_y)),
+    )
+
+    coverage = (box[2] - box[0]) * (box[3] - box[1]) / (image.width * image.height)
+    if coverage < 0.15 or coverage > 0.9:
+        return image
+    return image.crop(box)
+
+
+def dhash(image: Image.Image, hash_size: int = 16) -> int:
+    """
+    Computes the difference hash of an image: it is shrunk to a `(hash_size + 1) x hash_size`
+    grayscale thumbnail, with contrast normalized, and every bit tells whether a pixel is
+    brighter than its right neighbour. Photos of the same receipt give hashes a few bits
+    apart, whatever their resolution, exposure or compression.
+
+    Parameters:
+    - image (Image.Image): Upright image, ideally cropped to the receipt.
+    - hash_size (int): Number of rows of the hash; it has `hash_size ** 2` bits.
+
+    Returns:
+    - int: The hash as an integer.
+    """
+    thumbnail = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(ImageOps.autocontrast(thumbnail).getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            value = value << 1 | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+def perceptual_hash(image_bytes: bytes, hash_size: int = 16, autocrop: bool = True):
+    """
+    Computes the perceptual hash of a receipt photo (see `dhash`), after fixing its
+    orientation and cropping it to the receipt.
+
+    Returns:
+    - int | None: The hash, or None if the image cannot be decoded.
+    """
+    try:
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    except Exception:
+        return None
+    if autocrop:
+        image = _crop_to_receipt(image)
+    return dhash(image, hash_size)
+
+
+def preprocess_image(
+    image_bytes: bytes,
+    max_long_edge: int = 1600,
+    quality: int = 80,
+    grayscale: bool = True,
+    autocrop: bool = True,
+    hash_size: int = 0,
+):
+    """
+    Shrinks a receipt image so fewer bytes and image tokens are sent to the model.
+
+    Steps:
+    1. Sniffs the MIME type from the image bytes.
+    2. Applies the EXIF orientation so the text is upright.
+    3. Optionally crops to the receipt (and hashes it) and converts to grayscale.
+    4. Downscales so the longest edge is at most `max_long_edge`.
+    5. Re-encodes as JPEG, keeping the original if that would not be smaller.
+
+    Parameters:
+    - image_bytes (bytes): Raw image bytes of the receipt.
+    - max_long_edge (int): Maximum length in pixels of the longest image edge.
+    - quality (int): JPEG quality used for the re-encoded image.
+    - grayscale (bool): Whether to drop colour information.
+    - autocrop (bool): Whether to crop away the background around the receipt.
+    - hash_size (int): Size of the perceptual hash to compute (see `dhash`), 0 to skip it.
+
+    Returns:
+    - tuple: (processed bytes, MIME type, dict with `original_bytes` and `processed_bytes`,
+      plus `perceptual_hash` if requested and the image could be decoded).
+    """
+    try:
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+    except Exception:
+        # Unsupported format (e.g. HEIC without a plugin), send the image as-is
+        return _unchanged(image_bytes)
+
+    if autocrop:
+        image = _crop_to_receipt(image)
+    return _shrink(image, image_bytes, max_long_edge, quality, grayscale, hash_size)
+
+
+def _unchanged(image_bytes: bytes) -> tuple:
+    """Result of `preprocess_image` for an image that cannot be decoded: the original bytes."""
+    return image_bytes, sniff_mime_type(image_bytes), {
+        "original_bytes": len(image_bytes),
+        "processed_bytes": len(image_bytes),
+    }
+
+
+def _shrink(
+    image: Image.Image, image_bytes: bytes, max_long_edge: int, quality: int, grayscale: bool, hash_size: int
+) -> tuple:
+    """
+    Hashes, converts, downscales and re-encodes an upright (and already cropped) image.
+
+    Returns:
+    - tuple: Same as `preprocess_image`.
+    """
+    mime_type = sniff_mime_type(image_bytes)
+
+    # Hash the cropped receipt before it is resized, so the fingerprint does not depend on settings
+    fingerprint = dhash(image, hash_size) if hash_size else None
+
+    image = image.convert("L" if grayscale else "RGB")
+
+    if max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    processed_bytes = output.getvalue()
+
+    # Re-encoding a small, already-compressed image can make it bigger
+    if len(processed_bytes) >= len(image_bytes):
+        processed_bytes = image_bytes
+    else:
+        mime_type = "image/jpeg"
+
+    info = {"original_bytes": len(image_bytes), "processed_bytes": len(processed_bytes)}
+    if fingerprint is not None:
+        info["perceptual_hash"] = fingerprint
+    return processed_bytes, mime_type, info
+
+
+def _render_pdf_pages(pdf_bytes: bytes, dpi: int, max_pages: int) -> list:
+    """
+    Renders the pages of a PDF to images (needs the optional `pypdfium2` package).
+
+    Returns:
+    - list: One `Image.Image` per page, at most `max_pages`.
+    """
+    import pypdfium2
+
+    document = pypdfium2.PdfDocument(pdf_bytes)
+    try:
+        return [
+            document[index].render(scale=dpi / 72).to_pil()
+            for index in range(min(len(document), max_pages))
+        ]
+    finally:
+        document.close()
+
+
+def _encode_tile(image: Image.Image, max_long_edge: int, quality: int, grayscale: bool) -> bytes:
+    """Converts, downscales and JPEG-encodes one tile."""
+    image = image.convert("L" if grayscale else "RGB")
+    if max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def _tile_boxes(width: int, height: int, tile_aspect: float, overlap: float, max_tiles: int) -> list:
+    """
+    Splits a `width x height` page into horizontal bands of about `tile_aspect` times the
+    width, each overlapping the next by `overlap` of its height, so no line of text is
+    only ever seen cut in half. Bands get taller if more than `max_tiles` would be needed.
+
+    Returns:
+    - list: (left, top, right, bottom) crop boxes, top to bottom.
+    """
+    tile_height = min(height, int(width * tile_aspect))
+    step = max(1, int(tile_height * (1 - overlap)))
+    count = math.ceil(max(0, height - tile_height) / step) + 1
+    if count > max_tiles:
+        # Fewer, taller tiles: solve height = tile_height + (max_tiles - 1) * step for tile_height
+        tile_height = math.ceil(height / (1 + (max_tiles - 1) * (1 - overlap)))
+        step = max(1, int(tile_height * (1 - overlap)))
+        count = math.ceil(max(0, height - tile_height) / step) + 1
+
+    boxes = []
+    for index in range(count):
+        top = min(index * step, height - tile_height)
+        boxes.append((0, top, width, top + tile_height))
+    return boxes
+
+
+def tile_image(
+    image_bytes: bytes,
+    min_aspect: float = 2.5,
+    tile_aspect: float = 1.5,
+    overlap: float = 0.15,
+    max_tiles: int = 12,
+    pdf_dpi: int = 200,
+    max_long_edge: int = 1600,
+    quality: int = 80,
+    grayscale: bool = True,
+    autocrop: bool = True,
+):
+    """
+    Splits a long receipt (or every page of a PDF) into overlapping tiles that each keep
+    the text large enough to read after the model's own downscaling.
+
+    Steps:
+    1. Renders the pages of a PDF, or decodes and uprights the image.
+    2. Crops each page to the receipt, and leaves images no taller than `min_aspect` times
+       their width alone (they are sent whole, see `preprocess_image`).
+    3. Cuts each page into bands overlapping by `overlap` of their height.
+    4. Converts, downscales and JPEG-encodes every band.
+
+    Parameters:
+    - image_bytes (bytes): Raw image or PDF bytes.
+    - min_aspect (float): Height-to-width ratio from which an image is tiled.
+    - tile_aspect (float): Height-to-width ratio of a tile.
+    - overlap (float): Fraction of a tile's height shared with the next tile.
+    - max_tiles (int): Maximum number of tiles per page (and of PDF pages rendered).
+    - pdf_dpi (int): Resolution PDF pages are rendered at.
+    - max_long_edge (int): Maximum length in pixels of a tile's longest edge.
+    - quality (int): JPEG quality of the tiles.
+    - grayscale (bool): Whether to drop colour information.
+    - autocrop (bool): Whether to crop away the background around the receipt.
+
+    Returns:
+    - tuple | None: (list of (page index, JPEG tile) pairs, top to bottom and page by page,
+      dict with `pages` and `tiles`), or None if the image does not need tiling. Only tiles
+      of the same page overlap.
+    """
+    if sniff_mime_type(image_bytes) == "application/pdf":
+        pages = _render_pdf(image_bytes, pdf_dpi, max_tiles, autocrop)
+    else:
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            # Without cropping the size in the header decides, before any pixel is decoded
+            # (EXIF orientations 5-8 swap width and height)
+            width, height = image.size
+            if image.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                width, height = height, width
+            if not autocrop and height < min_aspect * width:
+                return None
+            image = ImageOps.exif_transpose(image)
+        except Exception:
+            return None
+        if autocrop:
+            image = _crop_to_receipt(image)
+        if image.height < min_aspect * image.width:
+            return None
+        pages = [image]
+
+    return _tile_pages(pages, tile_aspect, overlap, max_tiles, max_long_edge, quality, grayscale)
+
+
+def _tile_pages(
+    pages: list, tile_aspect: float, overlap: float, max_tiles: int, max_long_edge: int, quality: int, grayscale: bool
+) -> tuple:
+    """Cuts upright, cropped pages into encoded tiles, each with its page index (see `tile_image`)."""
+    tiles = []
+    for index, page in enumerate(pages):
+        for box in _tile_boxes(page.width, page.height, tile_aspect, overlap, max_tiles):
+            tiles.append((index, _encode_tile(page.crop(box), max_long_edge, quality, grayscale)))
+    return tiles, {"pages": len(pages), "tiles": len(tiles)}
+
+
+def _render_pdf(image_bytes: bytes, pdf_dpi: int, max_tiles: int, autocrop: bool) -> list:
+    """Renders the pages of a PDF, each cropped to the receipt if `autocrop` is set."""
+    pages = _render_pdf_pages(image_bytes, pdf_dpi, max_tiles)
+    if autocrop and len(pages) > 1:
+        pages = [_crop_to_receipt(page) for page in pages]
+    return pages
+
+
+def prepare_image(
+    image_bytes: bytes,
+    tiling: bool = True,
+    preprocess: bool = True,
+    min_aspect: float = 2.5,
+    tile_aspect: float = 1.5,
+    overlap: float = 0.15,
+    max_tiles: int = 12,
+    pdf_dpi: int = 200,
+    max_long_edge: int = 1600,
+    quality: int = 80,
+    grayscale: bool = True,
+    autocrop: bool = True,
+    hash_size: int = 0,
+) -> tuple:
+    """
+    Tiles or shrinks a receipt in one pass, decoding and cropping the image only once.
+
+    Steps:
+    1. Renders and tiles a PDF (with tiling on).
+    2. Decodes and uprights an image, then crops it to the receipt.
+    3. Cuts it into tiles if the cropped receipt is at least `min_aspect` times taller than
+       wide, otherwise shrinks it like `preprocess_image`.
+    The perceptual hash of an image (not of a PDF) is computed in both cases.
+
+    Parameters:
+    - image_bytes (bytes): Raw image or PDF bytes.
+    - tiling (bool): Whether long receipts and PDFs are tiled (see `tile_image`).
+    - preprocess (bool): Whether images sent whole are shrunk (see `preprocess_image`).
+    - hash_size (int): Size of the perceptual hash to compute (see `dhash`), 0 to skip it.
+    - The other parameters are those of `tile_image` and `preprocess_image`.
+
+    Returns:
+    - tuple: (tiles, prepared). `tiles` is the result of `tile_image` plus the
+      `perceptual_hash` in its counts, or None if the receipt is sent whole; `prepared` is
+      the result of `preprocess_image`, or None if the receipt was tiled or `preprocess` is off.
+    """
+    if sniff_mime_type(image_bytes) == "application/pdf":
+        if tiling:
+            pages = _render_pdf(image_bytes, pdf_dpi, max_tiles, autocrop)
+            return _tile_pages(pages, tile_aspect, overlap, max_tiles, max_long_edge, quality, grayscale), None
+        return None, _unchanged(image_bytes) if preprocess else None
+    if not (tiling or preprocess):
+        return None, None
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        if not preprocess and not autocrop:
+            # Only tiling could apply, and the size in the header decides it (see `tile_image`)
+            width, height = image.size
+            if image.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                width, height = height, width
+            if height < min_aspect * width:
+                return None, None
+        image = ImageOps.exif_transpose(image)
+    except Exception:
+        return None, _unchanged(image_bytes) if preprocess else None
+
+    if autocrop:
+        image = _crop_to_receipt(image)
+
+    if tiling and image.height >= min_aspect * image.width:
+        tiles, counts = _tile_pages([image], tile_aspect, overlap, max_tiles, max_long_edge, quality, grayscale)
+        if hash_size:
+            counts["perceptual_hash"] = dhash(image, hash_size)
+        return (tiles, counts), None
+    if not preprocess:
+        return None, None
+    return None, _shrink(image, image_bytes, max_long_edge, quality, grayscale, hash_size)
@@ -0,0 +1,233 @@
+"""
+File: job_queue.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: SQLite-backed queue of receipt extraction jobs. Uploaded images are stored
+with their status so clients can poll for results, and queued or interrupted jobs
+survive a server restart. Running jobs record the process running them, so the jobs of
+a worker process that died are requeued when the next one starts.
+
+Usage:
+1. Create the queue, e.g. `jobs = JobQueue("receipt_jobs.sqlite3")`.
+2. Call `jobs.enqueue(image_bytes)` to store a job and get its id.
+3. Workers call `jobs.start(job_id)`, then `jobs.finish(...)` or `jobs.fail(...)`.
+4. Clients read the job back with `jobs.get(job_id)`.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+# Job statuses, in the order a job moves through them
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a job does not fit within the queue depth or byte limits."""
+
+
+def _process_alive(pid: int) -> bool:
+    """Whether a process with the given id is running (on this machine)."""
+    if pid == os.getpid():
+        # A job owned by this process cannot be running yet, it just started
+        return False
+    if os.name == "nt":
+        # Signal 0 would terminate the process on Windows; assume it is still running
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Persistent store of receipt extraction jobs and their results."""
+
+    def __init__(self, path: str, max_depth: int = 1000, max_queued_bytes: int = 512 * 1024 * 1024):
+        """
+        Parameters:
+        - path (str): SQLite file holding the jobs.
+        - max_depth (int): Maximum number of jobs waiting to run.
+        - max_queued_bytes (int): Maximum total image size of the jobs waiting to run.
+        """
+        self.max_depth = max_depth
+        self.max_queued_bytes = max_queued_bytes
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                image BLOB,
+                size INTEGER NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        # Process running the job, added to queues created before it existed
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+
+    def enqueue(self, image_bytes: bytes) -> str:
+        """
+        Stores a new job if it fits within the queue limits.
+
+        Parameters:
+        - image_bytes (bytes): Raw image bytes of the receipt.
+
+        Returns:
+        - str: The new job id.
+
+        Raises:
+        - QueueFullError: If the queue is at its depth or byte limit.
+        """
+        job_id = uuid.uuid4().hex
+
+        with self._lock:
+            depth, queued_bytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()
+            if depth >= self.max_depth:
+                raise QueueFullError(f"Job queue is full ({depth} jobs waiting)")
+            if queued_bytes + len(image_bytes) > self.max_queued_bytes:
+                raise QueueFullError(f"Job queue is full ({queued_bytes} bytes waiting)")
+
+            self._db.execute(
+                "INSERT INTO jobs (id, status, image, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, image_bytes, len(image_bytes), time.time()),
+            )
+        return job_id
+
+    def recover(self, requeue_running: bool = True) -> List[str]:
+        """
+        Requeues jobs interrupted by a restart and lists every job waiting to run.
+
+        Parameters:
+        - requeue_running (bool): Whether every running job was interrupted. With several
+          workers, other workers may still be running theirs, so only the launcher requeues
+          them all, once, before the workers start (see `serve.py`); a worker starting later
+          (e.g. restarted after a crash) only requeues those of processes no longer running.
+
+        Returns:
+        - List[str]: Ids of the queued jobs, oldest first.
+        """
+        with self._lock:
+            running = self._db.execute(
+                "SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,)
+            ).fetchall()
+            stale = [
+                (QUEUED, job_id, RUNNING)
+                for job_id, owner in running
+                if requeue_running or owner is None or not _process_alive(owner)
+            ]
+            self._db.executemany(
+                "UPDATE jobs SET status = ?, started_at = NULL, owner = NULL WHERE id = ? AND status = ?",
+                stale,
+            )
+            rows = self._db.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def start(self, job_id: str) -> Optional[bytes]:
+        """
+        Marks a queued job as running.
+
+        Parameters:
+        - job_id (str): Id of the job to start.
+
+        Returns:
+        - bytes | None: The job's image, or None if the job is not waiting to run
+          (e.g. another worker process started it first).
+        """
+        with self._lock:
+            # Claim the job in a single statement, so only one worker process can win it
+            claimed = self._db.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, owner = ? WHERE id = ? AND status = ?",
+                (RUNNING, time.time(), os.getpid(), job_id, QUEUED),
+            ).rowcount
+            if not claimed:
+                return None
+            row = self._db.execute("SELECT image FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0]
+
+    def finish(self, job_id: str, result_json: str) -> None:
+        """Stores the extracted receipt JSON and drops the image, which is no longer needed."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, image = NULL, finished_at = ? WHERE id = ?",
+                (DONE, result_json, time.time(), job_id),
+            )
+
+    def requeue(self, job_id: str) -> None:
+        """Puts a running job back in the queue, e.g. when the provider is out of quota."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL, owner = NULL WHERE id = ? AND status = ?",
+                (QUEUED, job_id, RUNNING),
+            )
+
+    def fail(self, job_id: str, error: str) -> None:
+        """Stores the error of a failed job and drops its image."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, image = NULL, finished_at = ? WHERE id = ?",
+                (FAILED, error, time.time(), job_id),
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+        Reads a job's status and outcome.
+
+        Parameters:
+        - job_id (str): Id of the job.
+
+        Returns:
+        - dict | None: The job's id, status, result JSON, error and timestamps, or None if unknown.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, result, error, created_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        keys = ("id", "status", "result", "error", "created_at", "started_at", "finished_at")
+        return dict(zip(keys, row))
+
+    def stats(self) -> dict:
+        """
+        Returns the number of jobs per status and the bytes waiting in the queue.
+
+        Returns:
+        - dict: Job counts by status plus `queued_bytes`.
+        """
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+            queued_bytes = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()[0]
+        return {
+            **{status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)},
+            "queued_bytes": queued_bytes,
+        }
@@ -0,0 +1,247 @@
+"""
+File: metrics.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Minimal in-process metrics registry (counters, gauges and histograms with labels)
+rendered in the Prometheus text exposition format for the `/metrics` endpoint. With several
+worker processes, every worker publishes its samples to the shared state and renders the
+totals: counters and histograms are summed, gauges get a `worker` label.
+
+Usage:
+1. Declare a metric, e.g. `requests = registry.counter("receipt_requests_total", "Requests", ["endpoint"])`.
+2. Update it, e.g. `requests.inc(endpoint="/upload_receipt")`.
+3. Serve `registry.render()` as `text/plain; version=0.0.4`.
+4. With several workers, call `registry.share(state, worker_id)` once per worker.
+"""
+
+import math
+import threading
+
+# Default histogram buckets, in seconds, covering cache hits up to slow provider calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    """Formats label pairs as `{a="x",b="y"}` (empty string when there are none)."""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    """Escapes a label value as required by the exposition format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class holding a metric's name, help text, label names and values per label set."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> list:
+        """Returns the values per label set as JSON-serializable `[labels, value]` pairs."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merge(self, worker_samples: list) -> tuple:
+        """
+        Combines the samples of several workers (sums them).
+
+        Parameters:
+        - worker_samples (list): (worker id, samples) pairs.
+
+        Returns:
+        - tuple: (label names, label values -> value).
+        """
+        values = {}
+        for _, samples in worker_samples:
+            for key, value in samples:
+                values[tuple(key)] = values.get(tuple(key), 0) + value
+        return self.label_names, values
+
+    def render(self, label_names: tuple = None, values: dict = None) -> list:
+        """Returns the metric's exposition lines (of this process, or of merged samples)."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        if values is None:
+            label_names = self.label_names
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing value, e.g. number of requests."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. requests in flight."""
+
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def merge(self, worker_samples: list) -> tuple:
+        """Keeps every worker's values apart, under an extra `worker` label."""
+        values = {}
+        for worker, samples in worker_samples:
+            for key, value in samples:
+                values[(*key, worker)] = value
+        return (*self.label_names, "worker"), values
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, e.g. stage durations."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> list:
+        with self._lock:
+            return [[list(key), [list(counts), total]] for key, (counts, total) in self._values.items()]
+
+    def merge(self, worker_samples: list) -> tuple:
+        """Sums the bucket counts and totals of every worker."""
+        values = {}
+        for _, samples in worker_samples:
+            for key, (counts, total) in samples:
+                merged_counts, merged_total = values.get(tuple(key), ([0] * len(self.buckets), 0.0))
+                values[tuple(key)] = ([a + b for a, b in zip(merged_counts, counts)], merged_total + total)
+        return self.label_names, values
+
+    def render(self, label_names: tuple = None, values: dict = None) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        if values is None:
+            label_names = self.label_names
+            with self._lock:
+                values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            for bound, count in zip(self.buckets, counts):
+                labels = _format_labels(label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics plus callbacks refreshing gauges right before rendering."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+        # Shared state and id of this worker, when several workers serve the API
+        self._shared_state = None
+        self._worker = None
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names=()) -> Counter:
+        return self._register(Counter(name, help_text, label_names))
+
+    def gauge(self, name: str, help_text: str, label_names=()) -> Gauge:
+        return self._register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def add_collector(self, collector) -> None:
+        """Registers a callable run before every render, e.g. to copy cache stats into gauges."""
+        self._collectors.append(collector)
+
+    def share(self, state, worker: str) -> None:
+        """
+        Makes `render` report the metrics of every worker process.
+
+        Parameters:
+        - state (SharedState): State shared by the workers (see `shared_state.py`).
+        - worker (str): Id of this worker, e.g. its process id.
+        """
+        self._shared_state = state
+        self._worker = worker
+
+    def publish(self) -> None:
+        """Refreshes the gauges and stores this worker's samples in the shared state."""
+        for collector in self._collectors:
+            collector()
+        if self._shared_state is not None:
+            self._shared_state.publish_metrics(
+                self._worker, {metric.name: metric.samples() for metric in self._metrics}
+            )
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+        - str: The exposition text, ending with a newline.
+        """
+        self.publish()
+        lines = []
+        if self._shared_state is None:
+            for metric in self._metrics:
+                lines.extend(metric.render())
+            return "\n".join(lines) + "\n"
+
+        # Combine the samples the workers published last
+        by_metric = {}
+        for worker, name, samples in self._shared_state.metric_samples():
+            by_metric.setdefault(name, []).append((worker, samples))
+        for metric in self._metrics:
+            lines.extend(metric.render(*metric.merge(by_metric.get(metric.name, []))))
+        return "\n".join(lines) + "\n"
+
+
+# Registry shared by the whole API process
+registry = MetricsRegistry()
@@ -0,0 +1,182 @@
+"""
+File: model_cascade.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Two-tier extraction cascade. A local model (e.g. a vision model served by
+Ollama) answers first; its answer is kept if it parses and passes a consistency check,
+otherwise the call escalates to the cloud tier (the model router). Calls also go straight
+to the cloud when all local slots are busy, so a slow local model never queues requests.
+The hit rate of the local tier and the latency of both tiers are tracked.
+
+Usage:
+1. Create the cascade, e.g. `cascade = ModelCascade(local_model, check=receipt_problems)`.
+2. Call `cascade.invoke(messages, cloud_call, details)`, where `cloud_call()` calls the cloud
+   tier, or `await cascade.ainvoke(messages, cloud_call, details)` with an async `cloud_call`.
+3. `details` receives the answering `tier` and, for escalations, the `escalation_reason`.
+4. Read the hit rates and latencies with `cascade.stats()`.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values, fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ModelCascade:
+    """Tries a local structured-output model first and escalates failed answers to the cloud."""
+
+    def __init__(self, local_model, check, name: str = "local", max_concurrency: int = 2, window: int = 100):
+        """
+        Parameters:
+        - local_model: Structured-output model (`include_raw=True`) of the local tier.
+        - name (str): Provider name reported in `details` for local answers, e.g. `ollama`.
+        - check (callable): Returns the problems of a parsed answer, an empty list if it is acceptable.
+        - max_concurrency (int): Local calls in flight at once, further calls skip the local tier.
+        - window (int): Number of recent calls per tier used for the latency statistics.
+        """
+        self.local_model = local_model
+        self.check = check
+        self.name = name
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        self._lock = threading.Lock()
+        self.latencies = {"local": deque(maxlen=window), "cloud": deque(maxlen=window)}
+        self.counts = Counter()
+
+    def _record(self, tier: str, seconds: float, outcome: str) -> None:
+        with self._lock:
+            self.latencies[tier].append(seconds)
+            self.counts[f"{tier}_{outcome}"] += 1
+
+    def _accept(self, output, error, started: float, details: Optional[dict]) -> Optional[dict]:
+        """
+        Decides whether the local answer is kept, and records the outcome.
+
+        Returns:
+        - dict | None: The local output if accepted, None if the call must escalate.
+        """
+        seconds = time.perf_counter() - started
+        if error is not None:
+            reason = "error"
+            logger.warning("Local model failed, escalating: %s", error)
+        elif output.get("parsing_error") is not None or output.get("parsed") is None:
+            reason = "invalid"
+        elif self.check(output["parsed"]):
+            reason = "inconsistent"
+        else:
+            reason = None
+
+        self._record("local", seconds, reason or "accepted")
+        if details is not None:
+            details["local_model_seconds"] = round(seconds, 6)
+            if reason is None:
+                details.update(tier="local", provider=self.name)
+            else:
+                details["escalation_reason"] = reason
+        return output if reason is None else None
+
+    def _escalated(self, details: Optional[dict], started: float) -> None:
+        self._record("cloud", time.perf_counter() - started, "calls")
+        if details is not None:
+            details["tier"] = "cloud"
+
+    def _skip_local(self, details: Optional[dict]) -> None:
+        with self._lock:
+            self.counts["local_busy"] += 1
+        if details is not None:
+            details["escalation_reason"] = "busy"
+
+    def invoke(self, messages: list, cloud_call, details: Optional[dict] = None):
+        """
+        Extracts with the local model, escalating to `cloud_call()` when its answer is rejected.
+
+        Parameters:
+        - messages (list): Messages passed to the local model.
+        - cloud_call (callable): Calls the cloud tier and returns its output.
+        - details (dict | None): Optional dictionary receiving the tier and escalation reason.
+
+        Returns:
+        - dict: Structured output of the tier that answered.
+        """
+        if self._slots.acquire(blocking=False):
+            started = time.perf_counter()
+            output, error = None, None
+            try:
+                output = self.local_model.invoke(messages)
+            except Exception as exc:
+                error = exc
+            finally:
+                self._slots.release()
+            if self._accept(output, error, started, details) is not None:
+                return output
+        else:
+            self._skip_local(details)
+
+        started = time.perf_counter()
+        output = cloud_call()
+        self._escalated(details, started)
+        return output
+
+    async def ainvoke(self, messages: list, cloud_call, details: Optional[dict] = None):
+        """Async version of `invoke`, where `cloud_call()` returns an awaitable."""
+        if self._slots.acquire(blocking=False):
+            started = time.perf_counter()
+            output, error = None, None
+            try:
+                output = await self.local_model.ainvoke(messages)
+            except Exception as exc:
+                error = exc
+            finally:
+                self._slots.release()
+            if self._accept(output, error, started, details) is not None:
+                return output
+        else:
+            self._skip_local(details)
+
+        started = time.perf_counter()
+        output = await cloud_call()
+        self._escalated(details, started)
+        return output
+
+    def stats(self) -> dict:
+        """
+        Returns the cascade statistics.
+
+        Returns:
+        - dict: Local attempts, how they ended (accepted, error, invalid, inconsistent), calls
+          that skipped a busy local tier, the local hit rate over all calls, and the p50/p95
+          latency of both tiers.
+        """
+        with self._lock:
+            counts = dict(self.counts)
+            latencies = {tier: list(values) for tier, values in self.latencies.items()}
+        attempts = sum(
+            counts.get(f"local_{outcome}", 0) for outcome in ("accepted", "error", "invalid", "inconsistent")
+        )
+        calls = attempts + counts.get("local_busy", 0)
+        accepted = counts.get("local_accepted", 0)
+        return {
+            "calls": calls,
+            "local_attempts": attempts,
+            "local_accepted": accepted,
+            "local_errors": counts.get("local_error", 0),
+            "local_invalid": counts.get("local_invalid", 0),
+            "local_inconsistent": counts.get("local_inconsistent", 0),
+            "local_busy": counts.get("local_busy", 0),
+            "cloud_calls": counts.get("cloud_calls", 0),
+            "local_hit_rate": accepted / calls if calls else 0.0,
+            "local_p50_seconds": _percentile(latencies["local"], 0.5),
+            "local_p95_seconds": _percentile(latencies["local"], 0.95),
+            "cloud_p50_seconds": _percentile(latencies["cloud"], 0.5),
+            "cloud_p95_seconds": _percentile(latencies["cloud"], 0.95),
+        }
@@ -0,0 +1,483 @@
+"""
+File: model_router.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Latency-aware router over several structured-output models. It tracks the
+rolling p50/p95 latency and error rate of every provider, sends each call to the
+healthiest one, fails over to the next one on errors, and stops calling a provider
+for a while (circuit breaker) after repeated failures. Calls can optionally be hedged:
+if the primary provider is slow, the same request goes to a secondary one and the
+first answer wins. With an admission controller (see `rate_limiter.py`), every call
+first waits for quota of the provider it goes to.
+
+Usage:
+1. Create a router, e.g. `router = ModelRouter({"gemini": gemini_structured, "openai": openai_structured})`.
+2. Call `router.invoke(messages, details)` or `await router.ainvoke(messages, details)`.
+3. For hedged calls use `router.hedged_invoke(...)` or `await router.ahedged_invoke(...)`.
+4. `details` receives the chosen `provider` and the reason it was chosen.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Optional
+
+from rate_limiter import RateLimitedError, upstream_retry_after
+
+
+class CircuitTrialBusyError(RateLimitedError):
+    """Raised when a half-open provider is already handling its one trial call."""
+
+
+class ProviderStats:
+    """Rolling window of latencies and outcomes of one provider, plus its circuit breaker."""
+
+    def __init__(self, window: int, failure_threshold: int, cooldown_seconds: float):
+        """
+        Parameters:
+        - window (int): Number of recent calls used for the latency and error statistics.
+        - failure_threshold (int): Consecutive failures that open the circuit breaker.
+        - cooldown_seconds (float): How long an open circuit stays open before a trial call.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Returns the given latency percentile of the successful calls in the window."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        """Fraction of failed calls in the window."""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    @property
+    def state(self) -> str:
+        """Circuit breaker state: `closed`, `open` or `half-open`."""
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown_seconds:
+            return "open"
+        return "half-open"
+
+    def record(self, latency: float, ok: bool) -> None:
+        """Records the outcome of a call and opens or closes the circuit breaker."""
+        self.outcomes.append(ok)
+        self.trial_in_flight = False
+        if ok:
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            self.opened_at = None
+        else:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold or self.opened_at is not None:
+                # Open (or re-open after a failed trial call)
+                self.opened_at = time.monotonic()
+
+
+class ModelRouter:
+    """Routes structured-output calls to the healthiest of several providers."""
+
+    def __init__(
+        self,
+        models: dict,
+        window: int = 100,
+        failure_threshold: int = 5,
+        cooldown_seconds: float = 30,
+        executor=None,
+        validate=None,
+        limiter=None,
+    ):
+        """
+        Parameters:
+        - models (dict): Provider name -> runnable (e.g. `model.with_structured_output(Receipt)`),
+          in order of preference.
+        - window (int): Number of recent calls per provider used for the statistics.
+        - failure_threshold (int): Consecutive failures that open a provider's circuit breaker.
+        - cooldown_seconds (float): How long an open circuit stays open before a trial call.
+        - executor (Executor | None): Thread pool for providers without native async support.
+        - validate (callable | None): Called with every model output; raising marks the call
+          as failed (so it fails over, or loses a hedge) instead of returning the output.
+        - limiter (AdmissionController | None): Admission control applying each provider's
+          rate limits and retrying its rate-limit errors.
+        """
+        if not models:
+            raise ValueError("ModelRouter needs at least one model.")
+
+        self.models = models
+        self.executor = executor
+        self.validate = validate
+        self.limiter = limiter
+        self.stats = {
+            name: ProviderStats(window, failure_threshold, cooldown_seconds) for name in models
+        }
+        self._lock = threading.Lock()
+
+        # Counters of hedged calls (see `hedged_invoke`)
+        self.hedge_counters = {"calls": 0, "fired": 0, "won": 0}
+
+    def _score(self, name: str) -> float:
+        """
+        Lower is better: p95 latency inflated by the error rate. Untried providers score 0
+        so they get sampled, providers that only ever failed score last.
+        """
+        stats = self.stats[name]
+        if not stats.latencies:
+            return 0.0 if not stats.outcomes else float("inf")
+        return stats.percentile(0.95) * (1 + 4 * stats.error_rate)
+
+    def ranked(self) -> list:
+        """
+        Orders the providers for the next call.
+
+        Returns:
+        - list: (provider name, reason) pairs, healthiest first. Providers with an open
+          circuit are left out, and a half-open provider only gets one trial call at a time.
+        """
+        with self._lock:
+            candidates = []
+            for position, name in enumerate(self.models):
+                stats = self.stats[name]
+                state = stats.state
+                if state == "open":
+                    continue
+                if state == "half-open":
+                    if stats.trial_in_flight:
+                        continue
+                    reason = "circuit-trial"
+                elif not stats.outcomes:
+                    reason = "untried"
+                else:
+                    reason = "lowest-latency"
+                candidates.append((self._score(name), position, name, reason))
+
+            candidates.sort()
+            ranked = [(name, reason) for _, _, name, reason in candidates]
+
+        if not ranked:
+            # Every circuit is open, try the providers anyway rather than failing outright
+            ranked = [(name, "all-circuits-open") for name in self.models]
+        return ranked
+
+    def _record(self, name: str, started: float, ok: bool) -> None:
+        """Records a call's latency and outcome."""
+        with self._lock:
+            self.stats[name].record(time.perf_counter() - started, ok)
+
+    def _claim_trial(self, name: str) -> None:
+        """
+        Marks the call about to go to a half-open provider as its trial call, whether the
+        provider ranked first or is reached by failover or hedging, so concurrent calls
+        never send it more than one trial at a time.
+
+        Raises:
+        - CircuitTrialBusyError: If the provider's trial call is already in flight.
+        """
+        with self._lock:
+            stats = self.stats[name]
+            if stats.state != "half-open":
+                return
+            if stats.trial_in_flight:
+                raise CircuitTrialBusyError(
+                    f"{name} is already handling its circuit trial call", retry_after=1.0
+                )
+            stats.trial_in_flight = True
+
+    def _release_trial(self, name: str) -> None:
+        """Lets a half-open provider take another trial call."""
+        with self._lock:
+            self.stats[name].trial_in_flight = False
+
+    def _record_error(self, name: str, started: float, error: Exception) -> None:
+        """Records a failed call, except rate-limit errors, which say nothing about the provider's health."""
+        if upstream_retry_after(error) is not None:
+            self._release_trial(name)
+        else:
+            self._record(name, started, ok=False)
+
+    @staticmethod
+    def _describe(details: Optional[dict], name: str, reason: str, attempt: int) -> None:
+        """Copies the routing decision into the caller's `details`."""
+        if details is not None:
+            details.update(provider=name, routing_reason=reason, provider_attempts=attempt)
+
+    def _timed_invoke(self, name: str, messages: list):
+        """Calls one provider and records its latency and outcome."""
+        started = time.perf_counter()
+        try:
+            result = self.models[name].invoke(messages)
+            if self.validate is not None:
+                self.validate(result)
+        except Exception as e:
+            self._record_error(name, started, e)
+            raise
+        self._record(name, started, ok=True)
+        return result
+
+    async def _timed_ainvoke(self, name: str, messages: list):
+        """
+        Calls one provider asynchronously and records its latency and outcome,
+        using the thread pool if the provider has no async support.
+        """
+        model = self.models[name]
+        started = time.perf_counter()
+        try:
+            try:
+                result = await model.ainvoke(messages)
+            except NotImplementedError:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.executor, model.invoke, messages)
+            if self.validate is not None:
+                self.validate(result)
+        except asyncio.CancelledError:
+            # A cancelled call says nothing about the provider's health
+            self._release_trial(name)
+            raise
+        except Exception as e:
+            self._record_error(name, started, e)
+            raise
+        self._record(name, started, ok=True)
+        return result
+
+    def _admitted_invoke(self, name: str, messages: list, details: Optional[dict] = None):
+        """Calls one provider once its rate limits admit the call (see `rate_limiter.py`)."""
+        self._claim_trial(name)
+        if self.limiter is None:
+            return self._timed_invoke(name, messages)
+        try:
+            return self.limiter.call_blocking(name, lambda: self._timed_invoke(name, messages), details)
+        except RateLimitedError:
+            # Never called, so a pending trial call of a half-open provider is still open
+            self._release_trial(name)
+            raise
+
+    async def _admitted_ainvoke(
+        self, name: str, messages: list, details: Optional[dict] = None, priority: str = "interactive"
+    ):
+        """Async version of `_admitted_invoke`, admitting higher priorities first."""
+        self._claim_trial(name)
+        if self.limiter is None:
+            return await self._timed_ainvoke(name, messages)
+        try:
+            return await self.limiter.call(
+                name, lambda: self._timed_ainvoke(name, messages), details, priority
+            )
+        except (RateLimitedError, asyncio.CancelledError):
+            # Possibly never called, so a pending trial call of a half-open provider is still open
+            self._release_trial(name)
+            raise
+
+    def invoke(self, messages: list, details: Optional[dict] = None):
+        """
+        Calls the healthiest provider, failing over to the next one on errors
+        (including a provider that is out of quota).
+
+        Parameters:
+        - messages (list): Messages passed to the model.
+        - details (dict | None): Optional dictionary receiving the routing decision.
+
+        Returns:
+        - The model output of the first provider that succeeds.
+        """
+        last_error = None
+        for attempt, (name, reason) in enumerate(self.ranked(), start=1):
+            self._describe(details, name, reason if attempt == 1 else "failover", attempt)
+            try:
+                return self._admitted_invoke(name, messages, details)
+            except Exception as e:
+                last_error = e
+        raise last_error
+
+    async def ainvoke(self, messages: list, details: Optional[dict] = None, priority: str = "interactive"):
+        """
+        Async version of `invoke`. Providers without native async support
+        run in the router's thread pool, and calls waiting for quota are admitted
+        by `priority` (`interactive`, `batch` or `background`).
+        """
+        last_error = None
+        for attempt, (name, reason) in enumerate(self.ranked(), start=1):
+            self._describe(details, name, reason if attempt == 1 else "failover", attempt)
+            try:
+                return await self._admitted_ainvoke(name, messages, details, priority)
+            except Exception as e:
+                last_error = e
+        raise last_error
+
+    def _hedge_plan(self, delay: Optional[float], percentile: float, default_delay: float) -> tuple:
+        """
+        Picks the primary and secondary providers of a hedged call and the hedge delay.
+
+        The secondary is the next healthiest provider, or the primary again when only one
+        is available. Without an explicit `delay`, the primary's observed latency
+        percentile is used, or `default_delay` until enough calls have been seen.
+        """
+        ranked = self.ranked()
+        primary, reason = ranked[0]
+        secondary = ranked[1][0] if len(ranked) > 1 else primary
+        if delay is None:
+            with self._lock:
+                delay = self.stats[primary].percentile(percentile)
+            if delay is None:
+                delay = default_delay
+
+        with self._lock:
+            self.hedge_counters["calls"] += 1
+        return primary, reason, secondary, delay
+
+    def _hedge_result(self, details: Optional[dict], name: str, reason: str, fired: bool, won: bool) -> None:
+        """Updates the hedge counters and copies the outcome into the caller's `details`."""
+        with self._lock:
+            if fired:
+                self.hedge_counters["fired"] += 1
+            if won:
+                self.hedge_counters["won"] += 1
+        self._describe(details, name, "hedge" if won else reason, 2 if fired else 1)
+        if details is not None:
+            details.update(hedge_fired=fired, hedge_won=won)
+
+    def hedged_invoke(
+        self,
+        messages: list,
+        details: Optional[dict] = None,
+        delay: Optional[float] = None,
+        percentile: float = 0.9,
+        default_delay: float = 5.0,
+    ):
+        """
+        Calls the healthiest provider and, if it has not answered within `delay` seconds
+        (or failed), sends the same request to a secondary provider. The first successful
+        answer wins. Requires the router's `executor`; the losing call cannot be
+        interrupted and finishes in the background.
+
+        Parameters:
+        - messages (list): Messages passed to the model.
+        - details (dict | None): Optional dictionary receiving the routing and hedge outcome.
+        - delay (float | None): Seconds to wait before hedging, defaults to the primary's latency percentile.
+        - percentile (float): Latency percentile of the primary used as the default delay.
+        - default_delay (float): Delay used until the primary has latency data.
+
+        Returns:
+        - The model output of the first provider that succeeds.
+        """
+        primary, reason, secondary, delay = self._hedge_plan(delay, percentile, default_delay)
+
+        futures = {self.executor.submit(self._admitted_invoke, primary, messages, details): False}
+        pending = set(futures)
+        fired = False
+        last_error = None
+        while pending:
+            done, pending = wait(pending, timeout=None if fired else delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    won = futures[future]
+                    self._hedge_result(details, secondary if won else primary, reason, fired, won)
+                    return future.result()
+                last_error = future.exception()
+
+            if not fired:
+                # The primary is slow (or failed), fire the hedge
+                fired = True
+                hedge = self.executor.submit(self._admitted_invoke, secondary, messages, details)
+                futures[hedge] = True
+                pending.add(hedge)
+
+        self._hedge_result(details, secondary, reason, fired, False)
+        raise last_error
+
+    async def ahedged_invoke(
+        self,
+        messages: list,
+        details: Optional[dict] = None,
+        delay: Optional[float] = None,
+        percentile: float = 0.9,
+        default_delay: float = 5.0,
+        priority: str = "interactive",
+    ):
+        """
+        Async version of `hedged_invoke`. The losing call is cancelled,
+        and calls waiting for quota are admitted by `priority`.
+        """
+        primary, reason, secondary, delay = self._hedge_plan(delay, percentile, default_delay)
+
+        tasks = {
+            asyncio.create_task(self._admitted_ainvoke(primary, messages, details, priority)): False
+        }
+        pending = set(tasks)
+        fired = False
+        last_error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=None if fired else delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        won = tasks[task]
+                        self._hedge_result(details, secondary if won else primary, reason, fired, won)
+                        return task.result()
+                    last_error = task.exception()
+
+                if not fired:
+                    # The primary is slow (or failed), fire the hedge
+                    fired = True
+                    hedge = asyncio.create_task(
+                        self._admitted_ainvoke(secondary, messages, details, priority)
+                    )
+                    tasks[hedge] = True
+                    pending.add(hedge)
+        finally:
+            # Cancel the losing call (or both, if the caller itself was cancelled)
+            for task in pending:
+                task.cancel()
+
+        self._hedge_result(details, secondary, reason, fired, False)
+        raise last_error
+
+    def hedge_stats(self) -> dict:
+        """
+        Returns how often hedges fire and win, to tune the cost/latency trade-off.
+
+        Returns:
+        - dict: Hedged calls, hedges fired, hedges won and the fire/win rates.
+        """
+        with self._lock:
+            calls, fired, won = (self.hedge_counters[key] for key in ("calls", "fired", "won"))
+        return {
+            "calls": calls,
+            "fired": fired,
+            "won": won,
+            "fire_rate": fired / calls if calls else 0.0,
+            "win_rate": won / fired if fired else 0.0,
+        }
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current health of every provider.
+
+        Returns:
+        - dict: Provider name -> circuit state, p50/p95 latency, error rate and call count.
+        """
+        with self._lock:
+            return {
+                name: {
+                    "state": stats.state,
+                    "p50_seconds": stats.percentile(0.5),
+                    "p95_seconds": stats.percentile(0.95),
+                    "error_rate": stats.error_rate,
+                    "calls": len(stats.outcomes),
+                }
+                for name, stats in self.stats.items()
+            }
@@ -0,0 +1,229 @@
+"""
+File: near_duplicates.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Index of perceptual hashes of already extracted receipts, so a new photo of
+the same paper receipt (different bytes, same content) is answered with the earlier result
+instead of another model call. Hashes are compared by Hamming distance through a
+multi-index hash table, so a lookup costs the same with a hundred or millions of
+stored receipts, and are persisted in SQLite.
+
+Usage:
+1. Create the index, e.g. `index = NearDuplicateIndex("receipt_fingerprints.sqlite3", bits=256, max_distance=4)`.
+2. Compute a fingerprint with `image_preprocessor.perceptual_hash(...)` (or let
+   `preprocess_image` compute it).
+3. Call `index.find(fingerprint)` before extracting and `index.add(image_id, fingerprint, json_text)` afterwards.
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Returns the number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing of fixed-size integer hashes under the Hamming distance. Every hash
+    is split into `max_distance // 2 + 1` chunks, each with its own lookup table. Two hashes
+    within `max_distance` bits differ by at most one bit in at least one chunk (pigeonhole),
+    so a search only probes each chunk and its one-bit variants, whatever the index size.
+    """
+
+    def __init__(self, bits: int, max_distance: int):
+        """
+        Parameters:
+        - bits (int): Size of the hashes in bits.
+        - max_distance (int): Largest Hamming distance searches have to find.
+        """
+        self.max_distance = max_distance
+        chunks = max_distance // 2 + 1
+        self.flips = 1 if max_distance else 0
+
+        # Bit ranges of the chunks, as (shift, width) pairs
+        width, extra = divmod(bits, chunks)
+        self.chunks = []
+        shift = 0
+        for index in range(chunks):
+            size = width + (1 if index < extra else 0)
+            self.chunks.append((shift, size))
+            shift += size
+
+        # One table per chunk: chunk value -> ids, plus the full hash of every id
+        self.tables = [{} for _ in self.chunks]
+        self.hashes = {}
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def add(self, value: int, item) -> None:
+        """Inserts a hash under the id `item` (ids are unique, re-adding one replaces it)."""
+        if item in self.hashes:
+            self.remove(item)
+        self.hashes[item] = value
+        for table, (shift, size) in zip(self.tables, self.chunks):
+            table.setdefault(value >> shift & ((1 << size) - 1), []).append(item)
+
+    def remove(self, item) -> None:
+        """Removes the hash stored under `item`."""
+        value = self.hashes.pop(item)
+        for table, (shift, size) in zip(self.tables, self.chunks):
+            key = value >> shift & ((1 << size) - 1)
+            table[key].remove(item)
+            if not table[key]:
+                del table[key]
+
+    def nearest(self, value: int, max_distance: int = None) -> Optional[tuple]:
+        """
+        Finds the closest stored hash within `max_distance` (at most the index's own).
+
+        Returns:
+        - tuple | None: (item, distance) of the best match, or None if nothing is close enough.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+
+        best = None
+        seen = set()
+        for table, (shift, size) in zip(self.tables, self.chunks):
+            chunk = value >> shift & ((1 << size) - 1)
+            probes = [chunk] + [chunk ^ (1 << bit) for bit in range(size)] * self.flips
+            for probe in probes:
+                for item in table.get(probe, ()):
+                    if item in seen:
+                        continue
+                    seen.add(item)
+                    distance = hamming_distance(value, self.hashes[item])
+                    if distance <= max_distance and (best is None or distance < best[1]):
+                        best = (item, distance)
+        return best
+
+
+class NearDuplicateIndex:
+    """Perceptual-hash index of extracted receipts, in memory and backed by SQLite."""
+
+    def __init__(self, path: Optional[str], bits: int = 256, max_distance: int = 10, namespace: str = ""):
+        """
+        Parameters:
+        - path (str | None): SQLite file persisting the index, or None for memory only.
+        - bits (int): Size of the perceptual hashes in bits.
+        - max_distance (int): Largest Hamming distance still treated as the same receipt.
+        - namespace (str): Model and schema the stored results belong to; entries of
+          other namespaces are ignored (e.g. after switching models).
+        """
+        self.max_distance = max_distance
+        self.namespace = namespace
+        self._hashes = MultiIndexHash(bits, max_distance)
+        self._receipts = {}
+        self._lock = threading.Lock()
+
+        # Lookup counters, exposed through `stats()`
+        self.hits = 0
+        self.misses = 0
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS receipt_fingerprints (
+                    id TEXT NOT NULL,
+                    namespace TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    receipt TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, id)
+                )
+                """
+            )
+
+            # Rebuild the lookup tables from disk; the receipts themselves stay in SQLite
+            self._last_rowid = 0
+            self._load_new()
+
+    def _load_new(self) -> None:
+        """
+        Adds the fingerprints stored since the last load to the lookup tables, including
+        those added by other worker processes sharing the file.
+        """
+        rows = self._db.execute(
+            "SELECT rowid, id, fingerprint FROM receipt_fingerprints WHERE namespace = ? AND rowid > ?",
+            (self.namespace, self._last_rowid),
+        )
+        for rowid, image_id, fingerprint in rows:
+            self._hashes.add(int(fingerprint, 16), image_id)
+            self._last_rowid = max(self._last_rowid, rowid)
+
+    def find(self, fingerprint: int) -> Optional[tuple]:
+        """
+        Looks up a receipt whose image is perceptually close to the given one.
+
+        Parameters:
+        - fingerprint (int): Perceptual hash of the new image.
+
+        Returns:
+        - tuple | None: (id of the original image, receipt JSON, Hamming distance), or None.
+        """
+        with self._lock:
+            if self._db is not None:
+                self._load_new()
+            match = self._hashes.nearest(fingerprint)
+            if match is None:
+                self.misses += 1
+                return None
+
+            image_id, distance = match
+            if self._db is None:
+                receipt = self._receipts[image_id]
+            else:
+                row = self._db.execute(
+                    "SELECT receipt FROM receipt_fingerprints WHERE namespace = ? AND id = ?",
+                    (self.namespace, image_id),
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                receipt = row[0]
+
+            self.hits += 1
+            return image_id, receipt, distance
+
+    def add(self, image_id: str, fingerprint: int, receipt_json: str) -> None:
+        """
+        Stores the fingerprint and result of a freshly extracted receipt.
+
+        Parameters:
+        - image_id (str): Id of the image, e.g. the SHA-256 of its bytes.
+        - fingerprint (int): Perceptual hash of the image.
+        - receipt_json (str): The extracted receipt as JSON.
+        """
+        with self._lock:
+            self._hashes.add(fingerprint, image_id)
+            if self._db is None:
+                self._receipts[image_id] = receipt_json
+            else:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO receipt_fingerprints VALUES (?, ?, ?, ?, ?)",
+                    (image_id, self.namespace, format(fingerprint, "x"), receipt_json, time.time()),
+                )
+
+    def stats(self) -> dict:
+        """
+        Returns the index size and how often lookups found a near-duplicate.
+
+        Returns:
+        - dict: Entry count, hits, misses and hit rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._hashes),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,535 @@
+"""
+File: rate_limiter.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Admission control in front of the model providers. Every provider gets token
+buckets for its requests-per-minute and tokens-per-minute quota; calls wait in a bounded,
+priority-ordered queue until the quota allows them, are rejected right away when the wait
+would be too long, and are retried with jittered exponential backoff when the provider
+still answers with a rate-limit error (HTTP 429).
+
+Usage:
+1. Create a controller, e.g. `limiter = AdmissionController({"openai": (500, 200000)})`.
+2. Run each provider call through it with `await limiter.call("openai", invoke, details, "interactive")`
+   (or `limiter.call_blocking(...)` from synchronous code).
+3. Catch `RateLimitedError` and answer 429 (or 503 for `AdmissionQueueFullError`) with
+   its `retry_after` as the `Retry-After` header.
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Optional
+
+from shared_state import SharedTokenBucket
+
+# Priority classes, lower values are admitted first
+PRIORITIES = {"interactive": 0, "batch": 1, "background": 2}
+
+
+class RateLimitedError(Exception):
+    """Raised when a call cannot be admitted within the provider's quota in time."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionQueueFullError(RateLimitedError):
+    """Raised when too many calls are already waiting for quota."""
+
+
+class UpstreamRateLimitError(RateLimitedError):
+    """Raised when the provider kept answering with rate-limit errors after all retries."""
+
+
+# Exception types providers raise for HTTP 429 (OpenAI, Google API core, generic HTTP clients)
+_RATE_LIMIT_ERROR_TYPES = ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+
+
+def _find_rate_limit_error(error: Exception):
+    """
+    Returns the error (or the error it was raised from) that is a rate limit, or None.
+
+    Only status codes and exception types are considered, never the message: errors raised
+    while parsing a model output can quote receipt text such as `429.00`.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen and len(seen) < 5:
+        seen.add(id(error))
+        response = getattr(error, "response", None)
+        status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+        code = getattr(error, "code", None)
+        if (
+            status == 429
+            or (isinstance(code, int) and code == 429)
+            or type(error).__name__ in _RATE_LIMIT_ERROR_TYPES
+        ):
+            return error
+        # Provider integrations often wrap the client's error in their own
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def upstream_retry_after(error: Exception) -> Optional[float]:
+    """
+    Recognizes a provider's rate-limit error and reads how long it asks us to wait.
+
+    Parameters:
+    - error (Exception): Error raised by a provider call.
+
+    Returns:
+    - float | None: Seconds from the `Retry-After` header (0.0 when the provider gave no
+      hint), or None if the error is not a rate limit.
+    """
+    error = _find_rate_limit_error(error)
+    if error is None:
+        return None
+
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return 0.0
+
+
+class TokenBucket:
+    """Bucket refilled continuously at a per-minute rate, holding at most one minute of quota."""
+
+    def __init__(self, per_minute: float):
+        """
+        Parameters:
+        - per_minute (float): Quota refilled every minute, also the bucket's capacity.
+        """
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Returns the seconds until `amount` is available (capped at the capacity)."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float, now: float) -> None:
+        """Takes `amount` out of the bucket, which may go negative (reserving future quota)."""
+        self._refill(now)
+        self.level -= amount
+
+    def give_back(self, amount: float) -> None:
+        """Returns unused quota, e.g. when a call used fewer tokens than estimated."""
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ProviderLimiter:
+    """Request and token buckets of one provider, plus its queue of waiting calls."""
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        default_tokens: int,
+        name: str = "",
+        shared_state=None,
+    ):
+        """
+        Parameters:
+        - requests_per_minute (float): Request quota, 0 for unlimited.
+        - tokens_per_minute (float): Token quota, 0 for unlimited.
+        - default_tokens (int): Tokens assumed per call until real usage has been seen.
+        - name (str): Provider name, identifying its buckets in the shared state.
+        - shared_state (SharedState | None): State shared with the other worker processes
+          (see `shared_state.py`); None keeps the buckets in this process.
+        """
+        self.name = name
+        self.shared_state = shared_state
+        self.requests = self._bucket("requests", requests_per_minute)
+        self.tokens = self._bucket("tokens", tokens_per_minute)
+        self.average_tokens = float(default_tokens)
+        self.paused_until = 0.0
+        self.waiters = []
+        self.lock = threading.Lock()
+
+        # Counters exposed through `AdmissionController.snapshot()`
+        self.admitted = 0
+        self.rejected = 0
+        self.upstream_rate_limits = 0
+
+    def _bucket(self, kind: str, per_minute: float):
+        """Creates the request or token bucket, None when the quota is unlimited."""
+        if not per_minute:
+            return None
+        if self.shared_state is not None:
+            return SharedTokenBucket(self.shared_state, f"{self.name}:{kind}", per_minute)
+        return TokenBucket(per_minute)
+
+    def paused_for(self, now: float) -> float:
+        """Returns the seconds left until the provider admits calls again after a 429."""
+        if self.shared_state is not None:
+            return max(0.0, self.shared_state.paused_until(self.name) - time.time())
+        return max(0.0, self.paused_until - now)
+
+    def estimate(self) -> int:
+        """Tokens expected for the next call: a moving average of the observed usage."""
+        return int(self.average_tokens)
+
+    def _wait_time(self, calls: int, tokens: float, now: float) -> float:
+        wait = self.paused_for(now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(calls, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def _take(self, tokens: float, now: float) -> None:
+        if self.requests is not None:
+            self.requests.take(1, now)
+        if self.tokens is not None:
+            self.tokens.take(tokens, now)
+        self.admitted += 1
+
+    def wait_time(self, calls: int, tokens: float, now: float) -> float:
+        """Returns the seconds until `calls` requests using `tokens` in total fit in the quota."""
+        with self.lock:
+            return self._wait_time(calls, tokens, now)
+
+    def take(self, tokens: float, now: float) -> None:
+        """Reserves one request and `tokens` tokens."""
+        with self.lock:
+            self._take(tokens, now)
+
+    def try_take(self, tokens: float, now: float) -> float:
+        """
+        Reserves one request and `tokens` tokens if the quota holds them right now.
+
+        Returns:
+        - float: 0.0 if reserved, otherwise the seconds until the quota allows the call.
+        """
+        with self.lock:
+            if self.shared_state is None:
+                wait = self._wait_time(1, tokens, now)
+                if wait <= 0:
+                    self._take(tokens, now)
+                return wait
+
+            # One transaction checks and takes, so other workers cannot take the same quota in between
+            amounts = [
+                (bucket.key, bucket.capacity, amount)
+                for bucket, amount in ((self.requests, 1), (self.tokens, tokens))
+                if bucket is not None
+            ]
+            wait = self.shared_state.take_if_available(self.name, amounts)
+            if wait <= 0:
+                self.admitted += 1
+            return wait
+
+    def settle(self, estimated: float, used: Optional[float]) -> None:
+        """Corrects the token bucket and the estimate once a call reports its real usage."""
+        if used is None:
+            return
+        with self.lock:
+            if self.tokens is not None:
+                if used > estimated:
+                    self.tokens.take(used - estimated, time.monotonic())
+                else:
+                    self.tokens.give_back(estimated - used)
+            self.average_tokens = 0.8 * self.average_tokens + 0.2 * used
+
+    def pause(self, seconds: float) -> None:
+        """Stops admitting calls for `seconds`, after the provider itself answered 429."""
+        with self.lock:
+            if self.shared_state is not None:
+                # Every worker stops calling the provider, not just this one
+                self.shared_state.pause(self.name, time.time() + seconds)
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.upstream_rate_limits += 1
+
+
+class AdmissionController:
+    """Admits provider calls within their rate limits, by priority, and retries upstream 429s."""
+
+    def __init__(
+        self,
+        limits: dict,
+        default_tokens: int = 1500,
+        max_waiting: int = 256,
+        max_wait_seconds: float = 30,
+        max_retries: int = 3,
+        backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 30,
+        count_tokens=None,
+        shared_state=None,
+    ):
+        """
+        Parameters:
+        - limits (dict): Provider name -> (requests per minute, tokens per minute), 0 meaning
+          unlimited. Providers without an entry are not limited.
+        - default_tokens (int): Tokens assumed per call until real usage has been seen.
+        - max_waiting (int): Maximum number of calls waiting for quota across all providers.
+        - max_wait_seconds (float): Longest a call may wait for quota before it is rejected.
+        - max_retries (int): Retries of a call the provider answered with a rate-limit error.
+        - backoff_seconds (float): Base delay of the exponential backoff between retries.
+        - max_backoff_seconds (float): Upper bound of the backoff delay.
+        - count_tokens (callable | None): Returns the tokens a call used from its output
+          (or None if unknown), to correct the token bucket.
+        - shared_state (SharedState | None): Keeps the buckets in state shared by all worker
+          processes, so together they stay within the provider quotas.
+        """
+        self.limiters = {
+            name: ProviderLimiter(rpm, tpm, default_tokens, name=name, shared_state=shared_state)
+            for name, (rpm, tpm) in limits.items()
+            if rpm or tpm
+        }
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.count_tokens = count_tokens
+
+        self.waiting = 0
+        self._sequence = itertools.count()
+        self._condition = asyncio.Condition()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    async def _off_loop(limiter: Optional[ProviderLimiter], function, *args):
+        """Runs a limiter operation, in a thread when it goes to the shared SQLite state."""
+        if limiter is not None and limiter.shared_state is not None:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    def _reject_if_too_slow(self, provider: str, limiter: ProviderLimiter, wait: float) -> None:
+        """Rejects a call whose projected wait exceeds `max_wait_seconds`."""
+        if wait > self.max_wait_seconds:
+            limiter.rejected += 1
+            raise RateLimitedError(
+                f"Rate limit of the {provider} provider reached, retry in {wait:.1f}s", wait
+            )
+
+    async def acquire(self, provider: str, priority: str = "interactive") -> tuple:
+        """
+        Waits until the provider's quota admits one more call, higher priorities first.
+
+        Parameters:
+        - provider (str): Provider the call goes to.
+        - priority (str): Priority class, see `PRIORITIES`.
+
+        Returns:
+        - tuple: (estimated tokens reserved, seconds waited).
+
+        Raises:
+        - AdmissionQueueFullError: If `max_waiting` calls are already waiting.
+        - RateLimitedError: If the call would wait longer than `max_wait_seconds`.
+        """
+        limiter = self.limiters.get(provider)
+        if limiter is None:
+            return 0, 0.0
+
+        started = time.monotonic()
+        rank = PRIORITIES[priority]
+        tokens = limiter.estimate()
+
+        async with self._condition:
+            # Project the wait from the quota needed by the calls queued ahead of this one
+            ahead = [entry for entry in limiter.waiters if entry[0] <= rank]
+            projected = await self._off_loop(
+                limiter, limiter.wait_time, len(ahead) + 1, sum(entry[2] for entry in ahead) + tokens, started
+            )
+            self._reject_if_too_slow(provider, limiter, projected)
+            if self.waiting >= self.max_waiting:
+                limiter.rejected += 1
+                raise AdmissionQueueFullError(
+                    f"Too many calls waiting for the {provider} provider", max(1.0, projected)
+                )
+
+            entry = (rank, next(self._sequence), tokens)
+            heapq.heappush(limiter.waiters, entry)
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    remaining = started + self.max_wait_seconds - now
+                    timeout = remaining
+                    if limiter.waiters[0] == entry:
+                        # First in line, go as soon as the buckets hold enough quota
+                        wait = await self._off_loop(limiter, limiter.try_take, tokens, now)
+                        if wait <= 0:
+                            return tokens, now - started
+                        if wait > remaining:
+                            limiter.rejected += 1
+                            raise RateLimitedError(
+                                f"Rate limit of the {provider} provider reached, retry in {wait:.1f}s", wait
+                            )
+                        timeout = wait
+                    elif remaining <= 0:
+                        limiter.rejected += 1
+                        raise RateLimitedError(
+                            f"Rate limit of the {provider} provider reached", self.max_wait_seconds
+                        )
+
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                limiter.waiters.remove(entry)
+                heapq.heapify(limiter.waiters)
+                self.waiting -= 1
+                self._condition.notify_all()
+
+    def acquire_blocking(self, provider: str) -> tuple:
+        """
+        Blocking version of `acquire` for synchronous callers: reserves the quota right away
+        (first come, first served) and sleeps until it is available.
+        """
+        limiter = self.limiters.get(provider)
+        if limiter is None:
+            return 0, 0.0
+
+        tokens = limiter.estimate()
+        with self._lock:
+            now = time.monotonic()
+            wait = limiter.wait_time(1, tokens, now)
+            self._reject_if_too_slow(provider, limiter, wait)
+            limiter.take(tokens, now)
+        time.sleep(wait)
+        return tokens, wait
+
+    def _backoff(self, attempt: int, retry_after: float) -> float:
+        """Delay before a retry: the provider's hint plus exponential backoff with full jitter."""
+        ceiling = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+        return retry_after + random.uniform(0, ceiling)
+
+    def _upstream_limited(self, provider: str, error: Exception, attempt: int) -> Optional[float]:
+        """
+        Handles an error of an admitted call.
+
+        Returns:
+        - float | None: Seconds to wait before retrying, or None if the error is not a
+          rate limit (the caller re-raises it).
+
+        Raises:
+        - UpstreamRateLimitError: If the provider is still rate limiting after all retries.
+        """
+        retry_after = upstream_retry_after(error)
+        if retry_after is None:
+            return None
+
+        delay = self._backoff(attempt, retry_after)
+        limiter = self.limiters.get(provider)
+        if limiter is not None:
+            limiter.pause(delay)
+        if attempt >= self.max_retries:
+            raise UpstreamRateLimitError(
+                f"The {provider} provider is rate limiting requests", max(1.0, delay)
+            ) from error
+        return delay
+
+    def _settle(self, provider: str, tokens: float, output) -> None:
+        limiter = self.limiters.get(provider)
+        if limiter is not None and self.count_tokens is not None:
+            limiter.settle(tokens, self.count_tokens(output))
+
+    @staticmethod
+    def _describe(details: Optional[dict], waited: float, retries: int) -> None:
+        """Adds the time spent waiting for quota and the retries to the caller's `details`."""
+        if details is not None:
+            details["rate_limit_wait_seconds"] = round(
+                details.get("rate_limit_wait_seconds", 0.0) + waited, 6
+            )
+            if retries:
+                details["rate_limit_retries"] = details.get("rate_limit_retries", 0) + retries
+
+    async def call(self, provider: str, invoke, details: Optional[dict] = None, priority: str = "interactive"):
+        """
+        Runs a provider call once its quota admits it, retrying upstream rate-limit errors.
+
+        Parameters:
+        - provider (str): Provider the call goes to.
+        - invoke (callable): Returns a new awaitable making the call on every attempt.
+        - details (dict | None): Optional dictionary receiving the wait time and retries.
+        - priority (str): Priority class, see `PRIORITIES`.
+
+        Returns:
+        - The output of the call.
+        """
+        waited = 0.0
+        for attempt in range(self.max_retries + 1):
+            tokens, seconds = await self.acquire(provider, priority)
+            waited += seconds
+            limiter = self.limiters.get(provider)
+            try:
+                output = await invoke()
+            except Exception as e:
+                delay = await self._off_loop(limiter, self._upstream_limited, provider, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                waited += delay
+                continue
+            finally:
+                self._describe(details, waited, 1 if attempt else 0)
+                waited = 0.0
+            await self._off_loop(limiter, self._settle, provider, tokens, output)
+            return output
+
+    def call_blocking(self, provider: str, invoke, details: Optional[dict] = None):
+        """Blocking version of `call`, where `invoke` makes the call and returns its output."""
+        waited = 0.0
+        for attempt in range(self.max_retries + 1):
+            tokens, seconds = self.acquire_blocking(provider)
+            waited += seconds
+            try:
+                output = invoke()
+            except Exception as e:
+                delay = self._upstream_limited(provider, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                waited += delay
+                continue
+            finally:
+                self._describe(details, waited, 1 if attempt else 0)
+                waited = 0.0
+            self._settle(provider, tokens, output)
+            return output
+
+    def snapshot(self) -> dict:
+        """
+        Returns the quota left and the admission counters of every limited provider.
+
+        Returns:
+        - dict: Provider name -> available requests and tokens, calls waiting, admitted,
+          rejected and upstream rate limits, plus the seconds the provider stays paused.
+        """
+        now = time.monotonic()
+        snapshot = {}
+        for name, limiter in self.limiters.items():
+            with limiter.lock:
+                for bucket in (limiter.requests, limiter.tokens):
+                    if bucket is not None:
+                        bucket._refill(now)
+                snapshot[name] = {
+                    "requests_available": limiter.requests.level if limiter.requests else None,
+                    "tokens_available": limiter.tokens.level if limiter.tokens else None,
+                    "estimated_tokens_per_call": limiter.estimate(),
+                    "waiting": len(limiter.waiters),
+                    "admitted": limiter.admitted,
+                    "rejected": limiter.rejected,
+                    "upstream_rate_limits": limiter.upstream_rate_limits,
+                    "paused_seconds": limiter.paused_for(now),
+                }
+        return snapshot
@@ -0,0 +1,331 @@
+"""
+File: receipt_analytics.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Spending analytics over the extracted receipts. Receipts and items are kept as
+columnar NumPy arrays in memory-mapped files that only ever grow by appending, and the
+aggregates (spend per merchant and per month, tax and tip ratios, top items) are computed
+with vectorized group-bys instead of Python loops. Results are cached until new receipts
+are appended.
+
+Usage:
+1. Create the analytics, e.g. `analytics = ReceiptAnalytics("receipt_analytics")`.
+2. Append receipts with `analytics.append(receipts)` (dicts in the `Receipt` layout),
+   or pull new ones from a `ReceiptStore` with `analytics.sync(store)`.
+3. Read the aggregates with `analytics.summary(top=10)`.
+4. Several processes (e.g. API workers) may share the directory: `sync` holds a file
+   lock and first picks up the rows the other processes appended.
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from receipt_store import iso_date
+
+# Columns of the receipt and item tables, with their data types. Merchant and item names
+# are stored as integer codes into the name lists kept in `meta.json`.
+RECEIPT_COLUMNS = {
+    "id": np.int64,
+    "merchant": np.int32,
+    "month": np.int32,
+    "subtotal": np.float64,
+    "tax": np.float64,
+    "tip": np.float64,
+    "discount": np.float64,
+    "total": np.float64,
+}
+ITEM_COLUMNS = {
+    "receipt": np.int64,
+    "name": np.int32,
+    "quantity": np.float64,
+    "price": np.float64,
+}
+
+
+def month_of(date: str) -> int:
+    """
+    Returns the month of a receipt date as `YYYYMM`, or 0 if the date cannot be parsed.
+
+    Parameters:
+    - date (str): Date as extracted from the receipt, e.g. `2025-02-27` or `02/27/2025`.
+    """
+    iso = iso_date(date)
+    return int(iso[:4]) * 100 + int(iso[5:7]) if iso else 0
+
+
+class ColumnTable:
+    """Append-only table with one raw binary file per column, read back through memory maps."""
+
+    def __init__(self, directory: str, name: str, columns: dict, length: int):
+        """
+        Parameters:
+        - directory (str): Folder holding the column files.
+        - name (str): Table name, used as the file name prefix.
+        - columns (dict): Column name -> NumPy data type.
+        - length (int): Number of rows committed to `meta.json`.
+        """
+        self.columns = columns
+        self.length = length
+        self.paths = {column: os.path.join(directory, f"{name}.{column}.bin") for column in columns}
+        self._maps = {}
+
+        # Drop rows written after the last committed length (e.g. an interrupted append)
+        for column, dtype in columns.items():
+            with open(self.paths[column], "ab") as f:
+                f.truncate(length * np.dtype(dtype).itemsize)
+
+    def append(self, values: dict) -> None:
+        """Appends rows, given as column name -> list of values (all the same length)."""
+        rows = len(next(iter(values.values())))
+        for column, dtype in self.columns.items():
+            with open(self.paths[column], "ab") as f:
+                np.asarray(values[column], dtype=dtype).tofile(f)
+        self.length += rows
+        self._maps.clear()
+
+    def column(self, column: str) -> np.ndarray:
+        """Returns a read-only, memory-mapped view of a column."""
+        if column not in self._maps:
+            dtype = self.columns[column]
+            if self.length == 0:
+                self._maps[column] = np.empty(0, dtype=dtype)
+            else:
+                self._maps[column] = np.memmap(self.paths[column], dtype=dtype, mode="r", shape=(self.length,))
+        return self._maps[column]
+
+
+class ReceiptAnalytics:
+    """Columnar receipt and item data with cached, vectorized spending aggregates."""
+
+    def __init__(self, directory: str):
+        """
+        Parameters:
+        - directory (str): Folder holding the column files and `meta.json` (created if missing).
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._meta_path = os.path.join(directory, "meta.json")
+
+        # Aggregates computed since the last append
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+        with self._file_lock():
+            self._load(self._read_meta())
+
+    @contextmanager
+    def _file_lock(self):
+        """Holds an exclusive lock on the directory, shared with other processes using it."""
+        with open(os.path.join(self._directory, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> dict:
+        meta = {"last_id": 0, "receipts": 0, "items": 0, "merchants": [], "item_names": []}
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta.update(json.load(f))
+        return meta
+
+    def _load(self, meta: dict) -> None:
+        """Opens the columns and name lists as committed in `meta` (under the file lock)."""
+        self.last_id = meta["last_id"]
+        self.merchants = meta["merchants"]
+        self.item_names = meta["item_names"]
+        self._merchant_codes = {name: code for code, name in enumerate(self.merchants)}
+        self._item_codes = {name: code for code, name in enumerate(self.item_names)}
+
+        self.receipts = ColumnTable(self._directory, "receipts", RECEIPT_COLUMNS, meta["receipts"])
+        self.items = ColumnTable(self._directory, "items", ITEM_COLUMNS, meta["items"])
+        self._cache.clear()
+
+    @staticmethod
+    def _code(name: str, codes: dict, names: list) -> int:
+        """Returns the integer code of a name, assigning the next one to new names."""
+        key = name.strip().lower()
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(names)
+            names.append(key)
+        return code
+
+    def append(self, receipts: list) -> None:
+        """
+        Appends receipts to the columns and invalidates the cached aggregates.
+
+        Parameters:
+        - receipts (list): Dicts in the `Receipt` layout, with the `id` given by the receipt store.
+        """
+        if not receipts:
+            return
+
+        with self._lock:
+            rows = {column: [] for column in RECEIPT_COLUMNS}
+            items = {column: [] for column in ITEM_COLUMNS}
+            for position, receipt in enumerate(receipts, start=self.receipts.length):
+                transaction = receipt["transaction"]
+                rows["id"].append(receipt.get("id", 0))
+                rows["merchant"].append(self._code(receipt["merchant"]["name"], self._merchant_codes, self.merchants))
+                rows["month"].append(month_of(transaction["date"]))
+                for column in ("subtotal", "tax", "tip", "discount", "total"):
+                    value = transaction.get(column)
+                    rows[column].append(np.nan if value is None else value)
+                for item in receipt["items"]:
+                    items["receipt"].append(position)
+                    items["name"].append(self._code(item["name"], self._item_codes, self.item_names))
+                    items["quantity"].append(item["quantity"])
+                    items["price"].append(item["price"])
+
+            self.receipts.append(rows)
+            if items["receipt"]:
+                self.items.append(items)
+            self.last_id = max(self.last_id, max(rows["id"]))
+            self._save_meta()
+            self._cache.clear()
+
+    def _save_meta(self) -> None:
+        """Commits the row counts and name lists, atomically replacing `meta.json`."""
+        temporary = self._meta_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(
+                {
+                    "last_id": self.last_id,
+                    "receipts": self.receipts.length,
+                    "items": self.items.length,
+                    "merchants": self.merchants,
+                    "item_names": self.item_names,
+                },
+                f,
+            )
+        os.replace(temporary, self._meta_path)
+
+    def sync(self, store, batch_size: int = 1000) -> int:
+        """
+        Appends the receipts saved in a `ReceiptStore` since the last sync.
+
+        Returns:
+        - int: Number of receipts appended.
+        """
+        appended = 0
+        # One sync at a time, so concurrent callers never append the same receipts twice
+        with self._sync_lock, self._file_lock():
+            # Pick up what other processes appended since this one last looked
+            meta = self._read_meta()
+            if meta["receipts"] != self.receipts.length:
+                with self._lock:
+                    self._load(meta)
+            while True:
+                receipts = store.since(self.last_id, batch_size)
+                if not receipts:
+                    return appended
+                self.append(receipts)
+                appended += len(receipts)
+
+    def summary(self, top: int = 10) -> dict:
+        """
+        Computes (or returns the cached) spending aggregates.
+
+        Parameters:
+        - top (int): Number of merchants and items listed in the rankings.
+
+        Returns:
+        - dict: Totals, tax and tip ratios, the top merchants by spend, spend per month
+          and the top items by quantity x price.
+        """
+        with self._lock:
+            if top not in self._cache:
+                self._cache[top] = self._compute(top)
+            return self._cache[top]
+
+    def _compute(self, top: int) -> dict:
+        receipts, items = self.receipts, self.items
+        subtotal = receipts.column("subtotal")
+        tax = receipts.column("tax")
+        tip = receipts.column("tip")
+        total = receipts.column("total")
+
+        # Overall totals and ratios; receipts without a tip are left out of the tip ratio
+        subtotal_sum = float(subtotal.sum())
+        tipped = ~np.isnan(tip)
+        tipped_subtotal = float(subtotal[tipped].sum())
+        overview = {
+            "receipts": receipts.length,
+            "items": items.length,
+            "total_spend": float(total.sum()),
+            "tax_ratio": float(tax.sum()) / subtotal_sum if subtotal_sum else None,
+            "tip_ratio": float(tip[tipped].sum()) / tipped_subtotal if tipped_subtotal else None,
+            "tipped_share": float(tipped.mean()) if receipts.length else None,
+        }
+
+        # Group by merchant code
+        merchant = receipts.column("merchant")
+        merchant_count = len(self.merchants)
+        merchant_spend = np.bincount(merchant, weights=total, minlength=merchant_count)
+        merchant_receipts = np.bincount(merchant, minlength=merchant_count)
+        merchant_tax = np.bincount(merchant, weights=tax, minlength=merchant_count)
+        merchant_subtotal = np.bincount(merchant, weights=subtotal, minlength=merchant_count)
+        top_merchants = [
+            {
+                "merchant": self.merchants[code],
+                "receipts": int(merchant_receipts[code]),
+                "spend": float(merchant_spend[code]),
+                "tax_ratio": float(merchant_tax[code] / merchant_subtotal[code]) if merchant_subtotal[code] else None,
+            }
+            for code in self._top(merchant_spend, top)
+        ]
+
+        # Group by month (0 collects receipts whose date could not be parsed)
+        months, month_index = np.unique(receipts.column("month"), return_inverse=True)
+        month_spend = np.bincount(month_index, weights=total, minlength=len(months))
+        month_receipts = np.bincount(month_index, minlength=len(months))
+        by_month = [
+            {
+                "month": f"{month // 100:04d}-{month % 100:02d}" if month else "unknown",
+                "receipts": int(count),
+                "spend": float(spend),
+            }
+            for month, count, spend in zip(months.tolist(), month_receipts.tolist(), month_spend.tolist())
+        ]
+
+        # Group items by name code
+        name = items.column("name")
+        quantity = items.column("quantity")
+        name_count = len(self.item_names)
+        item_spend = np.bincount(name, weights=quantity * items.column("price"), minlength=name_count)
+        item_quantity = np.bincount(name, weights=quantity, minlength=name_count)
+        top_items = [
+            {
+                "item": self.item_names[code],
+                "quantity": float(item_quantity[code]),
+                "spend": float(item_spend[code]),
+            }
+            for code in self._top(item_spend, top)
+        ]
+
+        return {
+            "overview": overview,
+            "top_merchants": top_merchants,
+            "spend_by_month": by_month,
+            "top_items": top_items,
+        }
+
+    @staticmethod
+    def _top(values: np.ndarray, count: int) -> list:
+        """Returns the indices of the `count` largest values, largest first."""
+        if count <= 0 or len(values) == 0:
+            return []
+        if count < len(values):
+            # Partial selection first, only the winners get sorted
+            candidates = np.argpartition(-values, count - 1)[:count]
+        else:
+            candidates = np.arange(len(values))
+        return candidates[np.argsort(-values[candidates], kind="stable")].tolist()
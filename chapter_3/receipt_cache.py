@@ -0,0 +1,224 @@
+"""
+File: receipt_cache.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Content-addressed cache for extracted receipts. Results are keyed by the
+SHA-256 of the image bytes plus the model name and the `Receipt` schema version, and kept
+in a bounded in-memory LRU in front of a persistent SQLite tier, so duplicate uploads
+return without calling the model and survive restarts.
+
+Usage:
+1. Create a cache, e.g. `cache = ReceiptCache("receipt_cache.sqlite3")`.
+2. Build a key with `cache.make_key(image_bytes, model_name, schema_version)`.
+3. Call `cache.get(key)` before extracting and `cache.set(key, json_text)` afterwards.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class ReceiptCache:
+    """Two-tier (memory LRU + SQLite) cache of receipt JSON keyed by image content."""
+
+    def __init__(
+        self,
+        path: Optional[str],
+        memory_items: int = 1024,
+        ttl_seconds: float = 7 * 24 * 3600,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+    ):
+        """
+        Parameters:
+        - path (str | None): SQLite file for the persistent tier, or None for memory only.
+        - memory_items (int): Maximum number of entries kept in the in-memory LRU.
+        - ttl_seconds (float): Age after which an entry is treated as expired.
+        - max_disk_bytes (int): Total payload size the SQLite tier may hold before evicting.
+        """
+        self.memory_items = memory_items
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_bytes
+
+        # In-memory tier: key -> (created_at, json_text), ordered from least to most recently used
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Hit/miss counters, exposed through `stats()`
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # Persistent tier (optional), with a running total of its payload bytes so writes
+        # do not have to sum the table
+        self._db = None
+        self._disk_bytes = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS receipt_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS receipt_cache_accessed ON receipt_cache (accessed_at)"
+            )
+            self._disk_bytes = self._disk_size()
+
+    @staticmethod
+    def make_key(
+        image_bytes: bytes, model_name: str, schema_version: str, digest: Optional[str] = None
+    ) -> str:
+        """
+        Builds the cache key for an image.
+
+        Parameters:
+        - image_bytes (bytes): Raw image bytes of the receipt.
+        - model_name (str): Name of the model producing the result.
+        - schema_version (str): Version of the `Receipt` schema the result follows.
+        - digest (str | None): SHA-256 hex digest of the image if already computed
+          (e.g. while the upload was read), to avoid hashing the bytes again.
+
+        Returns:
+        - str: `<sha256 hex digest>:<model>:<schema version>`, identifying the
+          (image, model, schema) combination.
+        """
+        if digest is None:
+            digest = hashlib.sha256(image_bytes).hexdigest()
+        return f"{digest}:{model_name}:{schema_version}"
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up a cached result, checking memory first and then SQLite.
+
+        Parameters:
+        - key (str): Key built with `make_key`.
+
+        Returns:
+        - str | None: The cached receipt JSON, or None on a miss.
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                # Expired, drop it from memory (the disk copy is dropped below)
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, size, created_at FROM receipt_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, size, created_at = row
+                    if now - created_at < self.ttl_seconds:
+                        self._db.execute(
+                            "UPDATE receipt_cache SET accessed_at = ? WHERE key = ?", (now, key)
+                        )
+                        self._remember(key, created_at, value)
+                        self.disk_hits += 1
+                        return value
+                    self._db.execute("DELETE FROM receipt_cache WHERE key = ?", (key,))
+                    self._disk_bytes -= size
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Stores a result in both tiers and evicts old entries if the disk tier is full.
+
+        Parameters:
+        - key (str): Key built with `make_key`.
+        - value (str): Receipt JSON to cache.
+        """
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, now, value)
+
+            if self._db is not None:
+                # A replaced entry no longer counts towards the total
+                row = self._db.execute(
+                    "SELECT size FROM receipt_cache WHERE key = ?", (key,)
+                ).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO receipt_cache VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now, now),
+                )
+                self._disk_bytes += len(value) - (row[0] if row else 0)
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk(now)
+
+    def stats(self) -> dict:
+        """
+        Returns hit/miss counters and current tier sizes.
+
+        Returns:
+        - dict: Counters for memory hits, disk hits, misses, hit rate, entry counts and disk bytes.
+        """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            disk_entries = 0
+            if self._db is not None:
+                disk_entries = self._db.execute("SELECT COUNT(*) FROM receipt_cache").fetchone()[0]
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _remember(self, key: str, created_at: float, value: str) -> None:
+        """Inserts an entry in the memory LRU, evicting the least recently used one if full."""
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _disk_size(self) -> int:
+        """Sums the payload bytes of the SQLite tier."""
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM receipt_cache").fetchone()[0]
+
+    def _evict_disk(self, now: float) -> None:
+        """
+        Removes expired entries, then least recently used ones until under the size limit.
+        Only called once the running total is over the limit; the total is re-read from the
+        table first, so writes of other processes sharing the file are accounted for.
+        """
+        self._db.execute(
+            "DELETE FROM receipt_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        )
+        self._disk_bytes = self._disk_size()
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+
+        # Walk entries from least to most recently used until enough space is freed
+        excess = self._disk_bytes - self.max_disk_bytes
+        stale_keys = []
+        for key, size in self._db.execute(
+            "SELECT key, size FROM receipt_cache ORDER BY accessed_at"
+        ):
+            stale_keys.append((key,))
+            self._disk_bytes -= size
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM receipt_cache WHERE key = ?", stale_keys)
@@ -0,0 +1,125 @@
+"""
+File: receipt_checks.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Consistency rules for extracted receipts. A receipt whose items do not add
+up to its subtotal, or whose subtotal, tax, tip and discount do not add up to its total,
+was most likely misread; these checks catch that without a second model call.
+
+Usage:
+1. Call `receipt_problems(receipt)` with a `Receipt` (or a dict in the same layout).
+2. An empty list means the receipt passed every rule, otherwise each entry describes one failure.
+3. Call `sections_to_repair(receipt)` to find which part (`items`, `transaction`) to re-extract.
+"""
+
+
+def _close(a: float, b: float, tolerance: float) -> bool:
+    return abs(a - b) <= tolerance
+
+
+def _as_dict(receipt) -> dict:
+    return receipt.model_dump() if hasattr(receipt, "model_dump") else receipt
+
+
+def _items_match(items: list, subtotal: float, tolerance: float) -> bool:
+    """Whether the items add up to the subtotal, reading prices as unit prices or line totals."""
+    line_totals = sum(item["price"] for item in items)
+    unit_totals = sum(item["quantity"] * item["price"] for item in items)
+    return _close(line_totals, subtotal, tolerance) or _close(unit_totals, subtotal, tolerance)
+
+
+def _totals_match(transaction: dict, subtotal: float, tolerance: float) -> bool:
+    """Whether subtotal + tax + tip - discount is the total, the discount possibly already taken off."""
+    expected = subtotal + transaction["tax"] + (transaction["tip"] or 0.0)
+    discount = transaction["discount"] or 0.0
+    return _close(expected - discount, transaction["total"], tolerance) or _close(
+        expected, transaction["total"], tolerance
+    )
+
+
+def receipt_problems(receipt, tolerance: float = 0.05) -> list:
+    """
+    Checks that an extracted receipt is internally consistent.
+
+    Steps:
+    1. Requires a merchant name, a date, at least one item and a positive total.
+    2. Requires positive item quantities and non-negative prices.
+    3. Requires the items to add up to the subtotal, reading each price either as the
+       unit price or as the line total (receipts print both).
+    4. Requires subtotal + tax + tip - discount to equal the total, also accepting a
+       discount already taken off the subtotal.
+
+    Parameters:
+    - receipt (Receipt | dict): The extracted receipt.
+    - tolerance (float): Largest difference, in currency units, between amounts that should match.
+
+    Returns:
+    - list: Descriptions of the failed rules (empty if the receipt is consistent).
+    """
+    receipt = _as_dict(receipt)
+    merchant, transaction, items = receipt["merchant"], receipt["transaction"], receipt["items"]
+    problems = []
+
+    if not merchant["name"].strip():
+        problems.append("missing merchant name")
+    if not transaction["date"].strip():
+        problems.append("missing date")
+    if not items:
+        problems.append("no items")
+    if transaction["total"] <= 0:
+        problems.append("total is not positive")
+    if any(item["quantity"] <= 0 or item["price"] < 0 for item in items):
+        problems.append("item with a non-positive quantity or negative price")
+
+    # Items against the subtotal
+    subtotal = transaction["subtotal"]
+    if items and not _items_match(items, subtotal, tolerance):
+        unit_totals = sum(item["quantity"] * item["price"] for item in items)
+        problems.append(f"items add up to {unit_totals:.2f}, subtotal is {subtotal:.2f}")
+
+    # Subtotal, tax, tip and discount against the total
+    if not _totals_match(transaction, subtotal, tolerance):
+        expected = subtotal + transaction["tax"] + (transaction["tip"] or 0.0)
+        expected -= transaction["discount"] or 0.0
+        problems.append(
+            f"subtotal, tax, tip and discount add up to {expected:.2f}, total is {transaction['total']:.2f}"
+        )
+    return problems
+
+
+def sections_to_repair(receipt, tolerance: float = 0.05) -> list:
+    """
+    Works out which section of an inconsistent receipt was most likely misread.
+
+    Steps:
+    1. If the totals add up but the items do not match the subtotal, the items are wrong.
+    2. If the items match the subtotal but the totals do not add up, the transaction is wrong.
+    3. If neither holds but the items' sum would make the totals add up, only the subtotal
+       (part of the transaction) is wrong; otherwise both sections are re-read.
+
+    Parameters:
+    - receipt (Receipt | dict): The extracted receipt.
+    - tolerance (float): Largest difference, in currency units, between amounts that should match.
+
+    Returns:
+    - list: `items` and/or `transaction`, empty if the receipt is consistent.
+    """
+    receipt = _as_dict(receipt)
+    transaction, items = receipt["transaction"], receipt["items"]
+    subtotal = transaction["subtotal"]
+
+    items_ok = bool(items) and _items_match(items, subtotal, tolerance)
+    totals_ok = _totals_match(transaction, subtotal, tolerance)
+    if items_ok and totals_ok:
+        return []
+    if totals_ok:
+        return ["items"]
+    if items_ok:
+        return ["transaction"]
+
+    # Subtotal misread: the items' sum fits the rest of the transaction
+    line_totals = sum(item["price"] for item in items)
+    unit_totals = sum(item["quantity"] * item["price"] for item in items)
+    if items and any(_totals_match(transaction, total, tolerance) for total in (line_totals, unit_totals)):
+        return ["transaction"]
+    return ["items", "transaction"]
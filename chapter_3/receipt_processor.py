@@ -3,21 +3,105 @@ File: receipt_processor.py
 Author: Sina Mehdinia
 Date: 02/27/2025
 Description: Extracts structured receipt data from an image using
-Google's Gemini 2.0 Flash model or OpenAI's GPT-4o-mini.
+Google's Gemini 2.0 Flash model or OpenAI's GPT-4o-mini. When both are configured,
+each call is routed to the healthiest one (see `model_router.py`).
 
 Usage:
 1. Run the script with `python3 receipt_processor.py`.
 2. Ensure that the sample image path is correct before running.
 """
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
+import asyncio
+import binascii
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional
+
+# Start of the (slow) third-party imports, reported in `STARTUP_TIMINGS`
+_import_started = time.perf_counter()
+
 from dotenv import find_dotenv, load_dotenv
-import base64
 from pydantic import BaseModel
-from typing import List, Optional
 from langchain_core.messages import HumanMessage
 
+from config import (
+    CACHE_DISK_MAX_BYTES,
+    CACHE_ENABLED,
+    CACHE_MEMORY_ITEMS,
+    CACHE_PATH,
+    CASCADE_ENABLED,
+    CASCADE_LOCAL_CONCURRENCY,
+    CASCADE_LOCAL_TIMEOUT_SECONDS,
+    CONSISTENCY_TOLERANCE,
+    CACHE_TTL_SECONDS,
+    EXTRACTION_THREADS,
+    FAKE_FAILURE_RATE,
+    FAKE_JITTER_SECONDS,
+    FAKE_LATENCY_SECONDS,
+    FAKE_SEED,
+    LAZY_MODELS,
+    HEDGE_DEFAULT_DELAY_SECONDS,
+    HEDGE_DELAY_SECONDS,
+    HEDGE_ENABLED,
+    HEDGE_PERCENTILE,
+    HTTP2_ENABLED,
+    HTTP_KEEPALIVE_SECONDS,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE,
+    HTTP_TIMEOUT_SECONDS,
+    NEAR_DUPLICATE_ENABLED,
+    NEAR_DUPLICATE_HASH_SIZE,
+    NEAR_DUPLICATE_MAX_DISTANCE,
+    NEAR_DUPLICATE_PATH,
+    OLLAMA_BASE_URL,
+    OLLAMA_MODEL,
+    PREPROCESS_AUTOCROP,
+    PREPROCESS_ENABLED,
+    PREPROCESS_GRAYSCALE,
+    PREPROCESS_JPEG_QUALITY,
+    PREPROCESS_MAX_LONG_EDGE,
+    PREPROCESS_WORKERS,
+    PDF_DPI,
+    PROVIDERS,
+    RATE_LIMIT_BACKOFF_SECONDS,
+    RATE_LIMIT_DEFAULT_TOKENS,
+    RATE_LIMIT_MAX_BACKOFF_SECONDS,
+    RATE_LIMIT_MAX_RETRIES,
+    RATE_LIMIT_MAX_WAIT_SECONDS,
+    RATE_LIMIT_MAX_WAITING,
+    RATE_LIMITS,
+    ROUTER_COOLDOWN_SECONDS,
+    ROUTER_FAILURE_THRESHOLD,
+    ROUTER_WINDOW,
+    SHARED_STATE_PATH,
+    TILE_ASPECT,
+    TILE_MAX,
+    TILE_MIN_ASPECT,
+    TILE_OVERLAP,
+    TILING_ENABLED,
+    VALIDATION_ENABLED,
+    WORKERS,
+)
+from fake_model import FakeReceiptModel
+from http_clients import HttpClientPool
+from image_preprocessor import prepare_image, sniff_mime_type
+from model_cascade import ModelCascade
+from model_router import ModelRouter
+from near_duplicates import NearDuplicateIndex
+from rate_limiter import AdmissionController
+from receipt_cache import ReceiptCache
+from receipt_checks import receipt_problems, sections_to_repair
+from shared_state import SharedState
+
+logger = logging.getLogger(__name__)
+
 # Load environment variables (Ensure a .env file exists with API keys)
 load_dotenv(find_dotenv())
 
@@ -52,49 +136,996 @@ class Receipt(BaseModel):
     items: List[Item]
 
 
-# Initialize language models (ensure correct API setup in .env)
-#model = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-model = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0)
+class ReceiptItems(BaseModel):
+    """Items visible on one tile of a long receipt."""
+    items: List[Item]
+
+
+class ReceiptSummary(BaseModel):
+    """Merchant and transaction details of a long receipt, read from its header and footer."""
+    merchant: MerchantInfo
+    transaction: TransactionDetails
+
+
+# Version of the Receipt schema, changes whenever the Pydantic models above change
+RECEIPT_SCHEMA_VERSION = hashlib.sha256(
+    json.dumps(Receipt.model_json_schema(), sort_keys=True).encode("utf-8")
+).hexdigest()[:12]
+
+# Model name and API key variable of every supported provider
+# (`fake` is an offline stand-in for benchmarks, see `fake_model.py`)
+PROVIDER_MODELS = {
+    "gemini": ("gemini-2.0-flash", "GOOGLE_API_KEY"),
+    "openai": ("gpt-4o-mini", "OPENAI_API_KEY"),
+    "ollama": (OLLAMA_MODEL, None),
+    "fake": ("fake-receipt-model", None),
+}
 
-# Make the model generate structured outputs
-model_structured = model.with_structured_output(Receipt)
 
+# Keep-alive connections shared by every OpenAI call of this process
+http_pool = HttpClientPool(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive=HTTP_MAX_KEEPALIVE,
+    keepalive_seconds=HTTP_KEEPALIVE_SECONDS,
+    http2=HTTP2_ENABLED,
+    timeout_seconds=HTTP_TIMEOUT_SECONDS,
+)
 
-def process_receipt_bytes(image_bytes: bytes) -> dict:
+
+def build_chat_model(provider: str):
     """
-    Processes a receipt image given as raw bytes.
+    Initializes the chat model of a provider (ensure correct API setup in .env).
+    The provider's LangChain package is only imported here, so providers that are
+    not configured (or not used yet) cost nothing at start-up.
 
-    Steps:
-    1. Encodes the image bytes into a base64 string.
-    2. Creates a message with both text and image content.
-    3. Uses Gemini to extract structured receipt data.
+    Parameters:
+    - provider (str): Provider name, `gemini`, `openai`, `ollama` or `fake`.
+
+    Returns:
+    - BaseChatModel: The LangChain chat model.
+    """
+    model_name, _ = PROVIDER_MODELS[provider]
+    if provider == "gemini":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        # The Gemini client keeps its own long-lived gRPC (HTTP/2) channel, built once per model
+        return ChatGoogleGenerativeAI(model=model_name, temperature=0)
+    if provider == "openai":
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(
+            model=model_name,
+            temperature=0,
+            http_client=http_pool.sync_client,
+            http_async_client=http_pool.async_client,
+        )
+    if provider == "ollama":
+        from langchain_ollama import ChatOllama
+
+        return ChatOllama(
+            model=model_name,
+            base_url=OLLAMA_BASE_URL,
+            temperature=0,
+            client_kwargs={"timeout": CASCADE_LOCAL_TIMEOUT_SECONDS},
+        )
+    if provider == "fake":
+        return FakeReceiptModel(
+            latency=FAKE_LATENCY_SECONDS,
+            jitter=FAKE_JITTER_SECONDS,
+            failure_rate=FAKE_FAILURE_RATE,
+            seed=FAKE_SEED,
+        )
+    raise ValueError(f"Unknown provider: {provider}")
+
+
+def build_structured_model(provider: str, schema=Receipt):
+    """
+    Builds a provider's chat model with structured output (a `Receipt` by default).
+    `include_raw` keeps the raw model message, which carries the token usage.
+    """
+    if provider == "ollama":
+        # Local vision models rarely support tool calling, constrain the output to the JSON schema instead
+        return build_chat_model(provider).with_structured_output(
+            schema, method="json_schema", include_raw=True
+        )
+    return build_chat_model(provider).with_structured_output(schema, include_raw=True)
+
+
+# Import and start-up durations, exposed on `/startup_stats`
+STARTUP_TIMINGS = {"import_seconds": None, "model_build_seconds": {}, "warm_up_seconds": None}
+
+
+class LazyModel:
+    """
+    Stand-in for a provider's structured runnable that builds it on first use
+    (or during the warm-up), so importing this module stays fast.
+    """
+
+    def __init__(self, provider: str, schema=Receipt):
+        self.provider = provider
+        self.schema = schema
+        self._runnable = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        return self._runnable is not None
+
+    def get(self):
+        """Returns the runnable, building it (once, thread-safe) if needed."""
+        if self._runnable is None:
+            with self._lock:
+                if self._runnable is None:
+                    started = time.perf_counter()
+                    self._runnable = build_structured_model(self.provider, self.schema)
+                    seconds = round(time.perf_counter() - started, 6)
+                    name = self.provider
+                    if self.schema is not Receipt:
+                        name = f"{self.provider}:{self.schema.__name__}"
+                    STARTUP_TIMINGS["model_build_seconds"][name] = seconds
+                    logger.info("Built the %s model in %.3fs", name, seconds)
+        return self._runnable
+
+    def invoke(self, messages: list):
+        return self.get().invoke(messages)
+
+    async def ainvoke(self, messages: list):
+        # Building imports the provider package, keep that off the event loop
+        runnable = self._runnable or await asyncio.to_thread(self.get)
+        return await runnable.ainvoke(messages)
+
+
+# Select the configured providers, skipping those without an API key. Their models are
+# built on first use (or by `warm_up`), unless `RECEIPT_LAZY_MODELS=false`.
+chat_models = {}
+for provider in PROVIDERS:
+    if provider not in PROVIDER_MODELS:
+        raise ValueError(f"Unknown provider in RECEIPT_PROVIDERS: {provider}")
+    api_key_variable = PROVIDER_MODELS[provider][1]
+    if api_key_variable and not os.getenv(api_key_variable):
+        logger.warning("%s not set, skipping the %s provider", api_key_variable, provider)
+        continue
+    chat_models[provider] = LazyModel(provider)
+    if not LAZY_MODELS:
+        chat_models[provider].get()
+
+if not chat_models:
+    raise ValueError(
+        "No receipt model available. Set GOOGLE_API_KEY and/or OPENAI_API_KEY in your .env file."
+    )
+
+# Local first tier of the cascade, whose answers must pass the consistency checks
+model_cascade = None
+if CASCADE_ENABLED:
+    model_cascade = ModelCascade(
+        LazyModel("ollama"),
+        check=partial(receipt_problems, tolerance=CONSISTENCY_TOLERANCE),
+        name="ollama",
+        max_concurrency=CASCADE_LOCAL_CONCURRENCY,
+        window=ROUTER_WINDOW,
+    )
+
+# Name of the model(s) producing results, part of the result cache key
+MODEL_NAME = ",".join(PROVIDER_MODELS[provider][0] for provider in chat_models)
+if model_cascade is not None:
+    MODEL_NAME = f"{OLLAMA_MODEL}>{MODEL_NAME}"
+
+# Thread pool used when the model has no native async implementation
+_extraction_executor = ThreadPoolExecutor(
+    max_workers=EXTRACTION_THREADS, thread_name_prefix="receipt-extraction"
+)
+
+def _require_receipt(output: dict, schema=Receipt) -> None:
+    """Rejects structured outputs that did not parse into a `Receipt` (or the given schema)."""
+    if output.get("parsing_error") is not None:
+        raise ValueError(f"Model output is not a valid receipt: {output['parsing_error']}")
+    if not isinstance(output.get("parsed"), schema):
+        raise ValueError("Model did not return a receipt")
+
+
+def _used_tokens(output: dict) -> Optional[int]:
+    """Returns the total tokens reported in the raw model message, if any."""
+    usage = getattr(output.get("raw"), "usage_metadata", None)
+    if not usage:
+        return None
+    return usage.get("total_tokens") or usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+
+
+# State shared with the other worker processes when running several (see `serve.py`)
+shared_state = SharedState(SHARED_STATE_PATH) if WORKERS > 1 else None
+
+# Keep every provider within its requests/tokens per minute and retry its rate-limit errors
+admission_controller = AdmissionController(
+    RATE_LIMITS,
+    default_tokens=RATE_LIMIT_DEFAULT_TOKENS,
+    max_waiting=RATE_LIMIT_MAX_WAITING,
+    max_wait_seconds=RATE_LIMIT_MAX_WAIT_SECONDS,
+    max_retries=RATE_LIMIT_MAX_RETRIES,
+    backoff_seconds=RATE_LIMIT_BACKOFF_SECONDS,
+    max_backoff_seconds=RATE_LIMIT_MAX_BACKOFF_SECONDS,
+    count_tokens=_used_tokens,
+    shared_state=shared_state,
+)
+
+# Route each call to the healthiest of the structured-output models
+model_router = ModelRouter(
+    chat_models,
+    window=ROUTER_WINDOW,
+    failure_threshold=ROUTER_FAILURE_THRESHOLD,
+    cooldown_seconds=ROUTER_COOLDOWN_SECONDS,
+    executor=_extraction_executor,
+    validate=_require_receipt,
+    limiter=admission_controller,
+)
+
+# Routers of the prompts reading one section of a receipt (the items of one tile of a long
+# receipt, its header and footer, or a section re-read after failing validation), with the
+# same providers, health tracking settings and quotas as the main router
+section_routers = {
+    schema: ModelRouter(
+        {provider: LazyModel(provider, schema) for provider in chat_models},
+        window=ROUTER_WINDOW,
+        failure_threshold=ROUTER_FAILURE_THRESHOLD,
+        cooldown_seconds=ROUTER_COOLDOWN_SECONDS,
+        executor=_extraction_executor,
+        validate=partial(_require_receipt, schema=schema),
+        limiter=admission_controller,
+    )
+    for schema in (ReceiptItems, ReceiptSummary, TransactionDetails)
+} if TILING_ENABLED or VALIDATION_ENABLED else {}
+
+# Hedged calls: fire a second request if the first has not answered within the delay
+_hedge_options = {
+    "delay": HEDGE_DELAY_SECONDS,
+    "percentile": HEDGE_PERCENTILE,
+    "default_delay": HEDGE_DEFAULT_DELAY_SECONDS,
+}
+
+# Process pool for the CPU-heavy image pre-processing (decode, crop, resize, re-encode)
+_preprocess_executor = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS)
+
+# Image pre-processing with the configured settings: one decode and crop per upload, then
+# long receipts and PDFs are split into tiles and the rest is shrunk
+_prepare = partial(
+    prepare_image,
+    tiling=TILING_ENABLED,
+    preprocess=PREPROCESS_ENABLED,
+    min_aspect=TILE_MIN_ASPECT,
+    tile_aspect=TILE_ASPECT,
+    overlap=TILE_OVERLAP,
+    max_tiles=TILE_MAX,
+    pdf_dpi=PDF_DPI,
+    max_long_edge=PREPROCESS_MAX_LONG_EDGE,
+    quality=PREPROCESS_JPEG_QUALITY,
+    grayscale=PREPROCESS_GRAYSCALE,
+    autocrop=PREPROCESS_AUTOCROP,
+    hash_size=NEAR_DUPLICATE_HASH_SIZE if NEAR_DUPLICATE_ENABLED else 0,
+)
+
+# Cache of extracted receipts so duplicate uploads skip the model call
+receipt_cache = ReceiptCache(
+    CACHE_PATH,
+    memory_items=CACHE_MEMORY_ITEMS,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    max_disk_bytes=CACHE_DISK_MAX_BYTES,
+) if CACHE_ENABLED else None
+
+
+def _cache_lookup(image_bytes: bytes, image_digest: Optional[str] = None):
+    """
+    Looks up a previously extracted receipt for the same image, model and schema.
 
     Parameters:
     - image_bytes (bytes): Raw image bytes of the receipt.
+    - image_digest (str | None): SHA-256 hex digest of the image, if already computed.
 
     Returns:
-    - dict: JSON-serializable dictionary with structured receipt data.
+    - tuple: (cache key or None, cached receipt JSON or None, see `_parse_stored`).
+    """
+    if receipt_cache is None:
+        return None, None
+
+    key = receipt_cache.make_key(image_bytes, MODEL_NAME, RECEIPT_SCHEMA_VERSION, image_digest)
+    return key, receipt_cache.get(key)
+
+
+def _cache_store(key, receipt) -> None:
+    """Stores a freshly extracted receipt under the key returned by `_cache_lookup`."""
+    if key is not None and isinstance(receipt, Receipt):
+        receipt_cache.set(key, receipt.model_dump_json())
+
+
+# Perceptual-hash index so re-photographed receipts reuse the earlier result
+near_duplicate_index = NearDuplicateIndex(
+    NEAR_DUPLICATE_PATH,
+    bits=NEAR_DUPLICATE_HASH_SIZE ** 2,
+    max_distance=NEAR_DUPLICATE_MAX_DISTANCE,
+    namespace=f"{MODEL_NAME}:{RECEIPT_SCHEMA_VERSION}",
+) if NEAR_DUPLICATE_ENABLED else None
+if NEAR_DUPLICATE_ENABLED and not PREPROCESS_ENABLED:
+    logger.warning(
+        "RECEIPT_NEAR_DUPLICATE_ENABLED has no effect on receipts sent whole with "
+        "RECEIPT_PREPROCESS_ENABLED=false: the perceptual hash is computed during pre-processing"
+    )
+
+
+def _near_duplicate_lookup(fingerprint: Optional[int], details: Optional[dict]):
+    """
+    Looks up an earlier receipt whose photo is perceptually close to this one.
+
+    Parameters:
+    - fingerprint (int | None): Perceptual hash of the image, None if it could not be computed.
+    - details (dict | None): Optional dictionary receiving `near_duplicate` and, on a match,
+      `near_duplicate_of` (id of the original image) and `near_duplicate_distance`.
+
+    Returns:
+    - str | None: JSON of the earlier receipt (see `_parse_stored`), or None.
+    """
+    if near_duplicate_index is None or fingerprint is None:
+        return None
+
+    match = near_duplicate_index.find(fingerprint)
+    if details is not None:
+        details["near_duplicate"] = match is not None
+    if match is None:
+        return None
+
+    original_id, receipt_json, distance = match
+    if details is not None:
+        details.update(near_duplicate_of=original_id, near_duplicate_distance=distance)
+    return receipt_json
+
+
+def _remember_fingerprint(image_bytes: bytes, image_digest: Optional[str], fingerprint, receipt) -> None:
+    """Adds a freshly extracted receipt to the near-duplicate index, keyed by the image's SHA-256."""
+    if near_duplicate_index is None or fingerprint is None or not isinstance(receipt, Receipt):
+        return
+    if image_digest is None:
+        image_digest = hashlib.sha256(image_bytes).hexdigest()
+    near_duplicate_index.add(image_digest, fingerprint, receipt.model_dump_json())
+
+
+def _store_result(cache_key, image_bytes: bytes, image_digest: Optional[str], fingerprint, receipt) -> None:
+    """Stores a freshly extracted receipt in the cache and the near-duplicate index."""
+    _cache_store(cache_key, receipt)
+    _remember_fingerprint(image_bytes, image_digest, fingerprint, receipt)
+
+
+@contextmanager
+def _stage(details: Optional[dict], name: str):
+    """Times a processing stage and stores its duration as `<name>_seconds` in `details`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if details is not None:
+            details[f"{name}_seconds"] = round(time.perf_counter() - started, 6)
+
+
+def _parse_stored(receipt_json: Optional[str], details: Optional[dict]) -> Optional[Receipt]:
+    """
+    Validates a receipt read from the cache or the near-duplicate index, timed as the
+    `validate` stage. Fresh model answers are validated by the structured-output parser
+    inside the model call instead: a parsing error there makes the router fail over and
+    the cascade escalate, so it cannot move out of the `model` stage.
+    """
+    if receipt_json is None:
+        return None
+    with _stage(details, "validate"):
+        return Receipt.model_validate_json(receipt_json)
+
+
+def _record_preprocessing(image_bytes: bytes, prepared, details) -> tuple:
     """
-    # Convert the image bytes to a base64-encoded string
-    image_data = base64.b64encode(image_bytes).decode("utf-8")
+    Logs the before/after payload sizes and copies them into the caller's `details`.
 
+    Parameters:
+    - image_bytes (bytes): Raw image bytes of the receipt.
+    - prepared (tuple | None): Result of `preprocess_image`, or None if pre-processing is disabled.
+    - details (dict | None): Optional dictionary collecting per-request information.
+
+    Returns:
+    - tuple: (image bytes to send, their MIME type, perceptual hash or None).
+    """
+    if prepared is None:
+        prepared = image_bytes, sniff_mime_type(image_bytes), {
+            "original_bytes": len(image_bytes),
+            "processed_bytes": len(image_bytes),
+        }
+
+    image_bytes, mime_type, sizes = prepared
+    sizes = dict(sizes)
+    fingerprint = sizes.pop("perceptual_hash", None)
+    logger.info(
+        "Receipt image pre-processed: %d -> %d bytes (%s)",
+        sizes["original_bytes"], sizes["processed_bytes"], mime_type,
+    )
+    if details is not None:
+        details.update(sizes, mime_type=mime_type)
+    return image_bytes, mime_type, fingerprint
+
+
+def _record_usage(output: dict, details: Optional[dict]):
+    """
+    Copies the token usage of the raw model message into `details` and returns the parsed receipt.
+
+    Parameters:
+    - output (dict): Structured output with `raw` message and `parsed` receipt.
+    - details (dict | None): Optional dictionary collecting per-request information.
+
+    Returns:
+    - Receipt: The parsed receipt.
+    """
+    usage = getattr(output["raw"], "usage_metadata", None)
+    if details is not None and usage:
+        details["input_tokens"] = usage.get("input_tokens", 0)
+        details["output_tokens"] = usage.get("output_tokens", 0)
+    return output["parsed"]
+
+
+def encode_data_url(image_bytes: bytes, mime_type: str) -> str:
+    """
+    Base64-encodes an image straight into its `data:` URL.
+
+    The image is encoded in chunks into one pre-sized buffer that already holds the URL
+    prefix, so the only full-size allocations are that buffer and the final string
+    (instead of the base64 bytes, their decoded string and the formatted URL).
+
+    Parameters:
+    - image_bytes (bytes): Image bytes (any bytes-like object).
+    - mime_type (str): MIME type used to label the image.
+
+    Returns:
+    - str: The `data:<mime>;base64,...` URL.
+    """
+    prefix = f"data:{mime_type};base64,".encode("ascii")
+    chunk_size = 3 * 64 * 1024  # Multiple of 3, so chunks encode without padding
+
+    with memoryview(image_bytes) as view:
+        buffer = bytearray(len(prefix) + 4 * ((len(view) + 2) // 3))
+        buffer[: len(prefix)] = prefix
+        position = len(prefix)
+        for start in range(0, len(view), chunk_size):
+            encoded = binascii.b2a_base64(view[start : start + chunk_size], newline=False)
+            buffer[position : position + len(encoded)] = encoded
+            position += len(encoded)
+
+    return buffer.decode("ascii")
+
+
+def build_receipt_message(image_bytes: bytes, mime_type: str = "image/jpeg") -> HumanMessage:
+    """
+    Builds the multimodal message sent to the model for a receipt image.
+
+    Parameters:
+    - image_bytes (bytes): Image bytes of the receipt.
+    - mime_type (str): MIME type used to label the image in the data URL.
+
+    Returns:
+    - HumanMessage: Message with both the instruction text and the base64-encoded image.
+    """
     # Construct the message format for model invocation
-    message = HumanMessage(
+    return HumanMessage(
         content=[
             {"type": "text", "text": "Extract the transactions from the image."},
             {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{image_data}"},
+                "image_url": {"url": encode_data_url(image_bytes, mime_type)},
             },
         ],
     )
 
+
+def build_tile_messages(tiles: list) -> tuple:
+    """
+    Creates the messages extracting a tiled receipt: one per tile for its items, and one
+    with the first and last tiles for the merchant and the totals.
+
+    Parameters:
+    - tiles (list): (page index, JPEG tile) pairs, top to bottom (see `tile_image`).
+
+    Returns:
+    - tuple: (list of item messages, summary message).
+    """
+    count = len(tiles)
+    item_messages = [
+        HumanMessage(
+            content=[
+                {
+                    "type": "text",
+                    "text": (
+                        f"This is part {index} of {count} of a long receipt, cut into overlapping parts. "
+                        "Extract the purchased items shown in this part. Skip lines cut off at the top "
+                        "or bottom edge, and skip subtotal, tax, tip and total lines."
+                    ),
+                },
+                {"type": "image_url", "image_url": {"url": encode_data_url(tile, "image/jpeg")}},
+            ],
+        )
+        for index, (_, tile) in enumerate(tiles, start=1)
+    ]
+
+    # The merchant is printed at the top of a receipt and the totals at the bottom
+    ends = [tile for _, tile in tiles] if count <= 2 else [tiles[0][1], tiles[-1][1]]
+    summary_message = HumanMessage(
+        content=[
+            {
+                "type": "text",
+                "text": (
+                    "These are the top and bottom parts of a long receipt. "
+                    "Extract the merchant and the transaction details."
+                ),
+            },
+            *(
+                {"type": "image_url", "image_url": {"url": encode_data_url(tile, "image/jpeg")}}
+                for tile in ends
+            ),
+        ],
+    )
+    return item_messages, summary_message
+
+
+def _item_key(item: Item) -> tuple:
+    return " ".join(item.name.lower().split()), item.quantity, round(item.price, 2)
+
+
+def merge_tile_items(tiles_items: list) -> list:
+    """
+    Joins the items of consecutive tiles, dropping the items read twice in their overlap.
+
+    Steps:
+    1. Keeps every item of the first tile of each page (tiles of different PDF pages do
+       not overlap, so an item repeated across a page break is kept).
+    2. For each next tile of the same page, finds the longest run of items ending the
+       previous tile that also starts this tile (same name, quantity and price), and
+       skips that run.
+
+    Parameters:
+    - tiles_items (list): (page index, list of `Item`) pairs, one per tile, top to bottom.
+
+    Returns:
+    - list: The merged items.
+    """
+    merged = []
+    previous = []
+    previous_page = None
+    for page, items in tiles_items:
+        if page != previous_page:
+            previous = []
+            previous_page = page
+        keys = [_item_key(item) for item in items]
+        overlap = 0
+        for length in range(min(len(previous), len(keys)), 0, -1):
+            if previous[-length:] == keys[:length]:
+                overlap = length
+                break
+        merged.extend(items[overlap:])
+        previous = keys
+    return merged
+
+
+def _record_tiled_usage(outputs: list, tiles: list, counts: dict, details: Optional[dict]) -> Receipt:
+    """
+    Sums the token usage of the tile calls into `details` and assembles the receipt.
+
+    Parameters:
+    - outputs (list): Structured outputs of the item calls (tile order), then of the summary call.
+    - tiles (list): (page index, JPEG tile) pairs the item calls were made for.
+    - counts (dict): Tile counts returned by `tile_image` (`pages`, `tiles`).
+    - details (dict | None): Optional dictionary collecting per-request information.
+
+    Returns:
+    - Receipt: The receipt, with the items of all tiles.
+    """
+    *item_outputs, summary_output = outputs
+    if details is not None:
+        details.update(tiled=True, **counts)
+        usages = [getattr(output["raw"], "usage_metadata", None) or {} for output in outputs]
+        details["input_tokens"] = sum(usage.get("input_tokens", 0) for usage in usages)
+        details["output_tokens"] = sum(usage.get("output_tokens", 0) for usage in usages)
+
+    summary = summary_output["parsed"]
+    items = merge_tile_items(
+        [(page, output["parsed"].items) for (page, _), output in zip(tiles, item_outputs)]
+    )
+    return Receipt(merchant=summary.merchant, transaction=summary.transaction, items=items)
+
+
+# Schema and instructions of the sections re-read when a receipt fails validation
+_REPAIR_PROMPTS = {
+    "items": (
+        ReceiptItems,
+        "Read only the purchased item lines of this receipt: name, quantity and price of each. "
+        "An earlier reading found {count} items adding up to {item_sum:.2f}, which does not match "
+        "the subtotal of {subtotal:.2f}; check for missed, duplicated or misread lines.",
+    ),
+    "transaction": (
+        TransactionDetails,
+        "Read only the date, subtotal, tax, tip, discount and total printed on this receipt. "
+        "An earlier reading (subtotal {subtotal:.2f}, tax {tax:.2f}, total {total:.2f}) does not "
+        "add up; check every amount.",
+    ),
+}
+
+
+def build_repair_message(image_bytes: bytes, mime_type: str, receipt: Receipt, section: str) -> HumanMessage:
+    """
+    Creates a message re-reading one section of a receipt that failed validation, telling the
+    model what did not add up.
+
+    Parameters:
+    - image_bytes (bytes): Image bytes sent for the original extraction.
+    - mime_type (str): MIME type of the image.
+    - receipt (Receipt): The inconsistent receipt.
+    - section (str): Section to re-read, `items` or `transaction`.
+
+    Returns:
+    - HumanMessage: Message with the section's instructions and the image.
+    """
+    transaction = receipt.transaction
+    text = _REPAIR_PROMPTS[section][1].format(
+        count=len(receipt.items),
+        item_sum=sum(item.quantity * item.price for item in receipt.items),
+        subtotal=transaction.subtotal,
+        tax=transaction.tax,
+        total=transaction.total,
+    )
+    return HumanMessage(
+        content=[
+            {"type": "text", "text": text},
+            {"type": "image_url", "image_url": {"url": encode_data_url(image_bytes, mime_type)}},
+        ],
+    )
+
+
+def _validate(receipt: Receipt, details: Optional[dict]) -> list:
+    """Returns the sections to re-read (empty if the receipt is consistent) and records the check."""
+    sections = sections_to_repair(receipt, CONSISTENCY_TOLERANCE)
+    if details is not None:
+        details["validation"] = "repairing" if sections else "passed"
+    return sections
+
+
+def _check_tiled(receipt: Receipt, details: Optional[dict]) -> None:
+    """
+    Records whether a tiled receipt adds up. Its sections cannot be re-read from a single
+    image like `_apply_repairs` does, so an inconsistent tiled receipt is only flagged.
+    """
+    if not VALIDATION_ENABLED:
+        return
+    problems = receipt_problems(receipt, CONSISTENCY_TOLERANCE)
+    if problems:
+        logger.warning("Tiled receipt does not add up: %s", "; ".join(problems))
+    if details is not None:
+        details["validation"] = "inconsistent" if problems else "passed"
+
+
+def _apply_repairs(receipt: Receipt, sections: list, outputs: list, details: Optional[dict]) -> Receipt:
+    """
+    Merges the re-read sections into the receipt, keeping the original if the repair did not help.
+
+    Parameters:
+    - receipt (Receipt): The inconsistent receipt.
+    - sections (list): Sections re-read, in the order of `outputs`.
+    - outputs (list): Structured outputs of the repair calls, or the exceptions they raised.
+    - details (dict | None): Optional dictionary collecting per-request information.
+
+    Returns:
+    - Receipt: The repaired receipt if it is consistent, otherwise the one with fewer problems.
+    """
+    repaired = receipt
+    for section, output in zip(sections, outputs):
+        if isinstance(output, BaseException):
+            logger.warning("Re-reading the %s of a receipt failed: %s", section, output)
+            continue
+        parsed = output["parsed"]
+        repaired = repaired.model_copy(update={section: parsed.items if section == "items" else parsed})
+
+        # The repair calls count towards the request's token usage
+        usage = getattr(output["raw"], "usage_metadata", None)
+        if details is not None and usage:
+            for kind in ("input", "output"):
+                details[f"{kind}_tokens"] = details.get(f"{kind}_tokens", 0) + usage.get(f"{kind}_tokens", 0)
+
+    remaining = receipt_problems(repaired, CONSISTENCY_TOLERANCE)
+    if remaining and len(remaining) >= len(receipt_problems(receipt, CONSISTENCY_TOLERANCE)):
+        repaired = receipt
+    if details is not None:
+        details["validation"] = "inconsistent" if remaining else "repaired"
+        details["repaired_sections"] = ",".join(sections)
+    return repaired
+
+
+def process_receipt_bytes(
+    image_bytes: bytes,
+    details: Optional[dict] = None,
+    hedge: Optional[bool] = None,
+    image_digest: Optional[str] = None,
+) -> dict:
+    """
+    Processes a receipt image given as raw bytes.
+
+    Steps:
+    1. Returns the cached result if the same image was already processed.
+    2. Decodes and crops the image once, then shrinks it (downscale, grayscale, re-encode),
+       and returns the result of an earlier photo of the same receipt if its perceptual
+       hash is close. Long receipts and PDFs are instead cut into tiles extracted in
+       parallel (see `build_tile_messages`), their items merged and their totals checked.
+    3. Encodes the image bytes into a base64 string.
+    4. Creates a message with both text and image content.
+    5. Uses the healthiest configured model to extract structured receipt data
+       (hedged against a slow provider if enabled). With the cascade enabled, the
+       local model answers first and only inconsistent answers escalate.
+    6. Checks that the items and totals add up, re-reads only the section that does
+       not (see `build_repair_message`), and caches the result.
+
+    Parameters:
+    - image_bytes (bytes): Raw image bytes of the receipt.
+    - details (dict | None): Optional dictionary filled with per-request information
+      (e.g. `cache_hit`, `near_duplicate`, `original_bytes`, `processed_bytes`, `provider`,
+      `tier`, `model_seconds`, `input_tokens`).
+    - hedge (bool | None): Whether to hedge the model call against a slow provider,
+      defaults to the `RECEIPT_HEDGE_ENABLED` setting.
+    - image_digest (str | None): SHA-256 hex digest of the image if already computed
+      (e.g. while reading the upload), so the cache does not hash it again.
+
+    Returns:
+    - dict: JSON-serializable dictionary with structured receipt data.
+    """
+    # Skip the model call entirely for duplicate uploads
+    with _stage(details, "cache_lookup"):
+        cache_key, cached = _cache_lookup(image_bytes, image_digest)
+    receipt = _parse_stored(cached, details)
+    if details is not None:
+        details["cache_hit"] = receipt is not None
+    if receipt is not None:
+        return receipt
+
+    # Decode and crop the image once: long receipts and PDFs become tiles, the rest is shrunk
+    with _stage(details, "preprocess"):
+        tiled, prepared = None, None
+        if TILING_ENABLED or PREPROCESS_ENABLED:
+            tiled, prepared = _prepare(image_bytes)
+
+    # Extract long receipts and PDFs tile by tile, all tiles at once
+    if tiled is not None:
+        tiles, counts = tiled
+        fingerprint = counts.pop("perceptual_hash", None)
+        with _stage(details, "near_duplicate_lookup"):
+            match = _near_duplicate_lookup(fingerprint, details)
+        receipt = _parse_stored(match, details)
+        if receipt is not None:
+            _cache_store(cache_key, receipt)
+            return receipt
+        with _stage(details, "encode"):
+            item_messages, summary_message = build_tile_messages(tiles)
+        with _stage(details, "model"):
+            # `details` gets the provider of the summary call
+            calls = [
+                _extraction_executor.submit(section_routers[ReceiptItems].invoke, [message])
+                for message in item_messages
+            ]
+            calls.append(
+                _extraction_executor.submit(
+                    section_routers[ReceiptSummary].invoke, [summary_message], details
+                )
+            )
+            outputs = [call.result() for call in calls]
+        receipt = _record_tiled_usage(outputs, tiles, counts, details)
+        with _stage(details, "validate"):
+            _check_tiled(receipt, details)
+        _store_result(cache_key, image_bytes, image_digest, fingerprint, receipt)
+        return receipt
+
+    payload, mime_type, fingerprint = _record_preprocessing(image_bytes, prepared, details)
+
+    # Answer a new photo of an already extracted receipt with the earlier result
+    with _stage(details, "near_duplicate_lookup"):
+        match = _near_duplicate_lookup(fingerprint, details)
+    receipt = _parse_stored(match, details)
+    if receipt is not None:
+        _cache_store(cache_key, receipt)
+        return receipt
+
+    with _stage(details, "encode"):
+        message = build_receipt_message(payload, mime_type)
+
     # Call the structured model to extract receipt data
-    receipt = model_structured.invoke([message])
+    def cloud_call():
+        if HEDGE_ENABLED if hedge is None else hedge:
+            return model_router.hedged_invoke([message], details, **_hedge_options)
+        return model_router.invoke([message], details)
+
+    with _stage(details, "model"):
+        if model_cascade is not None:
+            output = model_cascade.invoke([message], cloud_call, details)
+        else:
+            output = cloud_call()
+    receipt = _record_usage(output, details)
+
+    # Re-read only the section that does not add up, instead of the whole receipt
+    with _stage(details, "validate"):
+        sections = _validate(receipt, details) if VALIDATION_ENABLED else []
+    if sections:
+        with _stage(details, "repair"):
+            calls = [
+                _extraction_executor.submit(
+                    section_routers[_REPAIR_PROMPTS[section][0]].invoke,
+                    [build_repair_message(payload, mime_type, receipt, section)],
+                )
+                for section in sections
+            ]
+            outputs = []
+            for call in calls:
+                try:
+                    outputs.append(call.result())
+                except Exception as exc:
+                    outputs.append(exc)
+        receipt = _apply_repairs(receipt, sections, outputs, details)
+
+    _store_result(cache_key, image_bytes, image_digest, fingerprint, receipt)
+    return receipt
+
+
+async def aprocess_receipt_bytes(
+    image_bytes: bytes,
+    details: Optional[dict] = None,
+    hedge: Optional[bool] = None,
+    image_digest: Optional[str] = None,
+    priority: str = "interactive",
+) -> dict:
+    """
+    Async version of `process_receipt_bytes` that never blocks the event loop.
+
+    Steps:
+    1. Returns the cached result if the same image was already processed.
+    2. Decodes, crops and shrinks the image in a separate process, and returns the result
+       of an earlier photo of the same receipt if its perceptual hash is close. Long
+       receipts and PDFs are instead cut into tiles whose calls are awaited together.
+    3. Builds the same multimodal message as `process_receipt_bytes`.
+    4. Awaits the routed model's native `ainvoke` (hedged against a slow provider if enabled),
+       once the provider's rate limits admit the call.
+    5. Falls back to running the blocking `invoke` in a thread pool
+       if the provider does not implement async calls.
+    6. Re-reads only the section of an inconsistent receipt, like `process_receipt_bytes`.
+    With the cascade enabled, the local model answers first and only inconsistent answers
+    reach the routed providers.
+
+    Parameters:
+    - image_bytes (bytes): Raw image bytes of the receipt.
+    - details (dict | None): Optional dictionary filled with per-request information
+      (e.g. `cache_hit`, `near_duplicate`, `original_bytes`, `processed_bytes`, `provider`,
+      `tier`, `model_seconds`, `input_tokens`).
+    - hedge (bool | None): Whether to hedge the model call against a slow provider,
+      defaults to the `RECEIPT_HEDGE_ENABLED` setting.
+    - image_digest (str | None): SHA-256 hex digest of the image if already computed
+      (e.g. while reading the upload), so the cache does not hash it again.
+    - priority (str): Priority class used when waiting for provider quota
+      (`interactive`, `batch` or `background`).
+
+    Returns:
+    - dict: JSON-serializable dictionary with structured receipt data.
+    """
+    # Skip the model call entirely for duplicate uploads; the cache and the near-duplicate
+    # index read and write SQLite, so they are called from a thread
+    with _stage(details, "cache_lookup"):
+        cache_key, cached = await asyncio.to_thread(_cache_lookup, image_bytes, image_digest)
+    receipt = _parse_stored(cached, details)
+    if details is not None:
+        details["cache_hit"] = receipt is not None
+    if receipt is not None:
+        return receipt
+
+    loop = asyncio.get_running_loop()
+
+    # Decode and crop the image once, in the process pool so the CPU work stays off the
+    # event loop: long receipts and PDFs become tiles, the rest is shrunk
+    with _stage(details, "preprocess"):
+        tiled, prepared = None, None
+        if TILING_ENABLED or PREPROCESS_ENABLED:
+            tiled, prepared = await loop.run_in_executor(_preprocess_executor, _prepare, image_bytes)
+
+    # Extract long receipts and PDFs tile by tile, all tiles at once
+    if tiled is not None:
+        tiles, counts = tiled
+        fingerprint = counts.pop("perceptual_hash", None)
+        with _stage(details, "near_duplicate_lookup"):
+            match = await asyncio.to_thread(_near_duplicate_lookup, fingerprint, details)
+        receipt = _parse_stored(match, details)
+        if receipt is not None:
+            await asyncio.to_thread(_cache_store, cache_key, receipt)
+            return receipt
+        with _stage(details, "encode"):
+            item_messages, summary_message = build_tile_messages(tiles)
+        with _stage(details, "model"):
+            outputs = await asyncio.gather(
+                *(
+                    section_routers[ReceiptItems].ainvoke([message], None, priority)
+                    for message in item_messages
+                ),
+                section_routers[ReceiptSummary].ainvoke([summary_message], details, priority),
+            )
+        receipt = _record_tiled_usage(outputs, tiles, counts, details)
+        with _stage(details, "validate"):
+            _check_tiled(receipt, details)
+        await asyncio.to_thread(_store_result, cache_key, image_bytes, image_digest, fingerprint, receipt)
+        return receipt
+
+    payload, mime_type, fingerprint = _record_preprocessing(image_bytes, prepared, details)
+
+    # Answer a new photo of an already extracted receipt with the earlier result
+    with _stage(details, "near_duplicate_lookup"):
+        match = await asyncio.to_thread(_near_duplicate_lookup, fingerprint, details)
+    receipt = _parse_stored(match, details)
+    if receipt is not None:
+        await asyncio.to_thread(_cache_store, cache_key, receipt)
+        return receipt
+
+    with _stage(details, "encode"):
+        message = build_receipt_message(payload, mime_type)
 
+    # Call the structured model asynchronously to extract receipt data
+    async def cloud_call():
+        if HEDGE_ENABLED if hedge is None else hedge:
+            return await model_router.ahedged_invoke([message], details, priority=priority, **_hedge_options)
+        return await model_router.ainvoke([message], details, priority)
+
+    with _stage(details, "model"):
+        if model_cascade is not None:
+            output = await model_cascade.ainvoke([message], cloud_call, details)
+        else:
+            output = await cloud_call()
+    receipt = _record_usage(output, details)
+
+    # Re-read only the section that does not add up, instead of the whole receipt
+    with _stage(details, "validate"):
+        sections = _validate(receipt, details) if VALIDATION_ENABLED else []
+    if sections:
+        with _stage(details, "repair"):
+            outputs = await asyncio.gather(
+                *(
+                    section_routers[_REPAIR_PROMPTS[section][0]].ainvoke(
+                        [build_repair_message(payload, mime_type, receipt, section)], None, priority
+                    )
+                    for section in sections
+                ),
+                return_exceptions=True,
+            )
+        receipt = _apply_repairs(receipt, sections, outputs, details)
+
+    await asyncio.to_thread(_store_result, cache_key, image_bytes, image_digest, fingerprint, receipt)
     return receipt
 
 
+def warm_up() -> dict:
+    """
+    Prepares everything the first extraction would otherwise wait for.
+
+    Steps:
+    1. Builds the structured-output model of every configured provider (and of the local tier).
+    2. Starts the pre-processing worker processes.
+
+    Returns:
+    - dict: The start-up timings, including this warm-up's duration.
+    """
+    started = time.perf_counter()
+    for model in chat_models.values():
+        model.get()
+    if model_cascade is not None:
+        model_cascade.local_model.get()
+
+    # Process pools only start their workers on demand, one short task each starts them all
+    if TILING_ENABLED or PREPROCESS_ENABLED:
+        for future in [_preprocess_executor.submit(os.getpid) for _ in range(PREPROCESS_WORKERS)]:
+            future.result()
+
+    STARTUP_TIMINGS["warm_up_seconds"] = round(time.perf_counter() - started, 6)
+    return STARTUP_TIMINGS
+
+
+STARTUP_TIMINGS["import_seconds"] = round(time.perf_counter() - _import_started, 6)
+
+
 # Sample execution for extracting receipt details from an image
 if __name__ == "__main__":      
     # Define the path to the sample receipt image
@@ -0,0 +1,329 @@
+"""
+File: receipt_store.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Persistent, queryable store of extracted receipts. Merchant, transaction and
+item rows are written to SQLite in batches by a background thread, so saving never slows
+down a request, and read back with filters on merchant, date and total using keyset
+pagination, which stays fast however deep a client pages.
+
+Usage:
+1. Create the store, e.g. `store = ReceiptStore("receipts.sqlite3")`.
+2. Call `store.add(receipt, image_id)` after every extraction (returns immediately).
+3. Read receipts back with `store.query(merchant="Corner Market", limit=100)` and pass
+   the returned `next_cursor` as `cursor` to get the next page.
+4. Call `store.close()` on shutdown to write the last batch.
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    id INTEGER PRIMARY KEY,
+    image_id TEXT NOT NULL UNIQUE,
+    merchant_name TEXT NOT NULL COLLATE NOCASE,
+    merchant_address TEXT NOT NULL,
+    date TEXT NOT NULL,
+    date_iso TEXT,
+    subtotal REAL NOT NULL,
+    tax REAL NOT NULL,
+    tip REAL,
+    discount REAL,
+    total REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS receipts_merchant ON receipts (merchant_name, id);
+CREATE INDEX IF NOT EXISTS receipts_total ON receipts (total, id);
+CREATE TABLE IF NOT EXISTS receipt_items (
+    receipt_id INTEGER NOT NULL REFERENCES receipts (id),
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    price REAL NOT NULL,
+    PRIMARY KEY (receipt_id, position)
+) WITHOUT ROWID;
+"""
+
+# Date formats tried, after ISO, to read the transaction date of a receipt
+_DATE_FORMATS = ("%m/%d/%Y", "%d/%m/%Y", "%m/%d/%y", "%d.%m.%Y", "%b %d, %Y", "%d %b %Y")
+
+_RECEIPT_COLUMNS = (
+    "id, image_id, merchant_name, merchant_address, date, subtotal, tax, tip, discount, total, created_at"
+)
+
+logger = logging.getLogger(__name__)
+
+
+def iso_date(date: Optional[str]) -> Optional[str]:
+    """
+    Normalizes a receipt date to `YYYY-MM-DD`, so dates written in different formats compare correctly.
+
+    Parameters:
+    - date (str | None): Date as extracted from the receipt, e.g. `2025-02-27`, `02/27/2025` or `27.02.2025`.
+
+    Returns:
+    - str | None: The ISO date, or None if it cannot be parsed.
+    """
+    text = (date or "").strip()
+    try:
+        return datetime.fromisoformat(text[:10]).date().isoformat()
+    except ValueError:
+        pass
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+class ReceiptStore:
+    """SQLite store of extracted receipts with batched background writes."""
+
+    def __init__(self, path: str, batch_size: int = 200, flush_seconds: float = 0.5):
+        """
+        Parameters:
+        - path (str): SQLite file holding the receipts.
+        - batch_size (int): Maximum number of receipts written in one transaction.
+        - flush_seconds (float): Longest a receipt waits before its batch is written.
+        """
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+
+        # Separate connections for the writer thread and for queries, so reads never
+        # wait for a batch being written (WAL mode lets them run side by side)
+        self._writer = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._writer.executescript(_SCHEMA)
+        self._migrate()
+        self._reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._read_lock = threading.Lock()
+
+        self._pending = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._write_loop, name="receipt-store", daemon=True)
+        self._thread.start()
+
+    def _migrate(self) -> None:
+        """Adds the normalized date column (and its index) to stores created before it existed."""
+        columns = {row[1] for row in self._writer.execute("PRAGMA table_info(receipts)")}
+        if "date_iso" not in columns:
+            self._writer.execute("ALTER TABLE receipts ADD COLUMN date_iso TEXT")
+            self._writer.create_function("iso_date", 1, iso_date, deterministic=True)
+            self._writer.execute("UPDATE receipts SET date_iso = iso_date(date)")
+        self._writer.execute("DROP INDEX IF EXISTS receipts_date")
+        self._writer.execute("CREATE INDEX IF NOT EXISTS receipts_date_iso ON receipts (date_iso, id)")
+
+    def add(self, receipt, image_id: str) -> None:
+        """
+        Queues a receipt to be saved. Saving the same image twice keeps the first copy.
+
+        Parameters:
+        - receipt (Receipt): The extracted receipt.
+        - image_id (str): Id of the receipt image, e.g. the SHA-256 of its bytes.
+        """
+        if not self._closed:
+            self._pending.put((receipt, image_id, time.time()))
+
+    def _write_loop(self) -> None:
+        """Writes queued receipts in batches until the store is closed."""
+        while True:
+            batch = [self._pending.get()]
+            if batch[0] is None:
+                return
+
+            # Collect more receipts until the batch is full or has waited long enough
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self._write_batch(batch)
+                    return
+                batch.append(entry)
+
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: list) -> None:
+        """Inserts a batch of receipts and their items in a single transaction."""
+        try:
+            self._insert(batch)
+        except Exception:
+            # Keep the writer alive, a failed batch must not stop later ones from being saved
+            logger.exception("Could not save a batch of %d receipts", len(batch))
+
+    def _insert(self, batch: list) -> None:
+        try:
+            self._writer.execute("BEGIN")
+            for receipt, image_id, created_at in batch:
+                merchant, transaction = receipt.merchant, receipt.transaction
+                cursor = self._writer.execute(
+                    "INSERT OR IGNORE INTO receipts "
+                    "(image_id, merchant_name, merchant_address, date, date_iso, subtotal, tax, tip, discount, "
+                    "total, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        image_id, merchant.name, merchant.address, transaction.date, iso_date(transaction.date),
+                        transaction.subtotal, transaction.tax, transaction.tip,
+                        transaction.discount, transaction.total, created_at,
+                    ),
+                )
+                if cursor.rowcount == 0:
+                    # Already stored
+                    continue
+                self._writer.executemany(
+                    "INSERT INTO receipt_items VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (cursor.lastrowid, position, item.name, item.quantity, item.price)
+                        for position, item in enumerate(receipt.items)
+                    ],
+                )
+            self._writer.execute("COMMIT")
+        except Exception:
+            self._writer.execute("ROLLBACK")
+            raise
+
+    def query(
+        self,
+        merchant: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        min_total: Optional[float] = None,
+        max_total: Optional[float] = None,
+        cursor: Optional[int] = None,
+        limit: int = 100,
+    ) -> dict:
+        """
+        Reads one page of stored receipts, newest first.
+
+        Parameters:
+        - merchant (str | None): Exact merchant name (case-insensitive).
+        - date_from (str | None): Earliest transaction date, e.g. `2025-01-31` (any format `iso_date` reads).
+        - date_to (str | None): Latest transaction date. Receipts whose date could not be
+          read are left out when either date is given.
+        - min_total (float | None): Smallest total.
+        - max_total (float | None): Largest total.
+        - cursor (int | None): `next_cursor` of the previous page; pages continue below this id.
+        - limit (int): Maximum number of receipts on the page.
+
+        Returns:
+        - dict: `receipts` (with their items) and the `next_cursor`, None on the last page.
+
+        Raises:
+        - ValueError: If `date_from` or `date_to` is not a readable date.
+        """
+        dates = {}
+        for name, value in (("date_from", date_from), ("date_to", date_to)):
+            dates[name] = None if value is None else iso_date(value)
+            if value is not None and dates[name] is None:
+                raise ValueError(f"{name} is not a valid date: {value}")
+
+        conditions, parameters = [], []
+        for condition, value in (
+            ("merchant_name = ?", merchant),
+            ("date_iso >= ?", dates["date_from"]),
+            ("date_iso <= ?", dates["date_to"]),
+            ("total >= ?", min_total),
+            ("total <= ?", max_total),
+            ("id < ?", cursor),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._read_lock:
+            rows = self._reader.execute(
+                f"SELECT {_RECEIPT_COLUMNS} FROM receipts {where} ORDER BY id DESC LIMIT ?",
+                (*parameters, limit),
+            ).fetchall()
+            items = self._items_of([row[0] for row in rows])
+
+        receipts = [self._to_dict(row, items.get(row[0], [])) for row in rows]
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return {"receipts": receipts, "next_cursor": next_cursor}
+
+    def since(self, after_id: int = 0, limit: int = 1000) -> list:
+        """
+        Reads receipts saved after a given id, oldest first, e.g. to feed them to analytics.
+
+        Parameters:
+        - after_id (int): Id of the last receipt already seen.
+        - limit (int): Maximum number of receipts returned.
+
+        Returns:
+        - list: Receipts with their items, in id order.
+        """
+        with self._read_lock:
+            rows = self._reader.execute(
+                f"SELECT {_RECEIPT_COLUMNS} FROM receipts WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit),
+            ).fetchall()
+            items = self._items_of([row[0] for row in rows])
+        return [self._to_dict(row, items.get(row[0], [])) for row in rows]
+
+    def get(self, receipt_id: int) -> Optional[dict]:
+        """
+        Reads one stored receipt.
+
+        Returns:
+        - dict | None: The receipt with its items, or None if unknown.
+        """
+        with self._read_lock:
+            row = self._reader.execute(
+                f"SELECT {_RECEIPT_COLUMNS} FROM receipts WHERE id = ?", (receipt_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            items = self._items_of([receipt_id])
+        return self._to_dict(row, items.get(receipt_id, []))
+
+    def _items_of(self, receipt_ids: list) -> dict:
+        """Loads the items of a page of receipts in one query: receipt id -> list of items."""
+        items = {}
+        if not receipt_ids:
+            return items
+        placeholders = ",".join("?" * len(receipt_ids))
+        for receipt_id, name, quantity, price in self._reader.execute(
+            f"SELECT receipt_id, name, quantity, price FROM receipt_items "
+            f"WHERE receipt_id IN ({placeholders}) ORDER BY receipt_id, position",
+            receipt_ids,
+        ):
+            items.setdefault(receipt_id, []).append({"name": name, "quantity": quantity, "price": price})
+        return items
+
+    @staticmethod
+    def _to_dict(row: tuple, items: list) -> dict:
+        """Rebuilds the `Receipt` layout from a stored row."""
+        (receipt_id, image_id, merchant_name, merchant_address, date,
+         subtotal, tax, tip, discount, total, created_at) = row
+        return {
+            "id": receipt_id,
+            "image_id": image_id,
+            "created_at": created_at,
+            "merchant": {"name": merchant_name, "address": merchant_address},
+            "transaction": {
+                "date": date,
+                "subtotal": subtotal,
+                "tax": tax,
+                "tip": tip,
+                "discount": discount,
+                "total": total,
+            },
+            "items": items,
+        }
+
+    def close(self) -> None:
+        """Writes the receipts still queued and stops the writer thread."""
+        if not self._closed:
+            self._closed = True
+            self._pending.put(None)
+            self._thread.join()
@@ -0,0 +1,144 @@
+"""
+File: scaling_benchmark.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Measures how throughput scales with the number of API worker processes.
+For every worker count it starts `serve.py` with the offline fake model, runs the same
+load as `benchmark.py` against it and stops it again, then prints throughput, latency and
+speed-up over a single worker.
+
+Usage:
+1. Run `python3 scaling_benchmark.py --workers 1,2,4 --requests 400 --concurrency 64`.
+2. Keep the fake model fast (`--fake-latency`, default 0.05s) so the server's own CPU work
+   (upload parsing, pre-processing, encoding) is what the extra workers have to absorb.
+3. Add `--json scaling.json` to save the results.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmark import make_receipt_image, offline_environment, parse_size_mix, percentile, run_load
+
+
+def free_port() -> int:
+    """Returns a TCP port nobody listens on right now."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 120) -> None:
+    """Waits until the server answers (the warm-up runs before it accepts requests)."""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url, timeout=2) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                if (await client.get("/startup_stats")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError("Server did not start in time")
+
+
+async def measure(workers: int, args, images: dict, mix: list) -> dict:
+    """
+    Starts `serve.py` with the given number of workers, runs the load and stops it.
+
+    Returns:
+    - dict: Worker count, throughput and latency percentiles.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    port = free_port()
+    environment = {**os.environ, **offline_environment(args, tempfile.mkdtemp(prefix="receipt-scaling-"))}
+    process = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port), "--log-level", "warning"],
+        cwd=here,
+        env=environment,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}"
+        await wait_until_ready(url, process)
+        async with httpx.AsyncClient(base_url=url, timeout=httpx.Timeout(args.timeout)) as client:
+            results, elapsed = await run_load(client, args, images, mix)
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies = [result["latency"] for result in results if result["ok"]]
+    return {
+        "workers": workers,
+        "ok": len(latencies),
+        "failed": len(results) - len(latencies),
+        "throughput_per_second": len(latencies) / elapsed,
+        "p50_seconds": percentile(latencies, 0.5) if latencies else None,
+        "p95_seconds": percentile(latencies, 0.95) if latencies else None,
+    }
+
+
+async def main_async(args) -> list:
+    mix = parse_size_mix(args.sizes)
+
+    # Same images for every worker count, generated once
+    images = {
+        label: [make_receipt_image(width, height, seed) for seed in range(args.variants)]
+        for label, (width, height), _ in mix
+    }
+
+    rows = []
+    for workers in [int(count) for count in args.workers.split(",")]:
+        rows.append(await measure(workers, args, images, mix))
+        row = rows[-1]
+        speedup = row["throughput_per_second"] / rows[0]["throughput_per_second"] if rows[0]["ok"] else 0
+        p50 = f"{row['p50_seconds']:.3f}s" if row["p50_seconds"] is not None else "-"
+        p95 = f"{row['p95_seconds']:.3f}s" if row["p95_seconds"] is not None else "-"
+        row["speedup"] = speedup
+        print(
+            f"{workers:>3} worker(s): {row['throughput_per_second']:8.2f} receipts/s  "
+            f"p50 {p50}  p95 {p95}  x{speedup:.2f}  ({row['failed']} failed)"
+        )
+    return rows
+
+
+def main():
+    """
+    Parses the command line, runs the benchmark for every worker count and prints (or saves) the results.
+    """
+    cores = os.cpu_count() or 1
+    default_workers = ",".join(str(count) for count in sorted({1, 2, 4, cores}) if count <= cores)
+
+    parser = argparse.ArgumentParser(description="Benchmark throughput from 1 to N API worker processes.")
+    parser.add_argument("--workers", default=default_workers, help="Comma-separated worker counts")
+    parser.add_argument("--endpoint", default="/upload_receipt", help="Endpoint receiving the uploads")
+    parser.add_argument("--requests", type=int, default=400, help="Requests per worker count")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight")
+    parser.add_argument("--rate", type=float, default=0, help="Requests per second (0 = as fast as possible)")
+    parser.add_argument("--sizes", default="1536x2048:1", help="Image-size mix, WIDTHxHEIGHT:WEIGHT")
+    parser.add_argument("--variants", type=int, default=4, help="Distinct images generated per size")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--fake-latency", type=float, default=0.05, help="Fake model mean latency in seconds")
+    parser.add_argument("--fake-jitter", type=float, default=0.01, help="Fake model latency jitter in seconds")
+    parser.add_argument("--fake-failure-rate", type=float, default=0.0, help="Fraction of fake model calls that fail")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the request mix and the fake model")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    rows = asyncio.run(main_async(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+File: serve.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Production launcher for the receipt API. Starts several uvicorn worker
+processes (one per CPU core by default) that share the result cache, receipt store, job
+queue, rate-limit buckets and metrics through SQLite files in WAL mode, so adding
+workers adds throughput without splitting the provider quotas or the job state.
+
+Usage:
+1. Run `python3 serve.py --workers 0 --port 1234` from the `chapter_3` folder
+   (`--workers 0` starts one worker per CPU core).
+2. Use the API as usual, e.g. `http://localhost:1234/static/index.html`.
+"""
+
+import argparse
+import os
+import sys
+
+
+def prepare_shared_state(workers: int) -> None:
+    """
+    Runs the one-time start-up steps before the workers start: requeues the jobs the previous
+    run left unfinished and clears its shared rate-limit buckets and metric samples.
+
+    Parameters:
+    - workers (int): Number of worker processes about to start.
+    """
+    # Settings are read when `config` is first imported, after the environment is set
+    from config import JOB_DB_PATH, JOB_MAX_QUEUE_DEPTH, JOB_MAX_QUEUED_BYTES, SHARED_STATE_PATH
+    from job_queue import JobQueue
+    from shared_state import SharedState
+
+    interrupted = JobQueue(
+        JOB_DB_PATH, max_depth=JOB_MAX_QUEUE_DEPTH, max_queued_bytes=JOB_MAX_QUEUED_BYTES
+    ).recover()
+    if workers > 1:
+        SharedState(SHARED_STATE_PATH).reset()
+    print(f"Starting {workers} worker(s), {len(interrupted)} job(s) waiting")
+
+
+def main():
+    """
+    Parses the command line, sizes the worker pools and starts uvicorn.
+    """
+    parser = argparse.ArgumentParser(description="Run the receipt API with several worker processes.")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=1234, help="Port to listen on")
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("RECEIPT_WORKERS", "0")),
+        help="Worker processes (0 = one per CPU core)",
+    )
+    parser.add_argument("--log-level", default="info", help="uvicorn log level")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(here)
+    sys.path.insert(0, here)
+
+    cores = os.cpu_count() or 1
+    workers = args.workers or cores
+    os.environ["RECEIPT_WORKERS"] = str(workers)
+
+    # Split the image pre-processing processes between the workers instead of starting
+    # a full set per worker (unless set explicitly)
+    os.environ.setdefault("RECEIPT_PREPROCESS_WORKERS", str(max(1, cores // workers)))
+
+    prepare_shared_state(workers)
+
+    import uvicorn
+
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=workers, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
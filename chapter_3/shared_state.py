@@ -0,0 +1,197 @@
+"""
+File: shared_state.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: State shared by the worker processes of a multi-worker deployment (see
+`serve.py`), kept in one SQLite file in WAL mode. It holds the providers' rate-limit
+buckets and pauses, so all workers draw from a single quota, and every worker's metric
+samples, so `/metrics` on any worker reports totals for the whole server.
+
+Usage:
+1. Create the state in every worker, e.g. `state = SharedState("receipt_shared_state.sqlite3")`.
+2. Pass it to `AdmissionController(..., shared_state=state)` and `registry.share(state, worker)`.
+3. Call `state.reset()` once before the workers start, to drop the previous run's samples.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    level REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pauses (
+    key TEXT PRIMARY KEY,
+    until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metric_samples (
+    worker TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    samples TEXT NOT NULL,
+    PRIMARY KEY (worker, metric)
+);
+"""
+
+
+class SharedState:
+    """SQLite-backed state shared by the API worker processes."""
+
+    def __init__(self, path: str):
+        """
+        Parameters:
+        - path (str): SQLite file holding the shared state.
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs a read-modify-write under SQLite's write lock, so no other worker can change
+        the same rows in between.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def reset(self) -> None:
+        """Clears the buckets, pauses and metric samples left by a previous run."""
+        with self.transaction() as db:
+            for table in ("buckets", "pauses", "metric_samples"):
+                db.execute(f"DELETE FROM {table}")
+
+    def pause(self, key: str, until: float) -> None:
+        """Extends a pause (wall-clock time) unless it already lasts longer."""
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO pauses VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET until = MAX(until, excluded.until)",
+                (key, until),
+            )
+
+    def paused_until(self, key: str) -> float:
+        """Returns the wall-clock time a pause ends, 0 if there is none."""
+        with self._lock:
+            row = self._db.execute("SELECT until FROM pauses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0.0
+
+    @staticmethod
+    def _bucket_level(db, key: str, per_minute: float, now: float) -> float:
+        """Reads a bucket's level, refilled up to `now` (not stored)."""
+        level, updated = db.execute("SELECT level, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        return min(per_minute, level + max(0.0, now - updated) * per_minute / 60)
+
+    def bucket_level(self, key: str, per_minute: float) -> float:
+        """Returns a bucket's current level without writing to the database."""
+        with self._lock:
+            return self._bucket_level(self._db, key, per_minute, time.time())
+
+    def take_if_available(self, pause_key: str, amounts: list) -> float:
+        """
+        Takes quota out of several buckets if all of them hold enough and the pause is over,
+        checking and taking in one transaction so two workers cannot both take the last of it.
+
+        Parameters:
+        - pause_key (str): Pause to respect (see `pause`).
+        - amounts (list): (bucket key, per-minute quota, amount to take) of every bucket.
+
+        Returns:
+        - float: 0.0 if the quota was taken, otherwise the seconds until it is available.
+        """
+        with self.transaction() as db:
+            now = time.time()
+            row = db.execute("SELECT until FROM pauses WHERE key = ?", (pause_key,)).fetchone()
+            wait = max(0.0, row[0] - now) if row else 0.0
+            levels = []
+            for key, per_minute, amount in amounts:
+                level = self._bucket_level(db, key, per_minute, now)
+                wait = max(wait, (min(amount, per_minute) - level) / (per_minute / 60))
+                levels.append((level - amount, now, key))
+            if wait <= 0:
+                db.executemany("UPDATE buckets SET level = ?, updated = ? WHERE key = ?", levels)
+        return wait
+
+    def publish_metrics(self, worker: str, samples: dict) -> None:
+        """Stores a worker's current metric samples (metric name -> JSON-serializable samples)."""
+        with self.transaction() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO metric_samples VALUES (?, ?, ?)",
+                [(worker, metric, json.dumps(values)) for metric, values in samples.items()],
+            )
+
+    def metric_samples(self) -> list:
+        """
+        Returns the metric samples of every worker.
+
+        Returns:
+        - list: (worker, metric name, samples) tuples.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT worker, metric, samples FROM metric_samples").fetchall()
+        return [(worker, metric, json.loads(samples)) for worker, metric, samples in rows]
+
+
+class SharedTokenBucket:
+    """
+    `TokenBucket` (see `rate_limiter.py`) whose level lives in the shared state, so every
+    worker draws from the same quota. Times are wall-clock, the `now` arguments of the
+    in-process bucket (monotonic, per process) are ignored.
+    """
+
+    def __init__(self, state: SharedState, key: str, per_minute: float):
+        """
+        Parameters:
+        - state (SharedState): The shared state.
+        - key (str): Name of the bucket, e.g. `openai:tokens`.
+        - per_minute (float): Quota refilled every minute, also the bucket's capacity.
+        """
+        self.state = state
+        self.key = key
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        with state.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO buckets VALUES (?, ?, ?)", (key, per_minute, time.time()))
+
+    def _update(self, change) -> float:
+        """Refills the bucket, applies `change` to its level and returns the new level."""
+        with self.state.transaction() as db:
+            level, updated = db.execute(
+                "SELECT level, updated FROM buckets WHERE key = ?", (self.key,)
+            ).fetchone()
+            now = time.time()
+            level = change(min(self.capacity, level + max(0.0, now - updated) * self.rate))
+            db.execute("UPDATE buckets SET level = ?, updated = ? WHERE key = ?", (level, now, self.key))
+        return level
+
+    @property
+    def level(self) -> float:
+        return self.state.bucket_level(self.key, self.capacity)
+
+    def _refill(self, now: float) -> None:
+        # Refilled on every read of `level` and every write
+        pass
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Returns the seconds until `amount` is available (capped at the capacity)."""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float, now: float) -> None:
+        """Takes `amount` out of the bucket, which may go negative (reserving future quota)."""
+        self._update(lambda level: level - amount)
+
+    def give_back(self, amount: float) -> None:
+        """Returns unused quota, e.g. when a call used fewer tokens than estimated."""
+        self._update(lambda level: min(self.capacity, level + amount))
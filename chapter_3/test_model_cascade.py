@@ -0,0 +1,165 @@
+"""
+File: test_model_cascade.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Tests the local-model cascade against the stand-in Ollama server of
+`fake_ollama.py`: the local answer is kept when it is consistent, the call escalates
+to the cloud tier when the local answer is inconsistent, not JSON or an error, the
+local tier is skipped while its slots are busy, and `stats()` counts every outcome.
+
+Usage:
+1. Install the requirements (the tests are skipped without `langchain-ollama`).
+2. Run `python -m pytest test_model_cascade.py` from the `chapter_3` folder.
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain_ollama")
+
+from langchain_ollama import ChatOllama
+
+from fake_model import SAMPLE_RECEIPT
+from fake_ollama import FakeOllamaServer
+from model_cascade import ModelCascade
+from receipt_checks import receipt_problems
+
+# JSON schema the local model is asked to follow (the stand-in answers with `SAMPLE_RECEIPT`)
+RECEIPT_SCHEMA = {
+    "title": "Receipt",
+    "description": "Structured data extracted from a receipt image.",
+    "type": "object",
+    "properties": {
+        "merchant": {"type": "object"},
+        "transaction": {"type": "object"},
+        "items": {"type": "array", "items": {"type": "object"}},
+    },
+    "required": ["merchant", "transaction", "items"],
+}
+
+# Output of the cloud tier, to tell which tier answered
+CLOUD_OUTPUT = {"raw": None, "parsed": "cloud", "parsing_error": None}
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = FakeOllamaServer(port=0, latency=0.0).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(autouse=True)
+def reset_server(server):
+    # Every test sets the outcome it needs; a rate of 1 makes it certain
+    server.latency = 0.0
+    server.inconsistent_rate = server.failure_rate = server.invalid_rate = 0.0
+
+
+def make_cascade(server: FakeOllamaServer, max_concurrency: int = 2) -> ModelCascade:
+    """Builds the cascade the way the receipt processor does, with the stand-in as local tier."""
+    local_model = ChatOllama(model=server.model, base_url=server.url, temperature=0).with_structured_output(
+        RECEIPT_SCHEMA, method="json_schema", include_raw=True
+    )
+    return ModelCascade(local_model, check=receipt_problems, name="ollama", max_concurrency=max_concurrency)
+
+
+class CloudTier:
+    """Counts the calls that escalated to the cloud tier."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return CLOUD_OUTPUT
+
+    async def acall(self):
+        return self()
+
+
+def test_consistent_answer_is_kept(server):
+    cascade, cloud, details = make_cascade(server), CloudTier(), {}
+
+    output = cascade.invoke(["Extract the receipt."], cloud, details)
+
+    assert output["parsed"] == SAMPLE_RECEIPT
+    assert cloud.calls == 0
+    assert details["tier"] == "local"
+    assert details["provider"] == "ollama"
+    assert "escalation_reason" not in details
+
+
+@pytest.mark.parametrize(
+    "setting, reason",
+    [("inconsistent_rate", "inconsistent"), ("invalid_rate", "invalid"), ("failure_rate", "error")],
+)
+def test_rejected_answer_escalates(server, setting, reason):
+    setattr(server, setting, 1.0)
+    cascade, cloud, details = make_cascade(server), CloudTier(), {}
+
+    output = cascade.invoke(["Extract the receipt."], cloud, details)
+
+    assert output is CLOUD_OUTPUT
+    assert cloud.calls == 1
+    assert details["tier"] == "cloud"
+    assert details["escalation_reason"] == reason
+
+
+def test_async_rejected_answer_escalates(server):
+    server.inconsistent_rate = 1.0
+    cascade, cloud, details = make_cascade(server), CloudTier(), {}
+
+    output = asyncio.run(cascade.ainvoke(["Extract the receipt."], cloud.acall, details))
+
+    assert output is CLOUD_OUTPUT
+    assert details["escalation_reason"] == "inconsistent"
+
+
+def test_busy_local_tier_is_skipped(server):
+    server.latency = 0.3
+    cascade, cloud = make_cascade(server, max_concurrency=1), CloudTier()
+    first, second = {}, {}
+
+    async def run_both():
+        return await asyncio.gather(
+            cascade.ainvoke(["Extract the receipt."], cloud.acall, first),
+            cascade.ainvoke(["Extract the receipt."], cloud.acall, second),
+        )
+
+    local_output, cloud_output = asyncio.run(run_both())
+
+    assert local_output["parsed"] == SAMPLE_RECEIPT
+    assert cloud_output is CLOUD_OUTPUT
+    assert first["tier"] == "local"
+    assert second["escalation_reason"] == "busy"
+    assert cloud.calls == 1
+
+
+def test_stats_count_every_outcome(server):
+    cascade, cloud = make_cascade(server, max_concurrency=1), CloudTier()
+    for setting in (None, "inconsistent_rate", "invalid_rate", "failure_rate"):
+        server.inconsistent_rate = server.failure_rate = server.invalid_rate = 0.0
+        if setting:
+            setattr(server, setting, 1.0)
+        cascade.invoke(["Extract the receipt."], cloud)
+
+    # A call arriving while the only slot is taken skips the local tier
+    cascade._slots.acquire()
+    try:
+        cascade.invoke(["Extract the receipt."], cloud)
+    finally:
+        cascade._slots.release()
+
+    stats = cascade.stats()
+    assert stats["calls"] == 5
+    assert stats["local_attempts"] == 4
+    assert stats["local_accepted"] == 1
+    assert stats["local_inconsistent"] == 1
+    assert stats["local_invalid"] == 1
+    assert stats["local_errors"] == 1
+    assert stats["local_busy"] == 1
+    assert stats["cloud_calls"] == 4 == cloud.calls
+    assert stats["local_hit_rate"] == pytest.approx(0.2)
+    assert stats["local_p50_seconds"] is not None
+    assert stats["cloud_p50_seconds"] is not None
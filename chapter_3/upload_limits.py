@@ -0,0 +1,208 @@
+"""
+File: upload_limits.py
+Author: Sina Mehdinia
+Date: 10/18/2026
+Description: Memory-conscious upload handling for the receipt API. Uploads are read in
+chunks into a single buffer with a size cap, hashed while they are read, and admitted
+through a per-worker budget of in-flight bytes so a burst of large photos waits instead
+of spiking memory.
+
+Usage:
+1. Add `MaxUploadSizeMiddleware` to reject oversized requests before their whole body is received.
+2. Reserve memory with `size = await upload_budget.acquire(expected_bytes, timeout)`.
+3. Read the file with `image, digest = await read_upload(file, max_bytes)`.
+4. Give the memory back with `await upload_budget.release(size)` once processing is done.
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Optional
+
+# Allowance for the multipart boundaries and headers around the uploaded file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the maximum allowed size."""
+
+
+class UploadBudgetTimeoutError(Exception):
+    """Raised when an upload waited too long for room in the in-flight bytes budget."""
+
+
+class ByteBudget:
+    """Async budget of bytes held in memory by uploads that are being processed."""
+
+    def __init__(self, max_bytes: int):
+        """
+        Parameters:
+        - max_bytes (int): Total upload bytes allowed in flight at once.
+        """
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size: int, timeout: Optional[float] = None) -> int:
+        """
+        Waits until `size` bytes fit in the budget, then reserves them.
+
+        Parameters:
+        - size (int): Bytes to reserve. A single upload larger than the whole budget
+          reserves the whole budget, so it can still run on its own.
+        - timeout (float | None): Maximum seconds to wait.
+
+        Returns:
+        - int: The number of bytes reserved, to pass to `release`.
+
+        Raises:
+        - UploadBudgetTimeoutError: If the bytes did not fit within the timeout.
+        """
+        size = min(size, self.max_bytes)
+        async with self._condition:
+            try:
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self.in_use + size <= self.max_bytes), timeout
+                )
+            except asyncio.TimeoutError:
+                raise UploadBudgetTimeoutError(
+                    f"Server is busy ({self.in_use} upload bytes in flight), please retry later"
+                )
+            self.in_use += size
+        return size
+
+    async def release(self, size: int) -> None:
+        """Returns reserved bytes to the budget and wakes up waiting uploads."""
+        async with self._condition:
+            self.in_use -= size
+            self._condition.notify_all()
+
+
+class _BodyTooLargeError(Exception):
+    """Raised inside `MaxUploadSizeMiddleware` once a request body crosses the limit."""
+
+
+class MaxUploadSizeMiddleware:
+    """
+    ASGI middleware answering 413 as soon as an upload is known to be too large: right
+    away when the request's `Content-Length` says so, and otherwise (e.g. a chunked upload)
+    as soon as the body received so far crosses the limit, before the rest is spooled.
+    """
+
+    def __init__(self, app, max_bytes: int, paths: tuple):
+        """
+        Parameters:
+        - app: The wrapped ASGI application.
+        - max_bytes (int): Maximum allowed size of the uploaded file.
+        - paths (tuple): Request paths the limit applies to.
+        """
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+
+    @staticmethod
+    async def _error(send, status: int, message: str) -> None:
+        """Sends a JSON error response and closes the connection."""
+        body = json.dumps({"error": message}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.max_bytes + MULTIPART_OVERHEAD_BYTES
+        too_large = f"Upload exceeds the maximum size of {self.max_bytes} bytes"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length:
+            try:
+                announced = int(content_length)
+            except ValueError:
+                await self._error(send, 400, "Invalid Content-Length header")
+                return
+            if announced > limit:
+                await self._error(send, 413, too_large)
+                return
+
+        # Count the body as it arrives, for requests without a (truthful) Content-Length
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _BodyTooLargeError()
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except _BodyTooLargeError:
+            if response_started:
+                raise
+            await self._error(send, 413, too_large)
+
+
+def check_upload_size(file, max_bytes: int) -> None:
+    """
+    Rejects an upload whose announced size is already over the limit.
+
+    Raises:
+    - UploadTooLargeError: If the file is larger than `max_bytes`.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLargeError(f"Upload exceeds the maximum size of {max_bytes} bytes")
+
+
+async def read_upload(file, max_bytes: int, chunk_size: int = 1024 * 1024) -> tuple:
+    """
+    Reads an uploaded file in chunks into a single buffer, hashing it along the way.
+
+    Parameters:
+    - file (UploadFile): The uploaded file.
+    - max_bytes (int): Maximum allowed size; larger uploads are rejected as soon as detected.
+    - chunk_size (int): Bytes read per chunk.
+
+    Returns:
+    - tuple: (bytearray with the file content, SHA-256 hex digest of the content).
+
+    Raises:
+    - UploadTooLargeError: If the file is larger than `max_bytes`.
+    """
+    check_upload_size(file, max_bytes)
+
+    # Allocate the whole buffer once when the size is known, so it never has to grow
+    hasher = hashlib.sha256()
+    buffer = bytearray(file.size or 0)
+    position = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        end = position + len(chunk)
+        if end > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the maximum size of {max_bytes} bytes")
+        hasher.update(chunk)
+        buffer[position:end] = chunk
+        position = end
+
+    # Trim if the file turned out shorter than announced
+    del buffer[position:]
+    return buffer, hasher.hexdigest()